@@ -1,8 +1,9 @@
 from fastapi import APIRouter, Request, HTTPException, Query, Depends,Form
-from fastapi.responses import HTMLResponse, RedirectResponse
+from fastapi.responses import FileResponse, HTMLResponse, RedirectResponse, Response
 from fastapi.templating import Jinja2Templates
 
-import pandas as pd
+import os
+import asyncio
 from passlib.context import CryptContext
 import aiofiles
 from pathlib import Path
@@ -15,14 +16,18 @@ from ..models.db_update_state import DBUpdateState
 
 # Initialize router
 from ..models.strading_state import *
-from ..database import get_db_connection
-from ..services.cache import get_cache_timestamp
+from ..services.cache import cache_stats, data_version, publish_data_version
+from ..services.chart_cache import CHART_FORMATS, chart_cache, stock_chart, stock_chart_key
+from ..services.series import SERIES_FORMATS, TIMEFRAMES, FormatUnavailable, encode_series
+from ..services.warmup import record_view
+from ..services.db_executor import run_db, QueryTimeout
 from ..services.stock import (
     get_top_gainers_data,
     get_stock_data,
     get_database_stats,
     get_data_summary,
-    get_filtered_stocks
+    get_filtered_stocks,
+    get_volume_gainers_data
 )
 
 # Initialize router
@@ -54,8 +59,7 @@ templates = Jinja2Templates(directory="templates")
 async def index(request: Request,auth: bool = Depends(require_auth)):
     """Show all available stock data"""
     try:
-        cache_timestamp = get_cache_timestamp()
-        stats = get_database_stats(cache_timestamp)
+        stats = await run_db(get_database_stats)
         return templates.TemplateResponse(
             "index.html",
             {
@@ -65,6 +69,8 @@ async def index(request: Request,auth: bool = Depends(require_auth)):
                 "database_size": stats['database_size']
             }
         )
+    except QueryTimeout as e:
+        raise HTTPException(status_code=503, detail=str(e))
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
@@ -72,12 +78,13 @@ async def index(request: Request,auth: bool = Depends(require_auth)):
 async def top_gainers(request: Request):
     """Show top 20 stocks by percentage increase from last week"""
     try:
-        cache_timestamp = get_cache_timestamp()
-        result_dict = get_top_gainers_data(cache_timestamp)
+        result_dict = await run_db(get_top_gainers_data)
         return templates.TemplateResponse(
             "top_gainers.html",
             {"request": request, "top_stocks": result_dict}
         )
+    except QueryTimeout as e:
+        raise HTTPException(status_code=503, detail=str(e))
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
@@ -92,8 +99,8 @@ async def stock(symbol: str):
 async def stock_detail(request: Request, symbol: str, auth: bool = Depends(require_auth)):
     """Show detailed stock data"""
     try:
-        cache_timestamp = get_cache_timestamp()
-        plot_data = get_stock_data(symbol, cache_timestamp)
+        plot_data = await run_db(get_stock_data, symbol)
+        record_view(symbol)
         
         return templates.TemplateResponse(
             "stock_detail_wrapper.html",
@@ -114,7 +121,7 @@ async def stock_detail(request: Request, symbol: str, auth: bool = Depends(requi
                 "request": request,
                 "error_message": f"Error loading stock data for {symbol}: {str(e)}"
             },
-            status_code=500
+            status_code=503 if isinstance(e, QueryTimeout) else 500
         )
 
 @router.get("/api/filtered_stocks")
@@ -128,11 +135,79 @@ async def filtered_stocks(
 ):
     """API endpoint for filtered stocks"""
     try:
-        results = get_filtered_stocks(limit, min_price, min_volume, min_price_change, sort_by, sort_order)
+        results = await run_db(get_filtered_stocks, limit, min_price, min_volume, min_price_change, sort_by, sort_order)
         return {"success": True, "data": results}
+    except QueryTimeout as e:
+        raise HTTPException(status_code=503, detail=str(e))
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
+@router.get("/api/stock/{symbol}/series")
+async def stock_series(
+    request: Request,
+    symbol: str,
+    timeframe: str = Query("all", pattern="^(all|daily|weekly)$"),
+    format: str = Query("json", pattern="^(json|arrow)$")
+):
+    """
+    Columnar price/indicator series of a stock (the /stockdetail data).
+
+    The ETag is the data version, so clients revalidate with If-None-Match
+    and get a 304 without any query until the next ingest.
+    """
+    timeframes = TIMEFRAMES if timeframe == "all" else (timeframe,)
+    if format == "arrow" and len(timeframes) != 1:
+        raise HTTPException(status_code=400, detail="format=arrow needs timeframe=daily or timeframe=weekly")
+
+    etag = f'"{data_version()}-{symbol}-{timeframe}-{format}"'
+    headers = {"ETag": etag, "Cache-Control": "no-cache"}
+    if etag in request.headers.get("if-none-match", ""):
+        return Response(status_code=304, headers=headers)
+
+    try:
+        body = await run_db(encode_series, symbol, timeframes, format)
+    except QueryTimeout as e:
+        raise HTTPException(status_code=503, detail=str(e))
+    except FormatUnavailable as e:
+        raise HTTPException(status_code=406, detail=str(e))
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+    if body is None:
+        raise HTTPException(status_code=404, detail=f"No data for {symbol}")
+    return Response(content=body, media_type=SERIES_FORMATS[format], headers=headers)
+
+@router.get("/api/stock/{symbol}/chart")
+async def stock_chart_image(
+    request: Request,
+    symbol: str,
+    format: str = Query("png", pattern="^(png|webp)$")
+):
+    """
+    Daily/weekly chart image of a stock, served from the chart cache.
+
+    The image is rendered only when none exists for the symbol's last bar
+    (and these parameters); the ETag is its cache key, so clients
+    revalidate with If-None-Match and get a 304 until the next bar.
+    """
+    try:
+        key = await run_db(stock_chart_key, symbol, format)
+    except QueryTimeout as e:
+        raise HTTPException(status_code=503, detail=str(e))
+    if key is None:
+        raise HTTPException(status_code=404, detail=f"No data for {symbol}")
+
+    etag = f'"{key}"'
+    headers = {"ETag": etag, "Cache-Control": "no-cache"}
+    if etag in request.headers.get("if-none-match", ""):
+        return Response(status_code=304, headers=headers)
+
+    try:
+        # Not on the database pool: a miss holds its thread for the whole render
+        path = await asyncio.to_thread(stock_chart, symbol, key)
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Error rendering chart for {symbol}: {str(e)}")
+    return FileResponse(path, media_type=CHART_FORMATS[format], headers=headers)
+
 @router.get("/stockfilter", response_class=HTMLResponse)
 async def stockfilter(request: Request):
     """Render stock filter page"""
@@ -148,17 +223,25 @@ async def stockfilter(request: Request):
 
 @router.get("/clear_cache")
 async def clear_cache():
-    """Clear the LRU cache"""
-    get_stock_data.cache_clear()
+    """Invalidate the caches of every worker (by publishing a new data version)"""
+    publish_data_version()
     return {"message": "Cache cleared"}
 
+@router.get("/cache_stats")
+async def cache_statistics():
+    """Hit/miss counters of this worker's caches"""
+    return {"pid": os.getpid(), "caches": cache_stats(), "charts": chart_cache.info()}
+
 
 
 # Additional FastAPI routes
 @router.get("/summary", response_class=HTMLResponse)
 async def summary(request: Request):
     """Show data summary"""
-    counts = get_data_summary()
+    try:
+        counts = await run_db(get_data_summary)
+    except QueryTimeout as e:
+        raise HTTPException(status_code=503, detail=str(e))
     return templates.TemplateResponse(
         "summary.html",
         {"request": request, "counts": counts}
@@ -167,124 +250,20 @@ async def summary(request: Request):
 @router.get("/volume-gainers", response_class=HTMLResponse)
 async def volume_gainers(request: Request):
     """Show top 20 stocks by volume increase"""
-    conn = get_db_connection()
     try:
-        # Get the latest date that's a Monday
-        date_query = """
-        SELECT MAX(date) 
-        FROM stock_prices 
-        WHERE timeframe = 'weekly' AND symbol='AAPL'
-        """
-        latest_date = pd.read_sql_query(date_query, conn).iloc[0, 0]
-        
-        # Get the previous week's Monday
-        prev_date = pd.read_sql_query(
-            """
-            SELECT MAX(date) 
-            FROM stock_prices 
-            WHERE timeframe = 'weekly' AND symbol='AAPL'
-            AND date < ?
-            """,
-            conn,
-            params=(latest_date,)
-        ).iloc[0, 0]
-
-        volume_query = """
-        WITH CurrentWeek AS (
-            SELECT symbol, volume, open, close
-            FROM stock_prices
-            WHERE timeframe = 'weekly' 
-            AND date = ?
-        ),
-        PrevWeek AS (
-            SELECT symbol, volume as prev_volume
-            FROM stock_prices
-            WHERE timeframe = 'weekly' 
-            AND date = ?
-        )
-        SELECT 
-            c.symbol,
-            c.open as current_open,
-            c.close as current_close,
-            c.volume as current_volume,
-            p.prev_volume,
-            ROUND(((c.volume - p.prev_volume) * 100.0 / p.prev_volume), 2) as volume_change
-        FROM CurrentWeek c
-        JOIN PrevWeek p ON c.symbol = p.symbol
-        WHERE p.prev_volume > 0
-        ORDER BY volume_change DESC
-        LIMIT 20
-        """
-        
-        df = pd.read_sql_query(
-            volume_query,
-            conn,
-            params=(latest_date, prev_date),
-            coerce_float=True
-        )
-        
-        df['current_volume'] = df['current_volume'].astype(int)
-        df['prev_volume'] = df['prev_volume'].astype(int)
-        
+        top_stocks = await run_db(get_volume_gainers_data)
         return templates.TemplateResponse(
             "volume_gainers.html",
-            {"request": request, "top_stocks": df.to_dict('records')}
+            {"request": request, "top_stocks": top_stocks}
         )
         
+    except QueryTimeout as e:
+        raise HTTPException(status_code=503, detail=str(e))
     except Exception as e:
         print(f"Error processing data: {str(e)}")
         import traceback
         traceback.print_exc()
         raise HTTPException(status_code=500, detail=str(e))
-    
-    finally:
-        conn.close()
-
-@router.get("/stock/{symbol}")
-async def stock_data(request: Request, symbol: str):
-    """Show data for a specific stock"""
-    conn = get_db_connection()
-    
-    # Get summary counts
-    total_records = pd.read_sql_query(
-        "SELECT COUNT(*) as count FROM stock_prices",
-        conn
-    ).iloc[0]['count']
-    
-    total_stocks = pd.read_sql_query(
-        "SELECT COUNT(DISTINCT symbol) as count FROM stock_prices",
-        conn
-    ).iloc[0]['count']
-    
-    # Get data for specific stock
-    daily_data = pd.read_sql_query(
-        "SELECT * FROM stock_prices WHERE symbol=? AND timeframe='daily' ORDER BY date DESC LIMIT 100",
-        conn,
-        params=(symbol,)
-    )
-    
-    weekly_data = pd.read_sql_query(
-        "SELECT * FROM stock_prices WHERE symbol=? AND timeframe='weekly' ORDER BY date DESC LIMIT 52",
-        conn,
-        params=(symbol,)
-    )
-    
-    conn.close()
-    
-    return templates.TemplateResponse(
-        "stock_data.html",
-        {
-            "request": request,
-            "symbol": symbol,
-            "total_records": total_records,
-            "total_stocks": total_stocks,
-            "daily_data": daily_data.to_dict('records'),
-            "weekly_data": weekly_data.to_dict('records')
-        }
-    )
-
-
-
 
 @router.get("/login", response_class=HTMLResponse)
 async def login_page(request: Request):
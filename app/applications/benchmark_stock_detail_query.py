@@ -0,0 +1,90 @@
+"""
+Before/after benchmark of the get_stock_data bar query.
+
+Prints the query plan and per-query latency of the old query (weekday
+filtered per row) and the current one (weekend rows are dropped at
+ingest, so no filter), over a sample of stored symbols. Both read
+stock_bars, as get_stock_data does.
+
+    python app/applications/benchmark_stock_detail_query.py [db_path] [--symbols N] [--repeat N]
+"""
+import argparse
+import random
+import statistics
+import time
+import os,sys
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from database import TIMEFRAME_IDS, connect, day_sql
+
+QUERIES = {
+    # The original per-row weekday filter, on the ISO date it was written for
+    'before': f"""
+        SELECT {day_sql()}, open, high, low, close, volume
+        FROM stock_bars
+        WHERE symbol_id = (SELECT id FROM symbols WHERE symbol = ?)
+        AND timeframe = ?
+        AND strftime('%w', {day_sql()}) NOT IN ('0', '6')
+        ORDER BY day DESC
+        LIMIT ?
+    """,
+    'after': f"""
+        SELECT {day_sql()}, open, high, low, close, volume
+        FROM stock_bars
+        WHERE symbol_id = (SELECT id FROM symbols WHERE symbol = ?)
+        AND timeframe = ?
+        ORDER BY day DESC
+        LIMIT ?
+    """,
+}
+LIMITS = {'daily': 120, 'weekly': 104}
+
+
+def query_plan(conn, query):
+    rows = conn.execute(f"EXPLAIN QUERY PLAN {query}", ('AAPL', TIMEFRAME_IDS['daily'], LIMITS['daily'])).fetchall()
+    return [row[-1] for row in rows]
+
+
+def time_query(conn, query, symbols, repeat):
+    """Latencies in ms of one get_stock_data-style call (daily + weekly) per symbol"""
+    latencies = []
+    for _ in range(repeat):
+        for symbol in symbols:
+            start = time.perf_counter()
+            for timeframe, limit in LIMITS.items():
+                conn.execute(query, (symbol, TIMEFRAME_IDS[timeframe], limit)).fetchall()
+            latencies.append((time.perf_counter() - start) * 1000)
+    return latencies
+
+
+def run_benchmark(db_path, n_symbols=200, repeat=3, seed=0):
+    conn = connect(db_path, readonly=True)
+    try:
+        symbols = [row[0] for row in conn.execute("""
+            SELECT s.symbol FROM symbols s
+            WHERE EXISTS (SELECT 1 FROM stock_bars b WHERE b.symbol_id = s.id AND b.timeframe = ?)
+        """, (TIMEFRAME_IDS['weekly'],))]
+        random.Random(seed).shuffle(symbols)
+        symbols = symbols[:n_symbols]
+        print(f"{len(symbols)} symbols x {repeat} rounds, daily LIMIT {LIMITS['daily']} + weekly LIMIT {LIMITS['weekly']}\n")
+
+        for name, query in QUERIES.items():
+            # Warm the page cache so both variants read from memory
+            time_query(conn, query, symbols, 1)
+            latencies = sorted(time_query(conn, query, symbols, repeat))
+            p95 = latencies[int(len(latencies) * 0.95) - 1]
+            print(f"[{name}]")
+            for line in query_plan(conn, query):
+                print(f"  plan: {line}")
+            print(f"  median {statistics.median(latencies):.3f} ms, p95 {p95:.3f} ms, "
+                  f"max {latencies[-1]:.3f} ms per symbol\n")
+    finally:
+        conn.close()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('db_path', nargs='?', default='static/stock_data.db')
+    parser.add_argument('--symbols', type=int, default=200)
+    parser.add_argument('--repeat', type=int, default=3)
+    args = parser.parse_args()
+    run_benchmark(args.db_path, args.symbols, args.repeat)
@@ -1,57 +1,202 @@
 from PIL import Image
+import io
 import os
+import struct
 from datetime import datetime
 
-def combine_images_to_pdf():
+PNG_SIGNATURE = b'\x89PNG\r\n\x1a\n'
+# PNG image data is copied in blocks of this many bytes
+BLOCK_SIZE = 1 << 20
+
+
+class StreamingPdfWriter:
+    """
+    Minimal PDF writer that writes each page (one full-page image) as soon
+    as it is added, so memory stays at one image whatever the page count.
+
+    Pages look like PIL's PDF output: the image size in points (72 dpi),
+    and images that have to be decoded are stored as JPEG.
+    """
+
+    def __init__(self, f):
+        self.f = f
+        self.offsets = {}  # object number -> byte offset
+        self.page_ids = []
+        self.next_id = 3  # 1 is the catalog, 2 the page tree (written by close())
+        self.f.write(b'%PDF-1.4\n%\xe2\xe3\xcf\xd3\n')
+
+    def _new_id(self):
+        self.next_id += 1
+        return self.next_id - 1
+
+    def _begin(self, obj_id):
+        self.offsets[obj_id] = self.f.tell()
+        self.f.write(b'%d 0 obj\n' % obj_id)
+
+    def _object(self, obj_id, body):
+        self._begin(obj_id)
+        self.f.write(body + b'\nendobj\n')
+
+    def _stream(self, obj_id, dictionary, blocks):
+        """A stream object whose data comes from an iterable of byte blocks"""
+        length_id = self._new_id()
+        self._begin(obj_id)
+        # The length goes in its own object, written after the data
+        self.f.write(b'<< %s /Length %d 0 R >>\nstream\n' % (dictionary, length_id))
+        length = 0
+        for block in blocks:
+            self.f.write(block)
+            length += len(block)
+        self.f.write(b'\nendstream\nendobj\n')
+        self._object(length_id, b'%d' % length)
+
+    def _page(self, width, height, image_dict, image_blocks):
+        start, first_id = self.f.tell(), self.next_id
+        try:
+            image_id, contents_id, page_id = self._new_id(), self._new_id(), self._new_id()
+            self._stream(image_id, b'/Type /XObject /Subtype /Image /Width %d /Height %d %s'
+                         % (width, height, image_dict), image_blocks)
+            self._stream(contents_id, b'', [b'q %d 0 0 %d 0 0 cm /Im0 Do Q' % (width, height)])
+            self._object(page_id, b'<< /Type /Page /Parent 2 0 R /MediaBox [0 0 %d %d] '
+                                  b'/Resources << /XObject << /Im0 %d 0 R >> >> /Contents %d 0 R >>'
+                         % (width, height, image_id, contents_id))
+        except Exception:
+            # Drop the half-written page, so a bad image only costs its own page
+            self.f.seek(start)
+            self.f.truncate()
+            for obj_id in range(first_id, self.next_id):
+                self.offsets.pop(obj_id, None)
+            self.next_id = first_id
+            raise
+        self.page_ids.append(page_id)
+
+    def add_png(self, path):
+        """
+        Add a PNG as a page. 8-bit grey or RGB, non-interlaced PNGs are
+        embedded as they are (their compressed data is valid PDF Flate data
+        with PNG predictors); others (like matplotlib's RGBA charts) go
+        through add_image().
+        """
+        with open(path, 'rb') as f:
+            header = _png_header(f)
+            if header is not None:
+                width, height, bit_depth, color_type, interlace = header
+                if bit_depth == 8 and color_type in (0, 2) and interlace == 0:
+                    colors = 1 if color_type == 0 else 3
+                    self._page(width, height,
+                               b'/ColorSpace /%s /BitsPerComponent 8 /Filter /FlateDecode '
+                               b'/DecodeParms << /Predictor 15 /Colors %d /BitsPerComponent 8 /Columns %d >>'
+                               % (b'DeviceGray' if colors == 1 else b'DeviceRGB', colors, width),
+                               _png_idat_blocks(f))
+                    return
+        self.add_image(path)
+
+    def add_image(self, path):
+        """Add any image PIL can open as a page (converted to RGB, stored as JPEG)"""
+        with Image.open(path) as image:
+            # PDF requires RGB; matplotlib's RGBA charts are opaque anyway
+            image = image.convert('RGB')
+            jpeg = io.BytesIO()
+            image.save(jpeg, 'JPEG')
+            width, height = image.size
+        self._page(width, height,
+                   b'/ColorSpace /DeviceRGB /BitsPerComponent 8 /Filter /DCTDecode',
+                   [jpeg.getvalue()])
+
+    def close(self):
+        """Write the page tree, catalog and cross-reference table"""
+        kids = b' '.join(b'%d 0 R' % page_id for page_id in self.page_ids)
+        self._object(2, b'<< /Type /Pages /Kids [%s] /Count %d >>' % (kids, len(self.page_ids)))
+        self._object(1, b'<< /Type /Catalog /Pages 2 0 R >>')
+        xref_offset = self.f.tell()
+        self.f.write(b'xref\n0 %d\n0000000000 65535 f \n' % self.next_id)
+        for obj_id in range(1, self.next_id):
+            self.f.write(b'%010d 00000 n \n' % self.offsets[obj_id])
+        self.f.write(b'trailer\n<< /Size %d /Root 1 0 R >>\nstartxref\n%d\n%%%%EOF\n'
+                     % (self.next_id, xref_offset))
+
+
+def _png_header(f):
+    """(width, height, bit depth, colour type, interlace) from the IHDR, or None if not a PNG"""
+    if f.read(8) != PNG_SIGNATURE:
+        return None
+    length, chunk_type = struct.unpack('>I4s', f.read(8))
+    if chunk_type != b'IHDR':
+        return None
+    width, height, bit_depth, color_type, _, _, interlace = struct.unpack('>IIBBBBB', f.read(13))
+    f.seek(length - 13 + 4, os.SEEK_CUR)  # rest of IHDR and its CRC
+    return width, height, bit_depth, color_type, interlace
+
+
+def _png_idat_blocks(f):
+    """The concatenated IDAT chunk data of a PNG (positioned after IHDR), in blocks"""
+    while True:
+        header = f.read(8)
+        if len(header) < 8:
+            return
+        length, chunk_type = struct.unpack('>I4s', header)
+        if chunk_type == b'IEND':
+            return
+        if chunk_type != b'IDAT':
+            f.seek(length + 4, os.SEEK_CUR)
+            continue
+        while length > 0:
+            block = f.read(min(length, BLOCK_SIZE))
+            if not block:
+                raise ValueError(f"Truncated PNG: {f.name}")
+            length -= len(block)
+            yield block
+        f.seek(4, os.SEEK_CUR)  # CRC
+
+
+def combine_images_to_pdf(today=None):
+    """
+    Combine the day's chart PNGs into one PDF, one page per chart in file
+    name order. Pages are streamed to the file one at a time, so memory
+    use does not grow with the number of charts.
+    """
     # Get today's date in YYYYMMDD format
-    today = datetime.now().strftime("%Y%m%d")
-    
+    today = today or datetime.now().strftime("%Y%m%d")
+
     # Define the folder path
     folder_path = f"./static/images/{today}"
-    
+
     # Check if the folder exists
     if not os.path.exists(folder_path):
         print(f"Folder {folder_path} does not exist")
         return
-    
-    # Get all PNG files from the folder
-    png_files = [f for f in os.listdir(folder_path) if f.lower().endswith('.png')]
-    
+
+    # Get all PNG files from the folder, in a stable order (the charts are
+    # named by rank, e.g. 001_AAPL.png)
+    png_files = sorted(f for f in os.listdir(folder_path) if f.lower().endswith('.png'))
+
     if not png_files:
         print("No PNG files found in the folder")
         return
-    
-    # Open all images and convert to RGB (PDF requires RGB)
-    images = []
-    for png_file in png_files:
-        image_path = os.path.join(folder_path, png_file)
-        try:
-            image = Image.open(image_path)
-            # Convert RGBA to RGB if necessary
-            if image.mode == 'RGBA':
-                image = image.convert('RGB')
-            images.append(image)
-        except Exception as e:
-            print(f"Error processing {png_file}: {str(e)}")
-    
-    if not images:
-        print("No valid images to process")
-        return
-    
+
     # Create PDF file path
     pdf_path = os.path.join(folder_path, f"combined_{today}.pdf")
-    
+    tmp_path = f"{pdf_path}.{os.getpid()}.tmp"
+
     try:
-        # Save the first image as PDF with the rest appended
-        images[0].save(
-            pdf_path,
-            "PDF",
-            save_all=True,
-            append_images=images[1:]
-        )
-        print(f"PDF created successfully: {pdf_path}")
+        with open(tmp_path, 'wb') as f:
+            writer = StreamingPdfWriter(f)
+            for png_file in png_files:
+                try:
+                    writer.add_png(os.path.join(folder_path, png_file))
+                except Exception as e:
+                    print(f"Error processing {png_file}: {str(e)}")
+            if not writer.page_ids:
+                print("No valid images to process")
+                return
+            writer.close()
+        os.replace(tmp_path, pdf_path)
+        print(f"PDF created successfully: {pdf_path} ({len(writer.page_ids)} pages)")
     except Exception as e:
         print(f"Error creating PDF: {str(e)}")
+    finally:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
 
 if __name__ == "__main__":
-    combine_images_to_pdf()
\ No newline at end of file
+    combine_images_to_pdf()
@@ -0,0 +1,53 @@
+"""
+Migrate stock_prices to the compact stock_bars schema and reclaim the space.
+
+update_database migrates automatically on its next run; this script does
+the same up front and then VACUUMs, printing the file size before and
+after. Stop the web app and the scheduled jobs first: VACUUM needs the
+database to itself.
+
+    python app/applications/migrate_compact_schema.py [db_path]
+"""
+import argparse
+import time
+import os,sys
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from database import connect, is_legacy_schema, migrate_to_compact_schema
+
+
+def file_size_mb(db_path):
+    """Size of the database including its WAL file, in MB"""
+    total = 0
+    for path in (db_path, db_path + '-wal'):
+        if os.path.exists(path):
+            total += os.path.getsize(path)
+    return total / (1024 * 1024)
+
+
+def run_migration(db_path):
+    before = file_size_mb(db_path)
+    conn = connect(db_path)
+    try:
+        if not is_legacy_schema(conn):
+            print(f"{db_path} already uses stock_bars ({before:.1f} MB)")
+            return
+        start = time.perf_counter()
+        rows = migrate_to_compact_schema(conn)
+        print(f"Migrating {rows} rows took {time.perf_counter() - start:.1f}s")
+
+        start = time.perf_counter()
+        conn.execute("VACUUM")
+        conn.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+        print(f"VACUUM took {time.perf_counter() - start:.1f}s")
+    finally:
+        conn.close()
+
+    after = file_size_mb(db_path)
+    print(f"Size: {before:.1f} MB -> {after:.1f} MB ({(1 - after / before) * 100:.0f}% smaller)")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('db_path', nargs='?', default='static/stock_data.db')
+    args = parser.parse_args()
+    run_migration(args.db_path)
@@ -17,6 +17,8 @@ edt = pytz.timezone("America/New_York")
 
 sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 from services import yfiance_local as yf
+from services.analysis import add_indicators, calculate_macd
+from services.chart_renderer import chart_axes, draw_bars, draw_candlesticks, draw_markers, render_charts, save_chart
 #import yfinance as yf
 
 
@@ -107,19 +109,6 @@ def calculate_future_business_days(real_today_str, today_str):
 
 
 
-# Function to calculate EMA
-def ema(data, window):
-    return data.ewm(span=window, adjust=False).mean()
-
-# Function to calculate MACD
-def calculate_macd(data, slow=26, fast=12, signal=9):
-    ema_fast = data.ewm(span=fast, adjust=False).mean()
-    ema_slow = data.ewm(span=slow, adjust=False).mean()
-    macd = ema_fast - ema_slow
-    macd_signal = macd.ewm(span=signal, adjust=False).mean()
-    macd_hist = 2*(macd - macd_signal)
-    return macd, macd_signal, macd_hist
-
 # Function to calculate the nearest MACD histogram crossover
 def calculate_crossover_days(macd_hist):
     for i in range(len(macd_hist)-1, 0, -1):
@@ -139,31 +128,9 @@ def fit_line_and_predict(macd_hist_values):
 
 # Modified plot_candlestick function to use continuous trading day indices
 def plot_candlestick(ax, data):
-    for idx in range(len(data)):
-        open_price = data['Open'].iloc[idx]
-        close_price = data['Close'].iloc[idx]
-        high_price = data['High'].iloc[idx]
-        low_price = data['Low'].iloc[idx]
-        
-        is_green = close_price >= open_price
-        color = 'green' if is_green else 'red'
-        
-        # Plot the high-low line (wick)
-        ax.plot([idx, idx], [low_price, high_price], 
-                color=color,
-                linewidth=2,
-                zorder=1)
-        
-        # Create the candlestick body
-        rect = plt.Rectangle((idx - 0.3, min(open_price, close_price)),
-                           0.6,
-                           abs(close_price - open_price),
-                           facecolor='white' if is_green else 'red',  # White fill for green candles
-                           edgecolor=color,  # Green border for green candles
-                           linewidth=1 if is_green else 0,  # Add border for green candles
-                           alpha=1.0,
-                           zorder=2)
-        ax.add_patch(rect)
+    # Wicks and bodies as two collections (services/chart_renderer.py);
+    # white fill with a green border for green candles
+    draw_candlesticks(ax, data, up_face='white', up_edge_width=1, down_edge_width=0)
 
 # Function to create custom date formatter for x-axis
 def format_date(x, p, trading_dates):
@@ -182,59 +149,6 @@ def fit_ema_line(data, start_idx, end_idx):
     return slope, mse, fit_values
 
 
-def calculate_rsi(data, window):
-    """Calculate the Relative Strength Index (RSI) for a given window."""
-    delta = data['Close'].diff()
-    gain = (delta.where(delta > 0, 0)).rolling(window=window).mean()
-    loss = (-delta.where(delta < 0, 0)).rolling(window=window).mean()
-    rs = gain / loss
-    rsi = 100 - (100 / (1 + rs))
-    return rsi
-
-def calculate_wr(data, window):
-    """Calculate the Williams %R for a given window."""
-    highest_high = data['High'].rolling(window=window).max()
-    lowest_low = data['Low'].rolling(window=window).min()
-    wr = (highest_high - data['Close']) / (highest_high - lowest_low) * 100
-    return wr
-
-def calculate_kdj(data, period=9):
-    """Calculate kdj_k, kdj_d, and kdj_j for the KDJ indicator."""
-    # Calculate the lowest low and highest high over the specified period
-    low_min = data['Low'].rolling(window=period, min_periods=1).min()
-    high_max = data['High'].rolling(window=period, min_periods=1).max()
-
-    # Calculate K% (fast stochastic) and rename it to kdj_k
-    data['kdj_k'] = 100 * ((data['Close'] - low_min) / (high_max - low_min))
-
-    # Smooth kdj_k to get kdj_d by applying a moving average
-    data['kdj_d'] = data['kdj_k'].rolling(window=3, min_periods=1).mean()
-
-    # Calculate kdj_j as 3 * kdj_k - 2 * kdj_d
-    data['kdj_j'] = 3 * data['kdj_k'] - 2 * data['kdj_d']
-
-    return data[['kdj_k', 'kdj_d', 'kdj_j']]
-
-def add_technical_indicators(data):
-    """Calculate and add RSI and WR to the DataFrame."""
-    # Calculate RSI for 6, 12, and 24 periods
-    data['RSI_6'] = calculate_rsi(data, 6)
-    data['RSI_12'] = calculate_rsi(data, 12)
-    data['RSI_24'] = calculate_rsi(data, 24)
-
-    # Calculate Williams %R for 6 and 10 periods
-    data['WR_6'] = calculate_wr(data, 6)
-    data['WR_10'] = calculate_wr(data, 10)
-
-    # Ensure you have the volume data in your DataFrame
-    if 'Volume' not in data.columns:
-        raise ValueError("The DataFrame must contain a 'Volume' column.")
-    # Ensure the DataFrame contains volume data
-    # Calculate KDJ and merge with the main data
-    kdj_data = calculate_kdj(data)
-    data = pd.concat([data, kdj_data], axis=1)
-    return data
-
 def find_buy_sell_points(x_valid,y_valid,hist_valid):
     # Initialize lists to hold the buy and sell points
     buy_points = []
@@ -353,19 +267,10 @@ def update_png(today,filename,mode): #mode=0 means daily, 1 means only one file
     future_dates = pd.date_range(start=trading_dates[-1], periods=2 + 1)[1:]
     extended_dates = trading_dates + list(future_dates)
 
-    # Calculate EMAs and MACD
-    for window in range(3, 26, 2):
-        data_for_check[f'EMA_{window}'] = ema(data_for_check['Close'], window)
-    for window in range(27, 52, 2):
-        data_for_check[f'EMA_{window}'] = ema(data_for_check['Close'], window)
-    data_for_check['MACD'], data_for_check['MACD_signal'], data_for_check['MACD_hist'] = calculate_macd(data_for_check['Close'])
-
-    # Calculate EMAs and MACD
-    for window in range(3, 26, 2):
-        data[f'EMA_{window}'] = ema(data['Close'], window)
-    for window in range(27, 52, 2):
-        data[f'EMA_{window}'] = ema(data['Close'], window)
-    data['MACD'], data['MACD_signal'], data['MACD_hist'] = calculate_macd(data['Close'])
+    # Calculate EMAs and MACD (services/analysis.py)
+    add_indicators(data_for_check, ['EMA', 'MACD'])
+    # Every indicator on the full range: EMAs, MACD, RSI, WR and KDJ
+    add_indicators(data)
     
     # Calculate the daily percentage change
     data['Pct_Change'] = data['Close'].pct_change() * 100  # Convert to percentage
@@ -387,7 +292,6 @@ def update_png(today,filename,mode): #mode=0 means daily, 1 means only one file
     else:
         crossover_days = 'N/A'
 
-    add_technical_indicators(data)
     meantrend = (data['RSI_6']+100-data['WR_6']+data['kdj_k'])/3
     x_range = np.arange(len(data))
     # Mask NaN values in 'WR_6' to get valid data points
@@ -408,37 +312,11 @@ def update_png(today,filename,mode): #mode=0 means daily, 1 means only one file
 
     market_cap = get_market_cap(stockticker)
 
-    # Create the main figure
-    fig = plt.figure(figsize=(19, 10))
-    # Top group with shared x-axis (ax1, ax2, ax3)
-    gs_top = fig.add_gridspec(3, 1, 
-        height_ratios=[2, 0.5, 0.5], 
-        hspace=0.00,            # Vertical space between subplots in top group
-        bottom=0.45,            # Bottom position of the top group
-        top=0.95,               # Top position (added to reduce top margin)
-        left=0.05,               # Left margin
-        right=0.95              # Right margin
-        )
-    ax1 = fig.add_subplot(gs_top[0])
-    ax2 = fig.add_subplot(gs_top[1], sharex=ax1)
-    ax3 = fig.add_subplot(gs_top[2], sharex=ax1)
-
-    # Bottom group with separate shared x-axis (ax4, ax5)
-    gs_bottom = fig.add_gridspec(2, 1, 
-        height_ratios=[2, 1], 
-        hspace=0.00,         # Vertical space between subplots in bottom group
-        bottom=0.05,          # Bottom position of the bottom group
-        top=0.42,             # Top position of the bottom group
-        left=0.05,            # Left margin
-        right=0.95           # Right margin
-        )
-    ax4 = fig.add_subplot(gs_bottom[0])
-    ax5 = fig.add_subplot(gs_bottom[1], sharex=ax4)
-
-    # Optionally, hide x-axis labels for upper plots in each group
-    ax1.tick_params(labelbottom=False)
-    ax2.tick_params(labelbottom=False)
-    ax4.tick_params(labelbottom=False)
+    # Reuse this process's figure (services/chart_renderer.py); the layout,
+    # shared x axes and hidden upper tick labels are already set up
+    chart = chart_axes()
+    fig = chart.fig
+    ax1, ax2, ax3, ax4, ax5 = chart.ax1, chart.ax2, chart.ax3, chart.ax4, chart.ax5
 
     # Plot candlestick data
     plot_candlestick(ax1, data)
@@ -462,7 +340,7 @@ def update_png(today,filename,mode): #mode=0 means daily, 1 means only one file
 
     # Plot MACD Histogram with Color Conditions
     color_condition = np.where(data['Close'].diff() > 0, 'green', 'red')
-    ax2.bar(x_range, data['MACD_hist'], color=color_condition)
+    draw_bars(ax2, x_range, data['MACD_hist'], color_condition)
     ax2.axhline(0, color='black', linewidth=1, linestyle='-')
     
     ax1.axvline(x=len(data) - 0.5- future_days, linestyle='-', color='blue', label='Today')
@@ -497,7 +375,7 @@ def update_png(today,filename,mode): #mode=0 means daily, 1 means only one file
 
     # Plot Volume
     #ax6 = ax1.twinx()  # Create a twin y-axis for volume
-    ax3_right.bar(x_range, data['Volume'], alpha=0.3, color=color_condition, label='Volume', width=0.75)
+    draw_bars(ax3_right, x_range, data['Volume'], color_condition, width=0.75, alpha=0.3)
 
     # Formatting ax3
     ax3.axhline(30, color='red', linestyle='--', linewidth=0.8)  # Overbought level for RSI
@@ -517,20 +395,11 @@ def update_png(today,filename,mode): #mode=0 means daily, 1 means only one file
         ax.grid(True, which='minor', alpha=0.5)  # Enable minor grid with desired transparency
 
     
-    for bp in buy_points:
-        ax1.axvline(x=bp, color='green', linestyle='--', label='Buy Point' if 'Buy Point' not in plt.gca().get_legend_handles_labels()[1] else "")
-        ax2.axvline(x=bp, color='green', linestyle='--', label='Buy Point' if 'Buy Point' not in plt.gca().get_legend_handles_labels()[1] else "")
-        #ax3.axvline(x=bp, color='green', linestyle='--', label='Buy Point' if 'Buy Point' not in plt.gca().get_legend_handles_labels()[1] else "")
-        #ax4.axvline(x=bp, color='green', linestyle='--', label='Buy Point' if 'Buy Point' not in plt.gca().get_legend_handles_labels()[1] else "")
-    for sp in sell_points:
-        ax1.axvline(x=sp, color='red', linestyle='--', label='Sell Point' if 'Sell Point' not in plt.gca().get_legend_handles_labels()[1] else "")
-        ax2.axvline(x=sp, color='red', linestyle='--', label='Sell Point' if 'Sell Point' not in plt.gca().get_legend_handles_labels()[1] else "")
-        #ax3.axvline(x=sp, color='red', linestyle='--', label='Sell Point' if 'Sell Point' not in plt.gca().get_legend_handles_labels()[1] else "")
-        #ax4.axvline(x=sp, color='red', linestyle='--', label='Sell Point' if 'Sell Point' not in plt.gca().get_legend_handles_labels()[1] else "")
-    for bp in buy_points7:
-        ax3.axvline(x=bp, color='green', linestyle='-', label='Buy Point' if 'Buy Point' not in plt.gca().get_legend_handles_labels()[1] else "")
-    for sp in sell_points7:
-        ax3.axvline(x=sp, color='red', linestyle='-', label='Sell Point' if 'Sell Point' not in plt.gca().get_legend_handles_labels()[1] else "")
+    # Buy/sell markers: one line collection per axes and colour
+    draw_markers((ax1, ax2), buy_points, 'green', linestyle='--')
+    draw_markers((ax1, ax2), sell_points, 'red', linestyle='--')
+    draw_markers((ax3,), buy_points7, 'green', linestyle='-')
+    draw_markers((ax3,), sell_points7, 'red', linestyle='-')
 
     #for wkdata:
     wkdata['MACD'], wkdata['MACD_signal'], wkdata['MACD_hist'] = calculate_macd(wkdata['Close'])
@@ -543,23 +412,23 @@ def update_png(today,filename,mode): #mode=0 means daily, 1 means only one file
     ax5.plot(wk_x_range, wkdata['MACD'], label='MACD', color='blue')
     ax5.plot(wk_x_range, wkdata['MACD_signal'], label='Signal', color='orange')
     wk_color_condition = np.where(wkdata['Close'].diff() > 0, 'green', 'red')
-    ax5.bar(wk_x_range, wkdata['MACD_hist'], color=wk_color_condition)
+    draw_bars(ax5, wk_x_range, wkdata['MACD_hist'], wk_color_condition)
     ax5.axhline(0, color='black', linewidth=1, linestyle='-')
 
     # Save plot
     ax1.set_title(f'{filename}|{market_cap:.1f}B|')
     plt.tight_layout()
     if mode ==0:
-        plt.savefig(f'./static/images/{today}/{filename}')
+        save_chart(fig, f'./static/images/{today}/{filename}')
     else:
-        plt.savefig(f'./static/images/generated_view.png')
-    plt.close()
-def process_stock_tickers(tickers):
+        save_chart(fig, f'./static/images/generated_view.png')
+def process_stock_tickers(tickers, workers=None):
     """
     Process a list of stock tickers and generate candlestick charts for each one.
     
     Args:
         tickers (list): List of stock ticker symbols
+        workers (int): Rendering processes (default: one per CPU)
     """
     # Get today's date in YYYYMMDD format
     today = datetime.now().strftime('%Y%m%d')
@@ -568,21 +437,13 @@ def process_stock_tickers(tickers):
     base_dir = f'./static/images/{today}'
     os.makedirs(base_dir, exist_ok=True)
     
-    # Process each ticker
-    for i,ticker in enumerate(tickers):
-        print(i,ticker)
-        try:
-            # Create filename in required format
-            filename = f'candle{i:02}0_{ticker}.png'
-            
-            # Call update_png function with daily mode (mode=0)
-            update_png(today, filename, 0)
-            
+    # Render every ticker's chart in daily mode (mode=0) on the worker pool
+    jobs = [(today, f'candle{i:02}0_{ticker}.png', 0) for i, ticker in enumerate(tickers)]
+    for ticker, error in zip(tickers, render_charts(update_png, jobs, workers)):
+        if error is None:
             print(f"Successfully processed {ticker}")
-            
-        except Exception as e:
-            print(f"Error processing {ticker}: {str(e)}")
-            continue
+        else:
+            print(f"Error processing {ticker}: {error}")
 
 if __name__ == "__main__":
     # Example stock ticker list - replace with your desired tickers
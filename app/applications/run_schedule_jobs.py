@@ -1,33 +1,32 @@
 import os,sys
 sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 from applications.update_db import update_database
+from applications.update_fundamentals import refresh_fundamentals
 from applications.schedule_jobs.top10_bp import filter_stock
 from applications.schedule_jobs.top10_rsi import analyze_rsi
 from applications.schedule_jobs.top10_volume import analyze_volume
 from applications.schedule_jobs.combine_daily_emails import combine_daily_emails
 from applications.schedule_jobs.sendemail_test import send_emails_to_all_subscribers
 
-import time
+from datetime import datetime
 
 
 if __name__ == "__main__":
     # To update current week's data:
     DB_PATH = "static/stock_data.db"
-    attempts = 0
-    max_attempts = 20
-    total_added = 1  # Initialize with non-zero value to enter the loop
-    while total_added > 0 and attempts < max_attempts:
-        total_added = update_database(DB_PATH, period='current')
-        attempts += 1
-        if attempts == max_attempts:
-            print(f"Reached maximum attempts ({max_attempts})")
-        elif total_added == 0:
-            print(f"Update completed successfully after {attempts} attempts")    
-        time.sleep(20)
+    # Symbols that still fail get up to 5 more passes in the same run (only
+    # them, not the whole universe); the derived tables are refreshed once
+    update_database(DB_PATH, period='current', retries=5)
 
-    filter_stock(0)
+    filter_stock(0, workers=os.cpu_count() or 1)
     analyze_rsi()
     analyze_volume()
     combine_daily_emails()
 
-    send_emails_to_all_subscribers()
\ No newline at end of file
+    send_emails_to_all_subscribers()
+
+    # Fundamentals (share counts, market cap, country) change slowly; refresh
+    # them weekly, after the emails are out, so the daily screeners read them
+    # from the local table instead of calling yfinance per stock
+    if datetime.today().weekday() == 4:
+        refresh_fundamentals(DB_PATH, max_age_days=7)
@@ -1,89 +1,278 @@
+import os,sys
 import smtplib
+import email.policy
+import queue
+import threading
+import time
 from email.mime.text import MIMEText
 from email.mime.multipart import MIMEMultipart
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
 import sqlite3
+sys.path.append(os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__)))))
+from database import connect
+
+# Email settings
+SMTP_HOST = "smtp"
+SMTP_PORT = 25
+FROM_EMAIL = "stockwise@tianshen.store"
+HTML_PATH = './templates/daily_email_combined.html'
+
+SMTP_SESSIONS = 4            # parallel SMTP sessions (= sending threads)
+MESSAGES_PER_SESSION = 100   # reconnect after this many, servers cap it per connection
+MAX_ATTEMPTS = 3             # per recipient, for temporary (4xx, connection) errors
+RETRY_DELAY = 2              # seconds, doubled after every failed attempt
+SMTP_TIMEOUT = 30
 
-def send_email(to_email, subject):
-    # Email settings
-    smtp_host = "smtp"
-    smtp_port = 25
-    from_email = "stockwise@tianshen.store"
 
-    # Create message
+def build_message(subject, html_content):
+    """
+    The daily email as bytes, without its To header (added per recipient
+    by DailyMailer.send, so the MIME body is built and encoded once).
+    """
     msg = MIMEMultipart('alternative')
-    msg['From'] = f"StockWise <{from_email}>"
-    msg['To'] = to_email
+    msg['From'] = f"StockWise <{FROM_EMAIL}>"
     msg['Subject'] = subject
+    msg.attach(MIMEText(html_content, 'html'))
+    return msg.as_bytes(policy=email.policy.SMTP)
+
+
+def _reply_text(code, reply):
+    if isinstance(reply, bytes):
+        reply = reply.decode(errors='replace')
+    return f"{code} {reply}"
+
+
+class SmtpSession:
+    """
+    One persistent SMTP connection, opened on first use and reopened
+    after MESSAGES_PER_SESSION messages (servers cap messages per
+    connection) or after reset().
+    """
+
+    def __init__(self, host, port):
+        self.host = host
+        self.port = port
+        self.server = None
+        self.sent = 0
+
+    def sendmail(self, to_email, data):
+        if self.server is not None and self.sent >= MESSAGES_PER_SESSION:
+            self.close()
+        if self.server is None:
+            self.server = smtplib.SMTP(self.host, self.port, timeout=SMTP_TIMEOUT)
+        self.server.sendmail(FROM_EMAIL, [to_email], data)
+        self.sent += 1
+
+    def reset(self):
+        """Drop the connection after an error; the next message reconnects"""
+        if self.server is not None:
+            self.server.close()
+        self.server = None
+        self.sent = 0
+
+    def close(self):
+        if self.server is not None:
+            try:
+                self.server.quit()
+            except (smtplib.SMTPException, OSError):
+                self.server.close()
+        self.server = None
+        self.sent = 0
+
+
+class DailyMailer:
+    """
+    Sends one prebuilt message to many recipients over a few persistent
+    SMTP sessions.
+
+    Each of the `sessions` threads keeps its own SmtpSession open across
+    recipients and takes the next recipient from a shared queue.
+    Temporary failures (4xx replies, connection errors) are retried on a
+    fresh connection with a doubling delay; permanent ones (5xx) are not.
+
+    Parameters:
+    host, port: SMTP server (e.g. a local aiosmtpd stand-in in tests)
+    sleep: injectable for tests
+    """
+
+    def __init__(self, host=SMTP_HOST, port=SMTP_PORT, sessions=SMTP_SESSIONS,
+                 max_attempts=MAX_ATTEMPTS, retry_delay=RETRY_DELAY, sleep=time.sleep):
+        self.host = host
+        self.port = port
+        self.sessions = sessions
+        self.max_attempts = max_attempts
+        self.retry_delay = retry_delay
+        self.sleep = sleep
+        self.lock = threading.Lock()
+
+    def _send_one(self, session, to_email, message):
+        """
+        Deliver to one recipient, retrying temporary errors.
+
+        Returns:
+        dict: email, status ('sent' or 'failed'), attempts, error
+        """
+        data = f"To: {to_email}\r\n".encode() + message
+        for attempt in range(1, self.max_attempts + 1):
+            try:
+                session.sendmail(to_email, data)
+                return {'email': to_email, 'status': 'sent', 'attempts': attempt, 'error': None}
+            except smtplib.SMTPRecipientsRefused as e:
+                # The session is still fine; only this address was refused
+                code, reply = list(e.recipients.values())[0]
+                error = _reply_text(code, reply)
+                permanent = code >= 500
+            except smtplib.SMTPResponseException as e:
+                error = _reply_text(e.smtp_code, e.smtp_error)
+                permanent = e.smtp_code >= 500
+                session.reset()
+            except (smtplib.SMTPException, OSError) as e:
+                # Connection refused, dropped or timed out
+                error = f"{type(e).__name__}: {e}"
+                permanent = False
+                session.reset()
+            if permanent:
+                break
+            if attempt < self.max_attempts:
+                self.sleep(self.retry_delay * 2 ** (attempt - 1))
+        return {'email': to_email, 'status': 'failed', 'attempts': attempt, 'error': error}
+
+    def _worker(self, pending, message, results, on_result):
+        session = SmtpSession(self.host, self.port)
+        try:
+            while True:
+                try:
+                    to_email = pending.get_nowait()
+                except queue.Empty:
+                    return
+                result = self._send_one(session, to_email, message)
+                with self.lock:
+                    results.append(result)
+                    if on_result is not None:
+                        on_result(result)
+        finally:
+            session.close()
+
+    def send(self, recipients, message, on_result=None):
+        """
+        Send message (bytes from build_message) to every recipient.
+        on_result(result) is called as each recipient finishes, one call at a
+        time (under the mailer's lock), so it may write to a shared connection.
+
+        Returns:
+        list: one result dict per recipient, in completion order
+        """
+        pending = queue.Queue()
+        for to_email in recipients:
+            pending.put(to_email)
+        results = []
+        workers = max(1, min(self.sessions, pending.qsize()))
+        with ThreadPoolExecutor(max_workers=workers, thread_name_prefix='smtp') as executor:
+            futures = [executor.submit(self._worker, pending, message, results, on_result)
+                       for _ in range(workers)]
+            for future in futures:
+                future.result()
+        return results
 
+
+def send_email(to_email, subject):
     # Read HTML content
     try:
-        with open('./templates/daily_email_combined.html', 'r') as f:
+        with open(HTML_PATH, 'r') as f:
             html_content = f.read()
-        
-        # Attach HTML content
-        msg.attach(MIMEText(html_content, 'html'))
-
-        # Connect to SMTP server
-        server = smtplib.SMTP(smtp_host, smtp_port)
-        server.send_message(msg)
-        server.quit()
-        return True
+        result = DailyMailer(sessions=1).send([to_email], build_message(subject, html_content))[0]
+        if result['status'] != 'sent':
+            print(f"Error sending email: {result['error']}")
+        return result['status'] == 'sent'
     except Exception as e:
         print(f"Error sending email: {e}")
         return False
-def get_db_connection():
-    conn = sqlite3.connect("./static/stock_data.db")
+def get_db_connection(db_path="./static/stock_data.db"):
+    # Delivery results are written from the SMTP threads, one at a time
+    # under DailyMailer's lock
+    conn = connect(db_path, check_same_thread=False)
     conn.row_factory = sqlite3.Row
     return conn
-def send_emails_to_all_subscribers():
+def create_email_deliveries_table(conn):
+    """
+    Create the email_deliveries table: the outcome of each day's email per
+    recipient, so a re-run of the job only retries the ones not yet sent.
+    """
+    conn.execute('''
+    CREATE TABLE IF NOT EXISTS email_deliveries (
+        send_date TEXT NOT NULL,
+        email TEXT NOT NULL,
+        status TEXT NOT NULL,
+        attempts INTEGER NOT NULL,
+        error TEXT,
+        updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+        PRIMARY KEY (send_date, email)
+    )
+    ''')
+    conn.commit()
+def send_emails_to_all_subscribers(db_path="./static/stock_data.db", host=SMTP_HOST, port=SMTP_PORT,
+                                   sessions=SMTP_SESSIONS):
     # Get database connection
-    conn = get_db_connection()
+    conn = get_db_connection(db_path)
     cursor = conn.cursor()
-    
+
     try:
-        # Get all email addresses
-        cursor.execute('SELECT email FROM email_subscriptions')
-        subscribers = cursor.fetchall()
-        
-        if not subscribers:
-            print("No subscribers found in the database.")
-            return
-        
+        create_email_deliveries_table(conn)
         # Get current date for email subject
         current_date = datetime.now().strftime("%Y-%m-%d")
         subject = f"StockWise Daily Analysis - {current_date}"
-        
-        # Counter for successful and failed sends
-        successful = 0
-        failed = 0
-        
-        print(f"\nSending emails to {len(subscribers)} subscribers...")
+
+        # Get all email addresses not yet sent today's email
+        cursor.execute('''
+            SELECT email FROM email_subscriptions
+            WHERE email NOT IN (
+                SELECT email FROM email_deliveries WHERE send_date = ? AND status = 'sent'
+            )
+        ''', (current_date,))
+        subscribers = [sub['email'] for sub in cursor.fetchall()]
+
+        if not subscribers:
+            print("No subscribers left to send to.")
+            return
+
+        # Build the message once for everyone
+        with open(HTML_PATH, 'r') as f:
+            message = build_message(subject, f.read())
+
+        print(f"\nSending emails to {len(subscribers)} subscribers over {min(sessions, len(subscribers))} SMTP sessions...")
         print("-" * 60)
-        
-        # Send email to each subscriber
-        for sub in subscribers:
-            email = sub['email']
-            print(f"Sending to: {email}...")
-            
-            if send_email(email, subject):
-                successful += 1
-                print(f"✓ Successfully sent to {email}")
+
+        def report(result):
+            # Record each recipient's delivery status as soon as it is known,
+            # so a crash mid-run does not resend to those already done
+            with conn:
+                conn.execute('''
+                    INSERT OR REPLACE INTO email_deliveries (send_date, email, status, attempts, error)
+                    VALUES (?, ?, ?, ?, ?)
+                ''', (current_date, result['email'], result['status'], result['attempts'], result['error']))
+            if result['status'] == 'sent':
+                print(f"✓ Successfully sent to {result['email']}")
             else:
-                failed += 1
-                print(f"✗ Failed to send to {email}")
-            
-            print("-" * 60)
-        
+                print(f"✗ Failed to send to {result['email']} after {result['attempts']} attempt(s): {result['error']}")
+
+        start = time.perf_counter()
+        results = DailyMailer(host, port, sessions).send(subscribers, message, on_result=report)
+
+        # Counter for successful and failed sends
+        successful = sum(1 for r in results if r['status'] == 'sent')
+        failed = len(results) - successful
+
         # Print summary
-        print(f"\nEmail sending complete:")
+        print("-" * 60)
+        print(f"\nEmail sending complete in {time.perf_counter() - start:.1f}s:")
         print(f"Successful: {successful}")
         print(f"Failed: {failed}")
         print(f"Total attempted: {len(subscribers)}\n")
-        
+
     except Exception as e:
         print(f"Error in send_emails_to_all_subscribers: {e}")
-    
+
     finally:
         conn.close()
 
@@ -92,4 +281,4 @@ if __name__ == "__main__":
     send_email(
         "xiaozhiyong1988@gmail.com",
         f"StockWise Daily Volume Analysis - {current_date}"
-    )
\ No newline at end of file
+    )
@@ -1,12 +1,17 @@
 import os,sys
 sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
-from services import yfiance_local as yf
+from database import get_read_connection
+from services.price_cube import get_price_cube
+from services.analysis import add_indicators, ema_many, macd_2d
 from applications.schedule_jobs.url_configure import *
 
-from services.calculate_turnover_rate import get_latest_turnover_rate
+from services.calculate_turnover_rate import get_turnover_rates
+from services.fundamentals import load_fundamentals
 import pandas as pd
-import sqlite3
 import numpy as np
+import argparse
+from concurrent.futures import ProcessPoolExecutor
+from itertools import repeat
 from datetime import datetime
 import pytz
 #from post_filtered import run_post_process
@@ -81,7 +86,7 @@ def create_html_table_buypoint(df, title, filename):
 def get_market_cap(ticker):
     try:
         # Connect to the database
-        conn = sqlite3.connect('./static/stock_data.db')
+        conn = get_read_connection()
         cursor = conn.cursor()
 
          # Get column names
@@ -110,19 +115,6 @@ def get_market_cap(ticker):
         return None
 
 
-# Function to calculate EMA
-def ema(data, window):
-    return data.ewm(span=window, adjust=False).mean()
-
-# Function to calculate MACD
-def calculate_macd(data, slow=26, fast=12, signal=9):
-    ema_fast = data.ewm(span=fast, adjust=False).mean()
-    ema_slow = data.ewm(span=slow, adjust=False).mean()
-    macd = ema_fast - ema_slow
-    macd_signal = macd.ewm(span=signal, adjust=False).mean()
-    macd_hist = 2*(macd - macd_signal)
-    return macd, macd_signal, macd_hist
-
 # Function to calculate the nearest MACD histogram crossover
 def calculate_crossover_days(macd_hist):
     for i in range(len(macd_hist)-1, 0, -1):
@@ -133,59 +125,6 @@ def calculate_crossover_days(macd_hist):
     return None, ''
 
 
-def calculate_rsi(data, window):
-    """Calculate the Relative Strength Index (RSI) for a given window."""
-    delta = data['Close'].diff()
-    gain = (delta.where(delta > 0, 0)).rolling(window=window).mean()
-    loss = (-delta.where(delta < 0, 0)).rolling(window=window).mean()
-    rs = gain / loss
-    rsi = 100 - (100 / (1 + rs))
-    return rsi
-
-def calculate_wr(data, window):
-    """Calculate the Williams %R for a given window."""
-    highest_high = data['High'].rolling(window=window).max()
-    lowest_low = data['Low'].rolling(window=window).min()
-    wr = (highest_high - data['Close']) / (highest_high - lowest_low) * 100
-    return wr
-
-def calculate_kdj(data, period=9):
-    """Calculate kdj_k, kdj_d, and kdj_j for the KDJ indicator."""
-    # Calculate the lowest low and highest high over the specified period
-    low_min = data['Low'].rolling(window=period, min_periods=1).min()
-    high_max = data['High'].rolling(window=period, min_periods=1).max()
-
-    # Calculate K% (fast stochastic) and rename it to kdj_k
-    data['kdj_k'] = 100 * ((data['Close'] - low_min) / (high_max - low_min))
-
-    # Smooth kdj_k to get kdj_d by applying a moving average
-    data['kdj_d'] = data['kdj_k'].rolling(window=3, min_periods=1).mean()
-
-    # Calculate kdj_j as 3 * kdj_k - 2 * kdj_d
-    data['kdj_j'] = 3 * data['kdj_k'] - 2 * data['kdj_d']
-
-    return data[['kdj_k', 'kdj_d', 'kdj_j']]
-
-def add_technical_indicators(data):
-    """Calculate and add RSI and WR to the DataFrame."""
-    # Calculate RSI for 6, 12, and 24 periods
-    data['RSI_6'] = calculate_rsi(data, 6)
-    data['RSI_12'] = calculate_rsi(data, 12)
-    data['RSI_24'] = calculate_rsi(data, 24)
-
-    # Calculate Williams %R for 6 and 10 periods
-    data['WR_6'] = calculate_wr(data, 6)
-    data['WR_10'] = calculate_wr(data, 10)
-
-    # Ensure you have the volume data in your DataFrame
-    if 'Volume' not in data.columns:
-        raise ValueError("The DataFrame must contain a 'Volume' column.")
-    # Ensure the DataFrame contains volume data
-    # Calculate KDJ and merge with the main data
-    kdj_data = calculate_kdj(data)
-    data = pd.concat([data, kdj_data], axis=1)
-    return data
-
 def find_buy_sell_points(x_valid,y_valid,hist_valid):
     # Initialize lists to hold the buy and sell points
     buy_points = []
@@ -393,7 +332,156 @@ def analyze_stocks(df):
         print(f"Error in analyze_stocks: {str(e)}")
         return [], []  # Return empty lists in case of error
 
-def analyze_and_plot_stocks(today, future_days=0):
+def macd_candidates(cube, today_date, future_days=0):
+    """
+    Tickers that can pass the MACD/EMA checks in analyze_and_plot_stocks,
+    evaluated for the whole cube at once with the vectorized indicators.
+
+    The per-ticker loop still applies every check; this only lets it skip
+    the tickers that would be rejected anyway before looking them up.
+    """
+    stop = None if future_days == 0 else cube.dates.searchsorted(today_date)
+    close = cube.packed('close', stop=stop)
+    if close.shape[1] < 3:
+        return set()
+    _, _, hist = macd_2d(close)
+    ema_3, *other_emas = ema_many(close, range(3, 51, 2))
+
+    # Most recent MACD histogram crossover must be positive -> negative
+    cross_down = (hist[:, 1:] < 0) & (hist[:, :-1] >= 0)
+    cross_up = (hist[:, 1:] > 0) & (hist[:, :-1] <= 0)
+    crossed = cross_down | cross_up
+    has_cross = crossed.any(axis=1)
+    last_cross = crossed.shape[1] - 1 - np.argmax(crossed[:, ::-1], axis=1)
+    rows = np.arange(len(close))
+    crossover_days = crossed.shape[1] - last_cross
+
+    last3 = hist[:, -3:]
+    keep = (has_cross & cross_down[rows, last_cross] & (crossover_days <= 22) &
+            (last3[:, 0] <= 0) & (last3[:, -1] <= 0) &
+            (np.diff(last3, axis=1) > 0).all(axis=1) &
+            ((last3[:, -1] - last3[:, 0]) / 2 >= 0.15) &
+            ~(ema_3[:, -1:] < np.stack(other_emas)[:, :, -1].T).all(axis=1) &
+            ~(ema_3[:, -1] < ema_3[:, -2]))
+    return {symbol for symbol, ok in zip(cube.symbols, keep) if ok}
+
+def screen_ticker(stockticker, today, future_days):
+    """
+    Run the buy-point checks of analyze_and_plot_stocks for one ticker.
+
+    Returns its stock_data row as a dict, or None if it does not pass.
+    Module-level so ProcessPoolExecutor workers can run it; each process
+    takes the daily cube from get_price_cube (a forked worker inherits the
+    one the parent already loaded). The country filter and turnover rate
+    are applied by the caller from the local fundamentals table.
+    """
+    today_date = datetime.strptime(today, '%Y%m%d')
+    cube = get_price_cube('daily', period='6mo')
+    note = ''
+    data = cube.history(stockticker)
+    if len(data)==0: return None
+
+    try:
+        data.index = data.index.tz_localize(None)
+    except:
+        return None
+    # Filter data to only include up to `today`
+    if future_days ==0 :
+        data_for_check = data.copy()
+    else:
+        data_for_check = data[data.index < today_date].copy()
+    try:
+        today_close_price = data_for_check['Close'].iloc[-1]
+    except:
+        return None
+
+
+    # Calculate EMAs and MACD (services/analysis.py)
+    add_indicators(data_for_check, ['EMA', 'MACD'])
+    # Every indicator on the full range: EMAs, MACD, RSI, WR and KDJ
+    add_indicators(data)
+    
+    # Calculate the daily percentage change
+    data['Pct_Change'] = data['Close'].pct_change() * 100  # Convert to percentage
+
+    # Count the days with a decrease in the close price
+    decrease_days = (data['Pct_Change'] <= 0).sum()
+
+    # Calculate the total number of trading days
+    total_days = data['Pct_Change'].count()  # Ignore NaN from pct_change()
+
+    # Calculate the percentage of decrease days
+    decrease_percentage = (decrease_days / total_days) * 100
+    if decrease_percentage > 70: return None
+
+    # Proceed with your conditions and analysis logic here as before
+    # Calculate crossover days
+    last_crossover_idx, crossover_sign = calculate_crossover_days(data_for_check['MACD_hist'].values)
+    if last_crossover_idx is not None:
+        crossover_days = len(data_for_check) - last_crossover_idx
+    else:
+        crossover_days = 'N/A'
+
+    try:
+        MACD_hist_slope = (data_for_check['MACD_hist'].values[-1] - data_for_check['MACD_hist'].values[-3])/2
+    except:
+        return None
+    # Skip if not meeting criteria
+    if (crossover_sign != '-' or crossover_days == 'N/A' or
+        data_for_check['MACD_hist'].values[-3:][0] > 0 or 
+        data_for_check['MACD_hist'].values[-3:][-1] > 0 or
+        not all(np.diff(data_for_check['MACD_hist'].values[-3:]) > 0)):
+        return None
+
+    # Check EMA conditions
+    current_day_idx = -1
+    green_ema = data_for_check['EMA_3'].values[current_day_idx]
+    all_other_ema_values = [data_for_check[f'EMA_{window}'].values[current_day_idx] for window in range(5, 51, 2)]
+
+    if all(green_ema < ema_value for ema_value in all_other_ema_values):
+        note = 'GreenLow'
+        return None
+    ema_3_last_3 = data_for_check['EMA_3'].values[-3:]
+    if ema_3_last_3[-1] < ema_3_last_3[-2]:
+        return None
+    #if MACD_hist_slope <0.02:return None
+    if MACD_hist_slope <0.15:return None
+    if crossover_days>22:return None
+
+    meantrend = (data['RSI_6']+100-data['WR_6']+data['kdj_k'])/3
+    x_range = np.arange(len(data))
+    # Mask NaN values in 'WR_6' to get valid data points
+    meanWR = (data['WR_6']+data['WR_10'])/2
+    valid_mask = ~np.isnan(meanWR)
+    x_valid = x_range[valid_mask]           # Filtered x-values without NaNs
+    y_valid = meanWR[valid_mask]      # Filtered WR_6 values without NaNs
+    hist_valid = data['MACD_hist'][valid_mask]
+    buy_points,sell_points = find_buy_sell_points(x_valid,y_valid,hist_valid)
+    buy_points7,sell_points7 = find_buy_sell_points7(x_valid,meantrend[valid_mask],hist_valid)
+    nearest_buy = x_valid[-1]-buy_points[-1]
+    nearest_buy7 = x_valid[-1]-buy_points7[-1]
+    nearest_sell = x_valid[-1]-sell_points[-1]
+    nearest_sell7 = x_valid[-1]-sell_points7[-1]
+    min_buy = min(nearest_buy,nearest_buy7)
+    min_sell = min(nearest_sell,nearest_sell7)
+
+    if min_buy >4: return None
+    try:
+        market_cap = get_market_cap(stockticker)
+        if market_cap is None:
+            market_cap = 0  # or handle the error case as needed
+        return {
+            'ticker': stockticker,
+            'close_price': today_close_price,
+            'market_cap': market_cap/1000000000,  # Converting to billions
+            'volume': data['Volume'].iloc[-1],
+            'rsi_6': data['RSI_6'].iloc[-1],
+            'BP': min_buy
+        }
+    except:
+        return None
+
+def analyze_and_plot_stocks(today, future_days=0, workers=1):
     # Define the number of future days to plot after today
     #future_days = 0  # Adjust as needed
     realtoday = datetime.today()
@@ -407,10 +495,30 @@ def analyze_and_plot_stocks(today, future_days=0):
     screener = pd.read_csv("./nasdaq_screener.csv")
     tickers = screener['Symbol']
     print(f"Loaded {len(tickers)} tickers from CSV file")
+    cube = get_price_cube('daily', period='6mo')
+    candidates = macd_candidates(cube, today_date, future_days)
+
+    # Only tickers that can pass the MACD/EMA checks are screened one by one;
+    # the country comes from the local fundamentals table
+    countries = load_fundamentals()['country']
+    selected = [ticker for ticker in tickers
+                if ticker in candidates and countries.get(ticker) != 'China']
+    print(f"{len(selected)} tickers pass the MACD/EMA prefilter, screening with {workers} worker(s)")
+
+    if workers > 1 and len(selected) > 1:
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            # map() yields results in submission order, so the merged rows
+            # keep the CSV order whatever order the shards finish in
+            rows = list(executor.map(screen_ticker, selected, repeat(today), repeat(future_days),
+                                     chunksize=max(1, len(selected) // (workers * 4))))
+    else:
+        rows = []
+        for idx, stockticker in enumerate(selected, start=1):
+            print(f'{idx}/{len(selected)}       \r',end='')
+            rows.append(screen_ticker(stockticker, today, future_days))
 
     total_stocks = len(tickers)
     tot_filtered = 0
-    sel_idx=0
     # Create an empty DataFrame before the loop
     stock_data = pd.DataFrame(columns=['ticker', 
                                        'close_price',
@@ -419,144 +527,19 @@ def analyze_and_plot_stocks(today, future_days=0):
                                        'turnover_rate',
                                        'rsi_6',
                                        'BP'])
-    for idx, stockticker in enumerate(tickers, start=1):
-        #if idx<415:
-        #    continue
-        print(f'{idx}/{len(tickers)}       \r',end='')
-        note = ''
-        stock = yf.Ticker(stockticker)
-        data = stock.history(period="6mo")
-        if len(data)==0: continue
-
-        # Get the info dictionary, which sometimes contains the 'country' key
-        market_cap = 0
-        try:
-            info = stock.info
-            market_cap = info.get('marketCap')
-            country = info.get("country", "Country information not available")
-            if country=='China':continue
-        except:
-            pass
-
-        try:
-            data.index = data.index.tz_localize(None)
-        except:
-            continue
-        # Filter data to only include up to `today`
-        if future_days ==0 :
-            data_for_check = data.copy()
-        else:
-            data_for_check = data[data.index < today_date].copy()
-        try:
-            today_close_price = data_for_check['Close'].iloc[-1]
-        except:
-            continue
-
-
-        # Calculate EMAs and MACD
-        for window in range(3, 26, 2):
-            data_for_check[f'EMA_{window}'] = ema(data_for_check['Close'], window)
-        for window in range(27, 52, 2):
-            data_for_check[f'EMA_{window}'] = ema(data_for_check['Close'], window)
-        data_for_check['MACD'], data_for_check['MACD_signal'], data_for_check['MACD_hist'] = calculate_macd(data_for_check['Close'])
-
-        # Calculate EMAs and MACD
-        for window in range(3, 26, 2):
-            data[f'EMA_{window}'] = ema(data['Close'], window)
-        for window in range(27, 52, 2):
-            data[f'EMA_{window}'] = ema(data['Close'], window)
-        data['MACD'], data['MACD_signal'], data['MACD_hist'] = calculate_macd(data['Close'])
-        
-        # Calculate the daily percentage change
-        data['Pct_Change'] = data['Close'].pct_change() * 100  # Convert to percentage
-
-        # Count the days with a decrease in the close price
-        decrease_days = (data['Pct_Change'] <= 0).sum()
-
-        # Calculate the total number of trading days
-        total_days = data['Pct_Change'].count()  # Ignore NaN from pct_change()
-
-        # Calculate the percentage of decrease days
-        decrease_percentage = (decrease_days / total_days) * 100
-        if decrease_percentage > 70: continue
-
-        # Proceed with your conditions and analysis logic here as before
-        # Calculate crossover days
-        last_crossover_idx, crossover_sign = calculate_crossover_days(data_for_check['MACD_hist'].values)
-        if last_crossover_idx is not None:
-            crossover_days = len(data_for_check) - last_crossover_idx
-        else:
-            crossover_days = 'N/A'
-
-        try:
-            MACD_hist_slope = (data_for_check['MACD_hist'].values[-1] - data_for_check['MACD_hist'].values[-3])/2
-        except:
-            continue
-        # Skip if not meeting criteria
-        if (crossover_sign != '-' or crossover_days == 'N/A' or
-            data_for_check['MACD_hist'].values[-3:][0] > 0 or 
-            data_for_check['MACD_hist'].values[-3:][-1] > 0 or
-            not all(np.diff(data_for_check['MACD_hist'].values[-3:]) > 0)):
-            continue
-
-        # Check EMA conditions
-        current_day_idx = -1
-        green_ema = data_for_check['EMA_3'].values[current_day_idx]
-        all_other_ema_values = [data_for_check[f'EMA_{window}'].values[current_day_idx] for window in range(5, 51, 2)]
-
-        if all(green_ema < ema_value for ema_value in all_other_ema_values):
-            note = 'GreenLow'
-            continue
-        ema_3_last_3 = data_for_check['EMA_3'].values[-3:]
-        if ema_3_last_3[-1] < ema_3_last_3[-2]:
-            continue
-        #if MACD_hist_slope <0.02:continue
-        if MACD_hist_slope <0.15:continue
-        if crossover_days>22:continue
-
-        add_technical_indicators(data)
-        meantrend = (data['RSI_6']+100-data['WR_6']+data['kdj_k'])/3
-        x_range = np.arange(len(data))
-        # Mask NaN values in 'WR_6' to get valid data points
-        meanWR = (data['WR_6']+data['WR_10'])/2
-        valid_mask = ~np.isnan(meanWR)
-        x_valid = x_range[valid_mask]           # Filtered x-values without NaNs
-        y_valid = meanWR[valid_mask]      # Filtered WR_6 values without NaNs
-        hist_valid = data['MACD_hist'][valid_mask]
-        buy_points,sell_points = find_buy_sell_points(x_valid,y_valid,hist_valid)
-        buy_points7,sell_points7 = find_buy_sell_points7(x_valid,meantrend[valid_mask],hist_valid)
-        nearest_buy = x_valid[-1]-buy_points[-1]
-        nearest_buy7 = x_valid[-1]-buy_points7[-1]
-        nearest_sell = x_valid[-1]-sell_points[-1]
-        nearest_sell7 = x_valid[-1]-sell_points7[-1]
-        min_buy = min(nearest_buy,nearest_buy7)
-        min_sell = min(nearest_sell,nearest_sell7)
-
-        if min_buy >4: continue
-        sel_idx+=1
+    rows = [row for row in rows if row is not None]
+    # Local volume / share count from the fundamentals table, no network calls
+    turnover = get_turnover_rates(cube, [row['ticker'] for row in rows]).fillna(0)
+    for row in rows:
+        row['turnover_rate'] = turnover[row['ticker']]
         tot_filtered += 1
-        try:
-            market_cap = get_market_cap(stockticker)
-            if market_cap is None:
-                market_cap = 0  # or handle the error case as needed
-            print(f'|{sel_idx:>4}/{total_stocks}|{stockticker:<5}|f:{tot_filtered:<2}|{market_cap/1000000000:<3.1f}B|BP:{min_buy}')
-            # Inside your main filtering loop, update the stock_data DataFrame creation:
-            stock_data.loc[len(stock_data)] = {
-                'ticker': stockticker,
-                'close_price': today_close_price,
-                'market_cap': market_cap/1000000000,  # Converting to billions
-                'volume': data['Volume'].iloc[-1],
-                'turnover_rate': get_latest_turnover_rate(stockticker)['turnover_rate'],
-                'rsi_6': data['RSI_6'].iloc[-1],
-                'BP': min_buy
-            }
-        except:
-            pass
+        print(f"|{tot_filtered:>4}/{total_stocks}|{row['ticker']:<5}|f:{tot_filtered:<2}|{row['market_cap']:<3.1f}B|BP:{row['BP']}")
+        stock_data.loc[len(stock_data)] = row
     
     analyze_stocks(stock_data)
 
 
-def filter_stock(deploy_mode, manual_date=None):
+def filter_stock(deploy_mode, manual_date=None, workers=1):
     edt = pytz.timezone('America/New_York')
     if deploy_mode == 1:  # auto deploy mode
         today = datetime.now(edt).strftime('%Y%m%d')
@@ -572,30 +555,30 @@ def filter_stock(deploy_mode, manual_date=None):
         print('today (develop mode):', today)
     
     # Run first function
-    analyze_and_plot_stocks(today, future_days=0)
+    analyze_and_plot_stocks(today, future_days=0, workers=workers)
     
 
 
 if __name__ == "__main__":
-    if len(sys.argv) > 1:
-        mode = int(sys.argv[1])
-        if mode == 2:
-            if len(sys.argv) != 3:
-                print("Error: Manual mode requires a date parameter in YYYYMMDD format")
-                print("Usage: script.py 2 YYYYMMDD")
-                sys.exit(1)
-            manual_date = sys.argv[2]
-            # Basic date format validation
-            if not (len(manual_date) == 8 and manual_date.isdigit()):
-                print("Error: Date must be in YYYYMMDD format")
-                sys.exit(1)
-            filter_stock(2, manual_date)
-        elif mode == 1:
-            filter_stock(1)
-        elif mode == 0:
-            filter_stock(0)
-        else:
-            print("Error: Invalid mode. Use 0 (develop), 1 (auto deploy), or 2 (manual deploy)")
+    parser = argparse.ArgumentParser(usage="script.py [0|1|2] [YYYYMMDD] [--workers N]")
+    parser.add_argument('mode', nargs='?', type=int, default=0)
+    parser.add_argument('manual_date', nargs='?')
+    parser.add_argument('--workers', type=int, default=1,
+                        help="processes for the per-ticker screening (default: 1, serial)")
+    args = parser.parse_args()
+    if args.mode == 2:
+        if args.manual_date is None:
+            print("Error: Manual mode requires a date parameter in YYYYMMDD format")
+            print("Usage: script.py 2 YYYYMMDD")
+            sys.exit(1)
+        manual_date = args.manual_date
+        # Basic date format validation
+        if not (len(manual_date) == 8 and manual_date.isdigit()):
+            print("Error: Date must be in YYYYMMDD format")
             sys.exit(1)
+        filter_stock(2, manual_date, workers=args.workers)
+    elif args.mode in (0, 1):
+        filter_stock(args.mode, workers=args.workers)
     else:
-        filter_stock(0)
\ No newline at end of file
+        print("Error: Invalid mode. Use 0 (develop), 1 (auto deploy), or 2 (manual deploy)")
+        sys.exit(1)
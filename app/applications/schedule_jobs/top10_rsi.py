@@ -1,11 +1,13 @@
 import os
 import sys
-import sqlite3
 import pandas as pd
 sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 from services import yfiance_local as yf
+from database import get_read_connection
+from services.price_cube import get_price_cube
+from services.indicator_state import get_latest_rsi
 from applications.schedule_jobs.url_configure import *
-from services.calculate_turnover_rate import get_latest_turnover_rate
+from services.calculate_turnover_rate import get_turnover_rates
 import warnings
 warnings.filterwarnings("ignore")
 
@@ -73,7 +75,7 @@ def create_html_table_rsi(df):
     return html
 
 def get_tickers_and_mcap():
-    conn = sqlite3.connect('./static/stock_data.db')
+    conn = get_read_connection()
     query = "SELECT Symbol, Market_Cap FROM nasdaq_screener"
     df = pd.read_sql_query(query, conn)
     conn.close()
@@ -92,19 +94,23 @@ def calculate_rsi(data, window):
     rsi = 100 - (100 / (1 + rs))
     return rsi
 
-def calculate_metrics(ticker):
+def calculate_metrics(ticker, cube=None, latest_rsi=None):
     try:
-        stock = yf.Ticker(ticker)
-        data = stock.history(period="3mo")  # More data for reliable RSI
+        if cube is not None:
+            data = cube.history(ticker, period="3mo")  # More data for reliable RSI
+        else:
+            stock = yf.Ticker(ticker)
+            data = stock.history(period="3mo")  # More data for reliable RSI
         if len(data) < 7:  # Need enough data for RSI calculation
             return None
             
-        data['RSI'] = calculate_rsi(data, window=6)
+        if latest_rsi is None:
+            data['RSI'] = calculate_rsi(data, window=6)
         
         today_volume = data['Volume'].iloc[-1]
         today_price = data['Close'].iloc[-1]
         today_trading_value = today_price * today_volume
-        current_rsi = data['RSI'].iloc[-1]
+        current_rsi = latest_rsi[ticker] if latest_rsi is not None else data['RSI'].iloc[-1]
         
         return {
             'rsi': current_rsi,
@@ -120,13 +126,15 @@ def calculate_metrics(ticker):
 def analyze_rsi():
     print("Fetching tickers from database...")
     stocks_df = get_tickers_and_mcap()
+    cube = get_price_cube('daily', period='6mo')
+    latest_rsi = get_latest_rsi(cube, window=6, zero_loss_rs=100)
     results = []
     
     total_stocks = len(stocks_df)
     for idx, (ticker, mcap) in enumerate(zip(stocks_df['Symbol'], stocks_df['Market_Cap']), 1):
         print(f'Processing {idx}/{total_stocks}: {ticker}\r', end='')
         
-        metrics = calculate_metrics(ticker)
+        metrics = calculate_metrics(ticker, cube, latest_rsi)
         if metrics:
             # Calculate trading value
             trading_value = metrics['today_price'] * metrics['today_volume']
@@ -149,10 +157,8 @@ def analyze_rsi():
     
     # Now get turnover rates only for top 10 stocks
     print("\nGetting turnover rates for top 10 stocks...")
-    turnover_rates = []
-    for ticker in top_10_df['ticker']:
-        turnover_info = get_latest_turnover_rate(ticker)
-        turnover_rates.append(turnover_info['turnover_rate'] if turnover_info else 0)
+    # Local volume / share count from the fundamentals table, no network calls
+    turnover_rates = get_turnover_rates(cube, top_10_df['ticker']).fillna(0).values
     
     # Add turnover rates to top 10 dataframe
     top_10_df['turnover_rate'] = turnover_rates
@@ -1,11 +1,13 @@
 import os
 import sys
-import sqlite3
 import pandas as pd
 sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 from services import yfiance_local as yf
+from database import get_read_connection
+from services.price_cube import get_price_cube
+from services.indicator_state import get_latest_rsi
 from applications.schedule_jobs.url_configure import *
-from services.calculate_turnover_rate import get_latest_turnover_rate
+from services.calculate_turnover_rate import get_turnover_rates
 from datetime import datetime
 import pytz
 import warnings
@@ -13,7 +15,7 @@ warnings.filterwarnings("ignore")
 
 def get_tickers_and_mcap():
     """Get all stock tickers and market caps from database."""
-    conn = sqlite3.connect('./static/stock_data.db')
+    conn = get_read_connection()
     query = "SELECT Symbol, Market_Cap FROM nasdaq_screener"
     df = pd.read_sql_query(query, conn)
     conn.close()
@@ -32,16 +34,20 @@ def calculate_rsi(data, window):
     rsi = 100 - (100 / (1 + rs))
     return rsi
 
-def calculate_metrics(ticker):
+def calculate_metrics(ticker, cube=None, latest_rsi=None):
     """Calculate all required metrics for a given ticker."""
     try:
-        stock = yf.Ticker(ticker)
-        data = stock.history(period="3mo")
+        if cube is not None:
+            data = cube.history(ticker, period="3mo")
+        else:
+            stock = yf.Ticker(ticker)
+            data = stock.history(period="3mo")
         if len(data) < 7:  # Need enough data for calculations
             return None
             
         # Calculate RSI
-        data['RSI'] = calculate_rsi(data, window=6)
+        if latest_rsi is None:
+            data['RSI'] = calculate_rsi(data, window=6)
         
         # Get latest metrics
         today_volume = data['Volume'].iloc[-1]
@@ -57,7 +63,7 @@ def calculate_metrics(ticker):
         return {
             'today_price': today_price,
             'today_volume': today_volume,
-            'rsi': data['RSI'].iloc[-1],
+            'rsi': latest_rsi[ticker] if latest_rsi is not None else data['RSI'].iloc[-1],
             'trading_value': trading_value,
             'volume_change': volume_change
         }
@@ -133,13 +139,15 @@ def create_html_table(df):
 def analyze_volume():
     print("Fetching tickers from database...")
     stocks_df = get_tickers_and_mcap()
+    cube = get_price_cube('daily', period='6mo')
+    latest_rsi = get_latest_rsi(cube, window=6, zero_loss_rs=100)
     results = []
     
     total_stocks = len(stocks_df)
     for idx, (ticker, mcap) in enumerate(zip(stocks_df['Symbol'], stocks_df['Market_Cap']), 1):
         print(f'Processing {idx}/{total_stocks}: {ticker}\r', end='')
         
-        metrics = calculate_metrics(ticker)
+        metrics = calculate_metrics(ticker, cube, latest_rsi)
         
         if metrics and metrics['trading_value'] > 1000000:  # Filter by trading value > 1M
             # Make sure all keys match the column names we'll use later
@@ -160,10 +168,8 @@ def analyze_volume():
     
     # Get turnover rates for top 10 stocks only
     print("\nGetting turnover rates for top 10 stocks...")
-    turnover_rates = []
-    for ticker in top_10_df['ticker']:
-        turnover_info = get_latest_turnover_rate(ticker)
-        turnover_rates.append(turnover_info['turnover_rate'] if turnover_info else 0)
+    # Local volume / share count from the fundamentals table, no network calls
+    turnover_rates = get_turnover_rates(cube, top_10_df['ticker']).fillna(0).values
     
     # Add turnover rates to top 10 dataframe
     top_10_df['turnover_rate'] = turnover_rates
@@ -7,17 +7,21 @@ import pandas as pd
 import os,sys
 sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 from services import yfiance_local as yf
+from services.price_cube import get_price_cube
 
 # Function to calculate EMA
 def ema(data, window):
     return data.ewm(span=window, adjust=False).mean()
 
-def stock_9classes(stockticker,plot): 
+def stock_9classes(stockticker,plot,cube=None): 
     today_date = datetime.today()
     #today_date_str = datetime.strptime(today_date, '%Y%m%d')
 
-    stock = yf.Ticker(stockticker)
-    data = stock.history(period="6mo")
+    if cube is not None:
+        data = cube.history(stockticker, period="6mo")
+    else:
+        stock = yf.Ticker(stockticker)
+        data = stock.history(period="6mo")
 
     # Calculate EMAs
     selections = [5,13,21,34,55,89,144,233]
@@ -84,6 +88,7 @@ def get_stocks_by_industry():
         total_industries = len(industry_stocks)
         total_stocks = sum(len(stocks) for stocks in industry_stocks.values())
         industry_averages = []
+        cube = get_price_cube('daily', period='6mo')
         # Print stocks grouped by industry with counts and percentages
         for i, (industry, symbols) in enumerate(sorted(industry_stocks.items()), 1):
             #if i>=5:break
@@ -96,7 +101,7 @@ def get_stocks_by_industry():
             stocksname = "Symbols:", " | ".join(sorted(symbols))
             classes = []
             for symbol in symbols:
-                class_value = stock_9classes(symbol,plot=0)
+                class_value = stock_9classes(symbol,plot=0,cube=cube)
                 if class_value != 0 :
                     classes.append(class_value)
                 #print(f'{symbol}:{class_value}')
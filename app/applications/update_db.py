@@ -1,9 +1,20 @@
 import sqlite3
 import yfinance as yf
 import pandas as pd
+import numpy as np
 from datetime import datetime, timedelta
-import time 
-import os
+import os,sys
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from services.download_scheduler import DownloadScheduler, RateLimitError, RetryQueue
+from services.indicator_state import update_indicator_state
+from services.latest_bars import update_latest_bars
+from services.trading_dates import create_trading_dates_table, record_trading_dates, remove_weekend_bars
+from services.weekly_snapshot import refresh_weekly_snapshot
+from services.cache import publish_data_version
+from services.history_archive import update_archive
+from database import connect, migrate_to_compact_schema, symbol_ids, to_day, day_sql, TIMEFRAME_IDS
+
+RETRY_QUEUE_PATH = './static/logs/download_retry_queue.json'
 
 class LogManager:
     def __init__(self, log_file_path):
@@ -41,19 +52,14 @@ def get_stocks_to_update(db_path):
     conn = sqlite3.connect(db_path)
     cursor = conn.cursor()
     
+    # One primary-key probe per dictionary symbol
     cursor.execute("""
-        SELECT COUNT(DISTINCT symbol)
-        FROM stock_prices
-        WHERE timeframe = 'weekly'
-    """)
-    total_stocks = cursor.fetchone()[0]
-    
-    cursor.execute("""
-        SELECT DISTINCT symbol
-        FROM stock_prices
-        WHERE timeframe = 'weekly'
-    """)
+        SELECT symbol
+        FROM symbols s
+        WHERE EXISTS (SELECT 1 FROM stock_bars b WHERE b.symbol_id = s.id AND b.timeframe = ?)
+    """, (TIMEFRAME_IDS['weekly'],))
     stocks = [row[0] for row in cursor.fetchall()]
+    total_stocks = len(stocks)
     
     conn.close()
     return stocks, total_stocks
@@ -63,9 +69,9 @@ def check_existing_records(conn, symbol, date, timeframe):
     cursor = conn.cursor()
     cursor.execute("""
         SELECT COUNT(*)
-        FROM stock_prices
-        WHERE symbol = ? AND date = ? AND timeframe = ?
-    """, (symbol, date, timeframe))
+        FROM stock_bars
+        WHERE symbol_id = (SELECT id FROM symbols WHERE symbol = ?) AND timeframe = ? AND day = ?
+    """, (symbol, TIMEFRAME_IDS[timeframe], to_day(date)))
     count = cursor.fetchone()[0]
     return count > 0
 
@@ -74,9 +80,9 @@ def verify_insertion(conn, symbol, date, timeframe):
     cursor = conn.cursor()
     cursor.execute("""
         SELECT *
-        FROM stock_prices
-        WHERE symbol = ? AND date = ? AND timeframe = ?
-    """, (symbol, date, timeframe))
+        FROM stock_bars
+        WHERE symbol_id = (SELECT id FROM symbols WHERE symbol = ?) AND timeframe = ? AND day = ?
+    """, (symbol, TIMEFRAME_IDS[timeframe], to_day(date)))
     data = cursor.fetchone()
     return data is not None
 
@@ -100,35 +106,80 @@ def get_date_ranges(period='current'):
     
     return start_date, end_date, is_friday
 
+def get_expected_trading_days(start_date, end_date):
+    """List the 'YYYY-MM-DD' weekdays in [start_date, end_date] that are not holidays."""
+    delta = end_date - start_date
+    days = (start_date + timedelta(days=i) for i in range(delta.days + 1))
+    return [day.strftime('%Y-%m-%d') for day in days
+            if day.weekday() < 5 and not is_holiday(day)]
+
 def check_data_completeness(conn, symbol, start_date, end_date, timeframe):
     """Check if we have complete data for the given period."""
     cursor = conn.cursor()
     
-    start_str = start_date.strftime('%Y-%m-%d')
-    end_str = end_date.strftime('%Y-%m-%d')
-    
     cursor.execute("""
-        SELECT COUNT(DISTINCT date)
-        FROM stock_prices
-        WHERE symbol = ? 
+        SELECT COUNT(*)
+        FROM stock_bars
+        WHERE symbol_id = (SELECT id FROM symbols WHERE symbol = ?)
         AND timeframe = ?
-        AND date BETWEEN ? AND ?
-    """, (symbol, timeframe, start_str, end_str))
+        AND day BETWEEN ? AND ?
+    """, (symbol, TIMEFRAME_IDS[timeframe], to_day(start_date), to_day(end_date)))
     
     existing_days = cursor.fetchone()[0]
     
     if timeframe == 'daily':
-        delta = end_date - start_date
-        expected_days = sum(1 for i in range(delta.days + 1) 
-                          if (start_date + timedelta(days=i)).weekday() < 5 
-                          and not is_holiday(start_date + timedelta(days=i)))
+        expected_days = len(get_expected_trading_days(start_date, end_date))
     else:
         expected_days = 1
         
     return existing_days >= expected_days
 
-def download_batch_data(symbols, start_date, end_date, interval):
-    """Download data for multiple symbols in a single API call."""
+def plan_updates(conn, symbols, start_date, end_date, is_friday):
+    """
+    Work out which symbols need downloading for the window with one grouped query.
+
+    The daily bars present per symbol are compared against the expected
+    trading-day calendar, and on Fridays a symbol also needs an update if it
+    has no weekly bar in the window.
+
+    Returns:
+        tuple: (symbols_to_fetch: list, missing_days: dict of symbol -> sorted
+        list of missing daily dates)
+    """
+    expected_days = set(get_expected_trading_days(start_date, end_date))
+
+    # Range scans of idx_stock_bars_day, one per timeframe
+    cursor = conn.cursor()
+    present = {'daily': {}, 'weekly': {}}
+    for timeframe in present:
+        cursor.execute(f"""
+            SELECT s.symbol, GROUP_CONCAT({day_sql('b.day')})
+            FROM stock_bars b
+            JOIN symbols s ON s.id = b.symbol_id
+            WHERE b.timeframe = ?
+            AND b.day BETWEEN ? AND ?
+            GROUP BY b.symbol_id
+        """, (TIMEFRAME_IDS[timeframe], to_day(start_date), to_day(end_date)))
+        for symbol, dates in cursor.fetchall():
+            present[timeframe][symbol] = set(dates.split(',')) if dates else set()
+
+    symbols_to_fetch = []
+    missing_days = {}
+    for symbol in symbols:
+        missing = expected_days - present['daily'].get(symbol, set())
+        need_weekly = is_friday and not present['weekly'].get(symbol)
+        if missing or need_weekly:
+            symbols_to_fetch.append(symbol)
+            missing_days[symbol] = sorted(missing)
+
+    return symbols_to_fetch, missing_days
+
+def download_batch_data(symbols, start_date, end_date, interval, raise_on_rate_limit=False):
+    """Download data for multiple symbols in a single API call.
+
+    With raise_on_rate_limit=True a 429 raises RateLimitError instead of
+    returning None, so the download scheduler can back off and retry.
+    """
     try:
         data = yf.download(
             tickers=symbols,
@@ -146,18 +197,128 @@ def download_batch_data(symbols, start_date, end_date, interval):
     except Exception as e:
         print(f"Full error details: {e.__class__.__name__}: {str(e)}")
         if "Too many requests" in str(e) or "429" in str(e):
+            if raise_on_rate_limit:
+                raise RateLimitError(str(e))
             return None
         if "timezone" in str(e).lower():
             return None
         raise e
 
-def process_batch_data(data, timeframe, conn, logger):
+PRICE_FIELDS = ['Open', 'High', 'Low', 'Close', 'Volume', 'Dividends', 'Stock Splits']
+
+BAR_COLUMNS = "(symbol_id, timeframe, day, open, high, low, close, volume, dividends, stock_splits)"
+
+INSERT_SQL = f"""
+    INSERT OR IGNORE INTO stock_bars {BAR_COLUMNS}
+    VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+"""
+
+UPSERT_SQL = f"""
+    INSERT INTO stock_bars {BAR_COLUMNS}
+    VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+    ON CONFLICT(symbol_id, timeframe, day) DO UPDATE SET
+        open = excluded.open,
+        high = excluded.high,
+        low = excluded.low,
+        close = excluded.close,
+        volume = excluded.volume,
+        dividends = excluded.dividends,
+        stock_splits = excluded.stock_splits
+    WHERE stock_bars.open IS NOT excluded.open
+       OR stock_bars.high IS NOT excluded.high
+       OR stock_bars.low IS NOT excluded.low
+       OR stock_bars.close IS NOT excluded.close
+       OR stock_bars.volume IS NOT excluded.volume
+       OR stock_bars.dividends IS NOT excluded.dividends
+       OR stock_bars.stock_splits IS NOT excluded.stock_splits
+"""
+
+def reshape_batch_data(data, timeframe):
+    """
+    Flatten a yfinance (ticker, field) MultiIndex frame into row tuples
+    matching the stock_prices column order.
+
+    Each field is pulled out as one dates x symbols block, so the whole
+    batch is reshaped with a handful of numpy operations instead of a
+    DataFrame per symbol. Bars with no close price (symbols that did not
+    trade on a date present for the other symbols) and bars dated on a
+    weekend are dropped, so stock_prices never holds weekend rows.
+    """
+    if data is None or data.empty:
+        return []
+
+    symbols = list(dict.fromkeys(col[0] for col in data.columns))
+    index = pd.DatetimeIndex(data.index)
+    dates = index.strftime('%Y-%m-%d').to_numpy()
+    weekday = np.repeat(index.weekday < 5, len(symbols))
+
+    blocks = {}
+    for field in PRICE_FIELDS:
+        if field in data.columns.get_level_values(1):
+            block = data.xs(field, axis=1, level=1).reindex(columns=symbols)
+            blocks[field] = block.to_numpy(dtype=float)
+        else:
+            blocks[field] = np.zeros((len(dates), len(symbols)))
+
+    n_dates, n_symbols = len(dates), len(symbols)
+    date_col = np.repeat(dates, n_symbols)
+    symbol_col = np.tile(np.array(symbols, dtype=object), n_dates)
+    valid = ~np.isnan(blocks['Close'].ravel()) & weekday
+
+    columns = [date_col[valid], symbol_col[valid], np.full(valid.sum(), timeframe, dtype=object)]
+    for field in PRICE_FIELDS:
+        values = blocks[field].ravel()[valid]
+        if field == 'Volume':
+            values = np.nan_to_num(values).astype(np.int64)
+        values = values.astype(object)
+        values[pd.isna(values)] = None
+        columns.append(values)
+
+    return list(zip(*(col.tolist() for col in columns)))
+
+def to_bar_rows(conn, rows):
+    """Swap the (date, symbol, timeframe) text key of reshaped rows for stock_bars ids"""
+    ids = symbol_ids(conn, (row[1] for row in rows), create=True)
+    return [(ids[row[1]], TIMEFRAME_IDS[row[2]], to_day(row[0]), *row[3:]) for row in rows]
+
+def upsert_batch_data(conn, rows):
+    """
+    Write reshaped rows with two executemany passes over stock_bars.
+
+    Returns (inserted, updated). INSERT OR IGNORE adds the new bars (its
+    rowcount is the inserted count); the upsert then only touches existing
+    bars whose values changed (the just-inserted ones are identical), so
+    its rowcount is the updated count. Both are primary-key lookups; no
+    re-read of the written rows.
+    """
+    if not rows:
+        return 0, 0
+
+    bars = to_bar_rows(conn, rows)
+    cursor = conn.cursor()
+    cursor.executemany(INSERT_SQL, bars)
+    inserted = cursor.rowcount
+    cursor.executemany(UPSERT_SQL, bars)
+    return inserted, cursor.rowcount
+
+def process_batch_data(data, timeframe, conn, logger, bulk=True):
     """Process and insert batch data into database."""
-    records_added = 0
-    
     if data is None or data.empty:
         return 0
 
+    if bulk:
+        try:
+            rows = reshape_batch_data(data, timeframe)
+            inserted, updated = upsert_batch_data(conn, rows)
+            record_trading_dates(conn, timeframe, [row[0] for row in rows])
+            logger.log(f"Upserted {len(rows)} {timeframe} bars: {inserted} inserted, {updated} updated")
+            return inserted
+        except Exception as e:
+            logger.log(f"Error upserting {timeframe} batch: {str(e)}")
+            return 0
+
+    records_added = 0
+
     # Get list of symbols from the multi-level columns
     symbols = list(set([col[0] for col in data.columns]))
     
@@ -181,6 +342,9 @@ def process_batch_data(data, timeframe, conn, logger):
             # Add symbol and timeframe columns
             symbol_data['symbol'] = symbol
             symbol_data['timeframe'] = timeframe
+
+            # No weekend rows (see remove_weekend_bars)
+            symbol_data = symbol_data[pd.DatetimeIndex(data.index).weekday < 5]
             
             # Insert records into database
             for _, row in symbol_data.iterrows():
@@ -189,6 +353,7 @@ def process_batch_data(data, timeframe, conn, logger):
                         row.to_frame().T.to_sql('stock_prices', conn, if_exists='append', index=False)
                         if verify_insertion(conn, row['symbol'], row['date'], timeframe):
                             records_added += 1
+                            record_trading_dates(conn, timeframe, [row['date']])
                             logger.log(f"Successfully inserted {timeframe} record for {symbol} on {row['date']}")
                     except Exception as e:
                         logger.log(f"Error inserting {timeframe} record for {symbol} on {row['date']}: {str(e)}")
@@ -199,24 +364,45 @@ def process_batch_data(data, timeframe, conn, logger):
             
     return records_added
 
-def update_database(db_path, period='current', batch_size=5):
-    """Update database with stock data for the specified period."""
+def update_database(db_path, period='current', batch_size=5, bulk=True, workers=4, rate=2.0, symbols=None,
+                    retries=0):
+    """Update database with stock data for the specified period.
+
+    bulk=True writes each downloaded batch with a single upsert; bulk=False
+    keeps the original row-by-row insert path.
+
+    Downloads run on a DownloadScheduler: batch_size symbols per yfinance
+    call, at most `workers` calls in flight and `rate` calls started per
+    second. Symbols that still fail after the in-run retries are kept in
+    the retry queue at RETRY_QUEUE_PATH; pass symbols=RetryQueue(...).pending()
+    to retry just those without re-planning the whole universe.
+
+    retries=N makes up to N more passes over the retry queue in this call,
+    on the same scheduler (so its rate-limit backoff carries over), before
+    the derived tables and the archive are refreshed once.
+    """
     logger = LogManager('./static/logs/update_db.txt')
-    conn = sqlite3.connect(db_path)
-    stocks, total_stocks = get_stocks_to_update(db_path)
-    
-    logger.log(f"Starting update process for {total_stocks} stocks...")
+    # WAL + synchronous=NORMAL: web readers keep going while ingest writes
+    conn = connect(db_path)
+    # One-off move of a TEXT-keyed stock_prices table into stock_bars
+    migrate_to_compact_schema(conn, log=logger.log)
+    create_trading_dates_table(conn)
+    # Weekend bars left by older ingests; a no-op once they are gone
+    purged = remove_weekend_bars(conn)
+    if purged:
+        logger.log(f"Removed {purged} weekend bars")
     start_date, end_date, is_friday = get_date_ranges(period)
-    
-    logger.log(f"Checking data completeness for period: {start_date.strftime('%Y-%m-%d')} to {end_date.strftime('%Y-%m-%d')}")
-    
-    # Pre-filter stocks that need updates
-    stocks_needing_update = []
-    for symbol in stocks:
-        need_daily = not check_data_completeness(conn, symbol, start_date, end_date, 'daily')
-        need_weekly = is_friday and not check_data_completeness(conn, symbol, start_date, end_date, 'weekly')
-        if need_daily or need_weekly:
-            stocks_needing_update.append(symbol)
+
+    if symbols is None:
+        stocks, total_stocks = get_stocks_to_update(db_path)
+        logger.log(f"Starting update process for {total_stocks} stocks...")
+        logger.log(f"Checking data completeness for period: {start_date.strftime('%Y-%m-%d')} to {end_date.strftime('%Y-%m-%d')}")
+
+        # Pre-filter stocks that need updates
+        stocks_needing_update, _ = plan_updates(conn, stocks, start_date, end_date, is_friday)
+    else:
+        logger.log(f"Retrying {len(symbols)} stocks from the retry queue...")
+        stocks_needing_update = list(symbols)
     
     if not stocks_needing_update:
         logger.log("All stocks are up to date. No downloads needed.")
@@ -228,36 +414,50 @@ def update_database(db_path, period='current', batch_size=5):
     
     records_added = {'daily': 0, 'weekly': 0}
     api_calls = {'daily': 0, 'weekly': 0}
-    
-    # Process stocks in batches
-    for i in range(0, len(stocks_needing_update), batch_size):
-        batch = stocks_needing_update[i:i + batch_size]
-        logger.log(f"\nProcessing batch {i//batch_size + 1}/{(len(stocks_needing_update) + batch_size - 1)//batch_size}")
-        logger.log(f"Batch symbols: {', '.join(batch)}")
-        
-        # Daily data
-        api_calls['daily'] += 1
-        daily_data = download_batch_data(batch, start_date, end_date, '1d')
-        
-        if daily_data is None:
-            logger.log("Rate limit reached for daily data. Stopping updates.")
-            break
-            
-        records_added['daily'] += process_batch_data(daily_data, 'daily', conn, logger)
-        
-        # Weekly data (only on Fridays)
+
+    def fetch(batch):
+        # Runs on a scheduler worker: download only, no database access
+        result = {'daily': download_batch_data(batch, start_date, end_date, '1d', raise_on_rate_limit=True)}
         if is_friday:
-            api_calls['weekly'] += 1
-            weekly_data = download_batch_data(batch, start_date, end_date, '1wk')
-            
-            if weekly_data is None:
-                logger.log("Rate limit reached for weekly data. Stopping updates.")
-                break
-                
-            records_added['weekly'] += process_batch_data(weekly_data, 'weekly', conn, logger)
-        
+            result['weekly'] = download_batch_data(batch, start_date, end_date, '1wk', raise_on_rate_limit=True)
+        return result
+
+    def process(batch, result):
+        # Runs on this thread, so the single connection does all the writing
+        logger.log(f"Batch symbols: {', '.join(batch)}")
+        added = 0
+        for timeframe, data in result.items():
+            api_calls[timeframe] += 1
+            count = process_batch_data(data, timeframe, conn, logger, bulk=bulk)
+            records_added[timeframe] += count
+            added += count
         conn.commit()
-        time.sleep(1)  # Respect rate limits
+        return added
+
+    scheduler = DownloadScheduler(
+        fetch, process,
+        batch_size=batch_size,
+        max_workers=workers,
+        rate=rate,
+        retry_queue=RetryQueue(RETRY_QUEUE_PATH),
+        log=logger.log
+    )
+
+    def log_summary(summary):
+        logger.log(f"\nDownloaded {summary['downloaded']}/{summary['batches']} batches "
+                   f"({summary['rate_limited']} rate-limited attempts)")
+        if summary['failed']:
+            logger.log(f"{len(summary['failed'])} stocks queued for retry")
+
+    log_summary(scheduler.run(stocks_needing_update))
+    attempted = set(stocks_needing_update)
+    for attempt in range(1, retries + 1):
+        pending = scheduler.retry_queue.pending()
+        if not pending:
+            break
+        logger.log(f"Retrying {len(pending)} failed stocks (attempt {attempt}/{retries})")
+        attempted.update(pending)
+        log_summary(scheduler.run(pending))
     
     # Log summary
     logger.log("\nUpdate Summary:")
@@ -265,16 +465,49 @@ def update_database(db_path, period='current', batch_size=5):
     logger.log(f"Weekly records added: {records_added['weekly']} (API calls: {api_calls['weekly']})")
     
     cursor = conn.cursor()
-    cursor.execute("SELECT COUNT(*) FROM stock_prices WHERE timeframe = 'daily'")
+    cursor.execute("SELECT COUNT(*) FROM stock_bars WHERE timeframe = ?", (TIMEFRAME_IDS['daily'],))
     total_daily = cursor.fetchone()[0]
-    cursor.execute("SELECT COUNT(*) FROM stock_prices WHERE timeframe = 'weekly'")
+    cursor.execute("SELECT COUNT(*) FROM stock_bars WHERE timeframe = ?", (TIMEFRAME_IDS['weekly'],))
     total_weekly = cursor.fetchone()[0]
     
     logger.log(f"\nFinal Database State:")
     logger.log(f"Total daily records: {total_daily}")
     logger.log(f"Total weekly records: {total_weekly}")
+
+    # Carry the screeners' indicators and the latest-bar table forward over
+    # the bars just stored
+    for timeframe in (['daily', 'weekly'] if is_friday else ['daily']):
+        try:
+            state = update_indicator_state(conn, timeframe)
+            logger.log(f"Indicator state ({timeframe}): {state['updated']} symbols advanced "
+                       f"over {state['bars']} bars, {state['rebuilt']} rebuilt")
+        except Exception as e:
+            logger.log(f"Error updating {timeframe} indicator state: {str(e)}")
+        try:
+            refreshed = update_latest_bars(conn, timeframe, None if purged else sorted(attempted))
+            logger.log(f"Latest bars ({timeframe}): {refreshed} symbols refreshed")
+        except Exception as e:
+            logger.log(f"Error updating {timeframe} latest bars: {str(e)}")
+    try:
+        snapshot = refresh_weekly_snapshot(conn)
+        logger.log(f"Weekly snapshot: {snapshot} symbols")
+    except Exception as e:
+        logger.log(f"Error refreshing weekly snapshot: {str(e)}")
+    try:
+        # This run only wrote bars in its download range (weekly bars are
+        # dated at the start of their week); the purge could touch any year
+        archived = update_archive(conn, changed=None if purged else (to_day(start_date) - 7, to_day(end_date)))
+        if archived is None:
+            logger.log("History archive skipped: pyarrow is not installed")
+        else:
+            logger.log(f"History archive: years rewritten {archived}")
+    except Exception as e:
+        logger.log(f"Error updating history archive: {str(e)}")
     
     conn.close()
+    # Web workers drop their cached pages and re-warm them (services/warmup.py)
+    version = publish_data_version()
+    logger.log(f"Published data version {version}")
     logger.log("Update process completed!")
 
     return records_added['daily'] + records_added['weekly']
@@ -0,0 +1,105 @@
+import yfinance as yf
+from datetime import datetime, timedelta
+import os,sys
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from services.download_scheduler import DownloadScheduler, RateLimitError, RetryQueue
+from services.fundamentals import INFO_FIELDS, create_fundamentals_table, upsert_fundamentals
+from applications.update_db import LogManager
+from database import connect
+
+RETRY_QUEUE_PATH = './static/logs/fundamentals_retry_queue.json'
+
+
+def seed_from_screener(conn):
+    """Give symbols that were never fetched the market cap and country from nasdaq_screener"""
+    conn.execute("""
+        INSERT INTO fundamentals (symbol, market_cap, country)
+        SELECT Symbol, Market_Cap, Country FROM nasdaq_screener WHERE true
+        ON CONFLICT(symbol) DO NOTHING
+    """)
+    conn.commit()
+
+
+def get_symbols_to_refresh(conn, max_age_days):
+    """nasdaq_screener symbols whose fundamentals are missing or older than max_age_days"""
+    cutoff = (datetime.now() - timedelta(days=max_age_days)).strftime('%Y-%m-%d')
+    cursor = conn.execute("""
+        SELECT n.Symbol
+        FROM nasdaq_screener n
+        LEFT JOIN fundamentals f ON f.symbol = n.Symbol
+        WHERE f.updated_at IS NULL OR f.updated_at < ?
+        ORDER BY n.Symbol
+    """, (cutoff,))
+    return [row[0] for row in cursor.fetchall()]
+
+
+def fetch_fundamentals(symbol):
+    """Fetch one symbol's fundamentals from yfinance; a 429 raises RateLimitError"""
+    try:
+        info = yf.Ticker(symbol).info
+    except Exception as e:
+        if "too many requests" in str(e).lower() or "429" in str(e):
+            raise RateLimitError(str(e))
+        raise e
+    record = {column: info.get(key) for key, column in INFO_FIELDS.items()}
+    record['symbol'] = symbol
+    record['updated_at'] = datetime.now().strftime('%Y-%m-%d')
+    return record
+
+
+def refresh_fundamentals(db_path, max_age_days=7, batch_size=10, workers=4, rate=2.0, symbols=None):
+    """
+    Refresh the fundamentals table from yfinance.
+
+    This is the only job that calls the network for fundamentals; the daily
+    screeners read the table. Symbols refreshed within max_age_days are
+    skipped, downloads run on a DownloadScheduler (rate limited, 429 backoff)
+    and symbols that keep failing stay in the retry queue at RETRY_QUEUE_PATH.
+
+    Returns:
+    int: number of symbols refreshed
+    """
+    logger = LogManager('./static/logs/update_fundamentals.txt')
+    conn = connect(db_path)
+    create_fundamentals_table(conn)
+    seed_from_screener(conn)
+
+    if symbols is None:
+        symbols = get_symbols_to_refresh(conn, max_age_days)
+    logger.log(f"Refreshing fundamentals for {len(symbols)} stocks...")
+
+    def fetch(batch):
+        records = []
+        for symbol in batch:
+            try:
+                records.append(fetch_fundamentals(symbol))
+            except RateLimitError:
+                raise
+            except Exception as e:
+                logger.log(f"Error fetching fundamentals for {symbol}: {str(e)}")
+        return records
+
+    def process(batch, records):
+        upsert_fundamentals(conn, records)
+        conn.commit()
+        return len(records)
+
+    scheduler = DownloadScheduler(
+        fetch, process,
+        batch_size=batch_size,
+        max_workers=workers,
+        rate=rate,
+        retry_queue=RetryQueue(RETRY_QUEUE_PATH),
+        log=logger.log
+    )
+    summary = scheduler.run(symbols)
+    logger.log(f"Refreshed {summary['added']} stocks in {summary['downloaded']}/{summary['batches']} batches "
+               f"({summary['rate_limited']} rate-limited attempts, {len(summary['failed'])} queued for retry)")
+
+    conn.close()
+    return summary['added']
+
+
+if __name__ == "__main__":
+    DB_PATH = "static/stock_data.db"
+    refresh_fundamentals(DB_PATH)
@@ -4,6 +4,7 @@ import sqlite3
 from datetime import datetime, timedelta
 sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 from services import yfiance_local as yf
+from services.price_cube import get_price_cube
 #import yfinance as yf
 
 def get_weekly_performance(ticker, num_weeks):
@@ -106,9 +107,10 @@ def week_screen():
     stockids = get_stock_symbols()
     weeks = 10        # Last 4 weeks
     print(len(stockids))
+    cube = get_price_cube('daily', period='6mo')
     for ticker in stockids:
         try:
-            weekly_data = get_weekly_performance(ticker, weeks)
+            weekly_data = get_weekly_performance(ticker, weeks, cube=cube)
         except:
             continue
         # Analyze a specific day (e.g., Monday)
@@ -179,13 +181,14 @@ def get_max_available_weeks(ticker):
         print(f"Error determining max weeks for {ticker}: {str(e)}")
         return 52  # Default to 52 weeks on error
 
-def get_weekly_performance(ticker, num_weeks):
+def get_weekly_performance(ticker, num_weeks, cube=None):
     """
     Get daily stock performance organized by weeks for a given ticker
     
     Parameters:
     ticker (str): Stock ticker symbol
     num_weeks (int): Number of past weeks to analyze
+    cube (PriceCube): preloaded daily history to slice instead of querying (optional)
     
     Returns:
     pandas.DataFrame: Weekly performance table with days as columns
@@ -195,8 +198,12 @@ def get_weekly_performance(ticker, num_weeks):
     start_date = end_date - timedelta(weeks=num_weeks + 1)  # Extra week to ensure we have full weeks
     
     # Download stock data
-    stock = yf.Ticker(ticker)
-    df = stock.history(start=start_date, end=end_date)
+    if cube is not None:
+        df = cube.history(ticker)
+        df = df[df.index >= start_date.strftime('%Y-%m-%d')]
+    else:
+        stock = yf.Ticker(ticker)
+        df = stock.history(start=start_date, end=end_date)
     
     if df.empty:
         raise ValueError(f"No data available for {ticker}")
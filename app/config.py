@@ -3,6 +3,20 @@ import os
 # Database configuration
 DB_PATH = 'static/stock_data.db'
 CACHE_DURATION = 300  # 5 minutes in seconds
+# 'memory' keeps caches per process; 'sqlite' also shares them between the
+# uvicorn workers through CACHE_DB_PATH
+CACHE_BACKEND = os.environ.get('CACHE_BACKEND', 'memory')
+CACHE_DB_PATH = 'static/cache.db'
+# Data-version marker written by update_database after each ingest; cached
+# results belong to one version and are dropped when it changes
+DATA_VERSION_PATH = 'static/data_version'
+DATA_CACHE_DURATION = 86400  # upper bound for results that only change with the data
+# Closed years of history as Arrow files for whole-universe reads (services/history_archive.py)
+ARCHIVE_DIR = 'static/archive'
+# Rendered chart images (services/chart_cache.py); least recently used ones
+# are deleted once the directory grows past the cap
+CHART_CACHE_DIR = 'static/images/charts'
+CHART_CACHE_MAX_BYTES = 512 * 1024 * 1024
 
 # Application settings
 HOST = "0.0.0.0"
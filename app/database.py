@@ -1,21 +1,175 @@
 import sqlite3
 import os,sys
+import threading
+from datetime import date, datetime
+from queue import Queue, Empty, Full
 #from .config import DB_PATH
 
 DB_PATH = 'static/stock_data.db'
 
-def initialize_database():
-    """Initialize the database with necessary tables and indices"""
-    conn = sqlite3.connect(DB_PATH)
-    cursor = conn.cursor()
-    
-    cursor.execute('DROP TABLE IF EXISTS stock_prices')
-    
-    cursor.execute('''
-    CREATE TABLE IF NOT EXISTS stock_prices (
-        date TEXT,
-        symbol TEXT,
-        timeframe TEXT,
+# Connection tuning applied to every connection we hand out
+SQLITE_PRAGMAS = {
+    'synchronous': 'NORMAL',       # safe with WAL, far fewer fsyncs than FULL
+    'mmap_size': 268435456,        # 256 MB memory-mapped reads
+    'cache_size': -65536,          # 64 MB page cache (negative = KiB)
+    'temp_store': 'MEMORY',
+    'busy_timeout': 30000,         # ms to wait on the single writer lock
+}
+POOL_SIZE = 8
+
+
+def configure_connection(conn, readonly=False):
+    """Apply the WAL journal mode and performance pragmas to a connection"""
+    if not readonly:
+        # journal_mode is stored in the database file, so this only has to
+        # succeed once; readers then never block behind the ingest writer
+        conn.execute('PRAGMA journal_mode=WAL')
+    for pragma, value in SQLITE_PRAGMAS.items():
+        conn.execute(f'PRAGMA {pragma}={value}')
+    if readonly:
+        conn.execute('PRAGMA query_only=ON')
+    return conn
+
+
+def connect(db_path=DB_PATH, readonly=False, check_same_thread=True, factory=sqlite3.Connection):
+    """Open a new tuned connection (WAL, pragmas; query_only for readers)"""
+    conn = sqlite3.connect(db_path, timeout=30, check_same_thread=check_same_thread, factory=factory)
+    return configure_connection(conn, readonly=readonly)
+
+
+class PooledConnection(sqlite3.Connection):
+    """
+    sqlite3 connection whose close() hands it back to its pool.
+
+    Being a real sqlite3.Connection it works with pandas.read_sql_query,
+    and the usual `conn = get_db_connection() ... finally: conn.close()`
+    pattern keeps working unchanged.
+    """
+    pool = None
+
+    def close(self):
+        if self.pool is None or not self.pool.release(self):
+            super().close()
+
+
+class ConnectionPool:
+    """
+    Per-process pool of tuned SQLite connections.
+
+    Connections are opened lazily and at most max_size idle ones are kept;
+    when every pooled connection is checked out callers get an extra one
+    that is really closed on close(). The pool starts empty again after a
+    fork so worker processes never share connections with their parent.
+    """
+
+    def __init__(self, db_path, readonly, max_size=POOL_SIZE):
+        self.db_path = db_path
+        self.readonly = readonly
+        self.max_size = max_size
+        self.pid = os.getpid()
+        self.idle = Queue(maxsize=max_size)
+
+    def acquire(self):
+        if self.pid != os.getpid():
+            self.pid = os.getpid()
+            self.idle = Queue(maxsize=self.max_size)
+        try:
+            return self.idle.get_nowait()
+        except Empty:
+            ensure_static_folder()
+            conn = connect(self.db_path, readonly=self.readonly,
+                           check_same_thread=False, factory=PooledConnection)
+            conn.pool = self
+            return conn
+
+    def release(self, conn):
+        """Return conn to the idle set; False means the caller should really close it"""
+        if self.pid != os.getpid():
+            return False
+        try:
+            if conn.in_transaction:
+                conn.rollback()
+            self.idle.put_nowait(conn)
+            return True
+        except (Full, sqlite3.Error):
+            return False
+
+
+_pools = {}
+_pools_lock = threading.Lock()
+
+
+def get_pool(readonly, db_path=DB_PATH):
+    """Return this process's pool for (db_path, readonly)"""
+    key = (db_path, readonly)
+    with _pools_lock:
+        if key not in _pools:
+            _pools[key] = ConnectionPool(db_path, readonly)
+        return _pools[key]
+
+
+def get_read_connection(db_path=DB_PATH):
+    """Borrow a pooled query_only connection; close() returns it to the pool"""
+    return get_pool(True, db_path).acquire()
+
+
+# Compact price storage: stock_bars is keyed by small integers (symbol id
+# from the symbols dictionary, timeframe id, day number = days since
+# 1970-01-01) and clustered on that key, so one symbol's history is one
+# contiguous range. stock_prices is a view with the old text columns (and
+# INSTEAD OF triggers) for code that does not need the speed.
+TIMEFRAME_IDS = {'daily': 0, 'weekly': 1}
+JULIAN_EPOCH = 2440587.5  # julianday('1970-01-01')
+EPOCH_DATE = date(1970, 1, 1)
+
+STOCK_BAR_COLUMNS = ['open', 'high', 'low', 'close', 'volume', 'dividends', 'stock_splits']
+
+
+def to_day(value):
+    """'YYYY-MM-DD' (or a date/datetime) -> day number"""
+    if isinstance(value, str):
+        value = date.fromisoformat(value[:10])
+    elif isinstance(value, datetime):
+        value = value.date()
+    return (value - EPOCH_DATE).days
+
+
+def day_sql(column='day'):
+    """SQL expression turning a day-number column back into 'YYYY-MM-DD'"""
+    return f"date({column} + {JULIAN_EPOCH})"
+
+
+def day_from_sql(column='date'):
+    """SQL expression turning a 'YYYY-MM-DD' column into a day number"""
+    return f"CAST(julianday({column}) - {JULIAN_EPOCH} AS INTEGER)"
+
+
+def create_compact_schema(conn):
+    """Create symbols, timeframes, stock_bars and the stock_prices view (if missing)"""
+    _create_compact_schema(conn)
+    conn.commit()
+
+
+def _create_compact_schema(conn):
+    conn.execute('''
+    CREATE TABLE IF NOT EXISTS symbols (
+        id INTEGER PRIMARY KEY,
+        symbol TEXT NOT NULL UNIQUE
+    )
+    ''')
+    conn.execute('''
+    CREATE TABLE IF NOT EXISTS timeframes (
+        id INTEGER PRIMARY KEY,
+        name TEXT NOT NULL UNIQUE
+    )
+    ''')
+    conn.executemany("INSERT OR IGNORE INTO timeframes (id, name) VALUES (?, ?)",
+                     [(id_, name) for name, id_ in TIMEFRAME_IDS.items()])
+    conn.execute('''
+    CREATE TABLE IF NOT EXISTS stock_bars (
+        symbol_id INTEGER NOT NULL,
+        timeframe INTEGER NOT NULL,
+        day INTEGER NOT NULL,
         open REAL,
         high REAL,
         low REAL,
@@ -23,16 +177,126 @@ def initialize_database():
         volume INTEGER,
         dividends REAL,
         stock_splits REAL,
-        PRIMARY KEY (date, symbol, timeframe)
-    )
+        PRIMARY KEY (symbol_id, timeframe, day)
+    ) WITHOUT ROWID
     ''')
-    
-    # Create indices
-    cursor.execute('CREATE INDEX IF NOT EXISTS idx_symbol ON stock_prices(symbol)')
-    cursor.execute('CREATE INDEX IF NOT EXISTS idx_timeframe ON stock_prices(timeframe)')
-    cursor.execute('CREATE INDEX IF NOT EXISTS idx_date ON stock_prices(date)')
-    
-    conn.commit()
+    # Cross-sections (all symbols on a date, date ranges); per-symbol
+    # reads use the primary key
+    conn.execute('''
+    CREATE INDEX IF NOT EXISTS idx_stock_bars_day
+    ON stock_bars(timeframe, day)
+    ''')
+
+    conn.execute(f'''
+    CREATE VIEW IF NOT EXISTS stock_prices AS
+    SELECT
+        {day_sql('b.day')} AS date,
+        s.symbol AS symbol,
+        t.name AS timeframe,
+        b.open, b.high, b.low, b.close, b.volume, b.dividends, b.stock_splits
+    FROM stock_bars b
+    JOIN symbols s ON s.id = b.symbol_id
+    JOIN timeframes t ON t.id = b.timeframe
+    ''')
+    conn.execute(f'''
+    CREATE TRIGGER IF NOT EXISTS stock_prices_insert
+    INSTEAD OF INSERT ON stock_prices
+    BEGIN
+        INSERT OR IGNORE INTO symbols (symbol) VALUES (NEW.symbol);
+        INSERT OR REPLACE INTO stock_bars
+            (symbol_id, timeframe, day, open, high, low, close, volume, dividends, stock_splits)
+        VALUES (
+            (SELECT id FROM symbols WHERE symbol = NEW.symbol),
+            (SELECT id FROM timeframes WHERE name = NEW.timeframe),
+            {day_from_sql('NEW.date')},
+            NEW.open, NEW.high, NEW.low, NEW.close, NEW.volume, NEW.dividends, NEW.stock_splits
+        );
+    END
+    ''')
+    conn.execute(f'''
+    CREATE TRIGGER IF NOT EXISTS stock_prices_delete
+    INSTEAD OF DELETE ON stock_prices
+    BEGIN
+        DELETE FROM stock_bars
+        WHERE symbol_id = (SELECT id FROM symbols WHERE symbol = OLD.symbol)
+        AND timeframe = (SELECT id FROM timeframes WHERE name = OLD.timeframe)
+        AND day = {day_from_sql('OLD.date')};
+    END
+    ''')
+
+
+def is_legacy_schema(conn):
+    """True while stock_prices is still the original TEXT-keyed table"""
+    row = conn.execute("SELECT type FROM sqlite_master WHERE name = 'stock_prices'").fetchone()
+    return row is not None and row[0] == 'table'
+
+
+def migrate_to_compact_schema(conn, log=print):
+    """
+    Move a legacy stock_prices table into stock_bars.
+
+    Copies the rows in primary-key order, drops the old table (and its
+    four indexes), then creates the view in its place; all in one
+    transaction. Run VACUUM afterwards to give the space back to the
+    filesystem. Returns the number of rows migrated (0 if already done).
+    """
+    if not is_legacy_schema(conn):
+        create_compact_schema(conn)
+        return 0
+
+    conn.execute("BEGIN IMMEDIATE")
+    try:
+        conn.execute("ALTER TABLE stock_prices RENAME TO stock_prices_legacy")
+        _create_compact_schema(conn)
+        conn.execute('''
+            INSERT OR IGNORE INTO symbols (symbol)
+            SELECT DISTINCT symbol FROM stock_prices_legacy WHERE symbol IS NOT NULL ORDER BY symbol
+        ''')
+        cursor = conn.execute(f'''
+            INSERT OR REPLACE INTO stock_bars
+                (symbol_id, timeframe, day, open, high, low, close, volume, dividends, stock_splits)
+            SELECT s.id, t.id, {day_from_sql('p.date')},
+                   p.open, p.high, p.low, p.close, p.volume, p.dividends, p.stock_splits
+            FROM stock_prices_legacy p
+            JOIN symbols s ON s.symbol = p.symbol
+            JOIN timeframes t ON t.name = p.timeframe
+            WHERE julianday(p.date) IS NOT NULL
+            ORDER BY s.id, t.id, 3
+        ''')
+        migrated = cursor.rowcount
+        conn.execute("DROP TABLE stock_prices_legacy")
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+    log(f"Migrated {migrated} rows into stock_bars")
+    return migrated
+
+
+def symbol_ids(conn, symbols, create=False):
+    """
+    {symbol: id} for the given symbols; create=True adds unknown symbols
+    to the dictionary (write connections only).
+    """
+    symbols = list(dict.fromkeys(symbols))
+    if create:
+        conn.executemany("INSERT OR IGNORE INTO symbols (symbol) VALUES (?)", [(s,) for s in symbols])
+    ids = {}
+    for i in range(0, len(symbols), 500):
+        chunk = symbols[i:i + 500]
+        ids.update(conn.execute(
+            f"SELECT symbol, id FROM symbols WHERE symbol IN ({','.join('?' * len(chunk))})", chunk).fetchall())
+    return ids
+
+
+def initialize_database():
+    """Initialize the database with the compact price tables"""
+    conn = connect(DB_PATH)
+    conn.execute('DROP VIEW IF EXISTS stock_prices')
+    conn.execute('DROP TABLE IF EXISTS stock_prices')
+    conn.execute('DROP TABLE IF EXISTS stock_bars')
+    conn.execute('DROP TABLE IF EXISTS symbols')
+    create_compact_schema(conn)
     conn.close()
 
 
@@ -43,9 +307,8 @@ def ensure_static_folder():
         os.makedirs('static')
 
 def get_db_connection():
-    """Get database connection"""
-    ensure_static_folder()
-    return sqlite3.connect(DB_PATH)
+    """Borrow a pooled read-write connection; close() returns it to the pool"""
+    return get_pool(False).acquire()
 
 
 def get_database_size():
@@ -117,16 +380,39 @@ def delete_stock_records(db_path, symbol):
         cursor.execute("BEGIN TRANSACTION")
         
         try:
-            # Delete from stock_prices table (note: symbol is part of primary key)
-            cursor.execute("DELETE FROM stock_prices WHERE symbol = ?", (symbol,))
+            # Day range of the symbol's bars per timeframe, for the archive
+            bar_ranges = cursor.execute("""
+                SELECT timeframe, MIN(day), MAX(day) FROM stock_bars
+                WHERE symbol_id = (SELECT id FROM symbols WHERE symbol = ?)
+                GROUP BY timeframe
+            """, (symbol,)).fetchall()
+
+            # Delete the symbol's bars (leading column of the stock_bars key)
+            cursor.execute("DELETE FROM stock_bars WHERE symbol_id = (SELECT id FROM symbols WHERE symbol = ?)", (symbol,))
             prices_deleted = cursor.rowcount
             
             # Delete from nasdaq_screener table (Symbol is not primary key)
             cursor.execute("DELETE FROM nasdaq_screener WHERE Symbol = ?", (symbol,))
             screener_deleted = cursor.rowcount
+
+            # Tables derived from the bars, where they have been built
+            derived = {row[0] for row in cursor.execute(
+                "SELECT name FROM sqlite_master WHERE type = 'table' AND name IN ('latest_bars', 'indicator_state')")}
+            for table in sorted(derived):
+                cursor.execute(f"DELETE FROM {table} WHERE symbol = ?", (symbol,))
             
             # Commit the transaction
             conn.commit()
+
+            # Archived years holding the deleted bars no longer match stock_bars
+            try:
+                from .services.history_archive import invalidate_archive
+            except ImportError:
+                # Imported as top-level `database` module by the scheduled job scripts
+                from services.history_archive import invalidate_archive
+            timeframes = {timeframe_id: name for name, timeframe_id in TIMEFRAME_IDS.items()}
+            for timeframe_id, first_day, last_day in bar_ranges:
+                invalidate_archive(timeframes[timeframe_id], first_day, last_day)
             
             deleted_counts = {
                 "stock_prices": prices_deleted,
@@ -1,25 +1,256 @@
+import numpy as np
 import pandas as pd
 
 
 # Analysis functions
+#
+# Per-series helpers for the web views and the screening/chart scripts:
+# thin wrappers that run the vectorized engine below on a single row.
+
+def _row(values):
+    return np.asarray(values, dtype=float)[None, :]
+
+
+def ema(data, window):
+    """EMA of a Series (pandas ewm(span=window, adjust=False))"""
+    return pd.Series(ema_2d(_row(data), window)[0], index=data.index)
+
+
 def calculate_macd(close_prices, slow=26, fast=12, signal=9):
     """Calculate MACD (Moving Average Convergence Divergence)"""
     close_prices = pd.Series(close_prices)
-    ema_fast = close_prices.ewm(span=fast, adjust=False).mean()
-    ema_slow = close_prices.ewm(span=slow, adjust=False).mean()
-    macd_line = ema_fast - ema_slow
-    signal_line = macd_line.ewm(span=signal, adjust=False).mean()
-    histogram = 2 * (macd_line - signal_line)
-    return macd_line, signal_line, histogram
+    return tuple(pd.Series(values[0], index=close_prices.index)
+                 for values in macd_2d(_row(close_prices), slow, fast, signal))
 
 
 def calculate_wr(closes, highs, lows, window=6):
     """Calculate Williams %R indicator"""
     closes = pd.Series(closes)
-    highs = pd.Series(highs)
-    lows = pd.Series(lows)
-    
-    highest_high = highs.rolling(window=window).max()
-    lowest_low = lows.rolling(window=window).min()
-    wr = ((highest_high - closes) / (highest_high - lowest_low) * 100)
-    return wr
\ No newline at end of file
+    return pd.Series(wr_2d(_row(closes), _row(highs), _row(lows), window)[0], index=closes.index)
+
+
+def calculate_rsi(data, window):
+    """Calculate the Relative Strength Index (RSI) of data['Close'] for a given window."""
+    return pd.Series(rsi_2d(_row(data['Close']), window)[0], index=data.index)
+
+
+def calculate_kdj(data, period=9):
+    """Add kdj_k, kdj_d and kdj_j to data (High, Low, Close) and return them"""
+    k, d, j = kdj_2d(_row(data['Close']), _row(data['High']), _row(data['Low']), period)
+    data['kdj_k'], data['kdj_d'], data['kdj_j'] = k[0], d[0], j[0]
+    return data[['kdj_k', 'kdj_d', 'kdj_j']]
+
+
+def add_technical_indicators(data):
+    """Calculate and add RSI, WR and KDJ to the DataFrame."""
+    if 'Volume' not in data.columns:
+        raise ValueError("The DataFrame must contain a 'Volume' column.")
+    add_indicators(data, ['RSI', 'WR', 'KDJ'])
+    return data
+
+
+def add_indicators(data, groups=('EMA', 'MACD', 'RSI', 'WR', 'KDJ')):
+    """
+    Add compute_indicators' columns to one symbol's bars (High, Low,
+    Close), named as the screening and chart scripts use them:
+    EMA_3..EMA_51, MACD, MACD_signal, MACD_hist, RSI_6/12/24, WR_6/10 and
+    kdj_k/d/j, for the given groups.
+    """
+    result = compute_indicators(_row(data['Close']), _row(data['High']), _row(data['Low']))
+    columns = {}
+    if 'EMA' in groups:
+        columns.update({f'EMA_{span}': values[0] for span, values in zip(EMA_RIBBON_SPANS, result['ema'])})
+    if 'MACD' in groups:
+        columns.update(MACD=result['macd'][0], MACD_signal=result['macd_signal'][0],
+                       MACD_hist=result['macd_hist'][0])
+    if 'RSI' in groups:
+        columns.update({f'RSI_{window}': result[f'rsi_{window}'][0] for window in (6, 12, 24)})
+    if 'WR' in groups:
+        columns.update(WR_6=result['wr_6'][0], WR_10=result['wr_10'][0])
+    if 'KDJ' in groups:
+        columns.update(kdj_k=result['kdj_k'][0], kdj_d=result['kdj_d'][0], kdj_j=result['kdj_j'][0])
+    for name, values in columns.items():
+        data[name] = values
+    return data
+
+
+# Vectorized indicator engine
+#
+# The indicators of the screeners and charts, computed on 2-D (symbols,
+# time) arrays for every symbol at once. Rows may start with NaN padding (see pack_right);
+# a row's indicators start at its first real bar, as if the padding was
+# not there.
+
+EMA_RIBBON_SPANS = list(range(3, 26, 2)) + list(range(27, 52, 2))
+
+
+def pack_right(values, valid):
+    """
+    Shift each row's valid entries to the right edge, NaN-padding the left.
+
+    Turns a date-aligned (symbols, dates) array with gaps into per-symbol
+    bar sequences whose last column is each symbol's latest bar.
+    """
+    values = np.asarray(values, dtype=float)
+    order = np.argsort(valid, axis=1, kind='stable')
+    packed = np.take_along_axis(values, order, axis=1)
+    counts = valid.sum(axis=1)
+    packed[np.arange(values.shape[1]) < (values.shape[1] - counts)[:, None]] = np.nan
+    return packed
+
+
+def ema_many(values, spans):
+    """
+    EMAs (pandas ewm(span, adjust=False)) for several spans in one pass.
+
+    Returns an array shaped (len(spans), symbols, time).
+    """
+    values = np.asarray(values, dtype=float)
+    alphas = 2.0 / (np.asarray(spans, dtype=float) + 1.0)
+    alphas = alphas[:, None]
+    # Iterate over time with contiguous (spans, symbols) slices
+    series = np.ascontiguousarray(values.T)
+    out = np.empty((values.shape[1], len(alphas), values.shape[0]))
+    state = np.full((len(alphas), values.shape[0]), np.nan)
+    for t, x in enumerate(series):
+        step = alphas * x + (1 - alphas) * state
+        # Start at the first bar; NaN bars keep the previous value
+        np.copyto(step, x, where=np.isnan(state))
+        np.copyto(step, state, where=np.isnan(x))
+        state = out[t] = step
+    out = np.moveaxis(out, 0, -1)
+    out[:, np.isnan(values)] = np.nan
+    return out
+
+
+def ema_2d(values, span):
+    """EMA for every row of a (symbols, time) array"""
+    return ema_many(values, [span])[0]
+
+
+def macd_2d(close, slow=26, fast=12, signal=9):
+    """Vectorized calculate_macd: returns (dif, dea, histogram)"""
+    ema_fast, ema_slow = ema_many(close, [fast, slow])
+    macd_line = ema_fast - ema_slow
+    signal_line = ema_2d(macd_line, signal)
+    histogram = 2 * (macd_line - signal_line)
+    return macd_line, signal_line, histogram
+
+
+def _rolling(values, window, func, min_periods=None):
+    """
+    Trailing-window mean/max/min along the time axis (func is np.mean,
+    np.max or np.min). Accumulates over the window offsets so each step
+    is one whole-array operation.
+
+    With min_periods None a window containing NaN gives NaN (pandas'
+    default); otherwise NaNs are skipped and windows with fewer than
+    min_periods values give NaN.
+    """
+    values = np.asarray(values, dtype=float)
+    n = values.shape[-1]
+    pad = np.full(values.shape[:-1] + (window - 1,), np.nan)
+    padded = np.concatenate([pad, values], axis=-1)
+    skip_nan = min_periods is not None
+    if func is np.mean:
+        combine = np.add
+    elif func is np.max:
+        combine = np.fmax if skip_nan else np.maximum
+    else:
+        combine = np.fmin if skip_nan else np.minimum
+
+    result = None
+    count = np.zeros(values.shape, dtype=int)
+    for k in range(window):
+        shifted = padded[..., k:k + n]
+        present = ~np.isnan(shifted)
+        count += present
+        if skip_nan and func is np.mean:
+            shifted = np.where(present, shifted, 0.0)
+        result = shifted.copy() if result is None else combine(result, shifted)
+
+    if func is np.mean:
+        result = result / (np.maximum(count, 1) if skip_nan else window)
+    result[count < (min_periods if skip_nan else window)] = np.nan
+    return result
+
+
+def rsi_2d(close, window, zero_loss_rs=None):
+    """
+    Vectorized RSI with simple rolling means, as in the screening scripts.
+
+    zero_loss_rs replaces rs where the average loss is 0 (top10_rsi uses
+    100); by default gain / 0 gives RSI 100 and 0 / 0 gives NaN.
+    """
+    close = np.asarray(close, dtype=float)
+    delta = np.diff(close, axis=-1, prepend=np.nan)
+    padding = np.isnan(close)
+    # pandas' where(delta > 0, 0) turns the first (NaN) delta into 0
+    gain = np.where(delta > 0, delta, 0.0)
+    loss = np.where(delta < 0, -delta, 0.0)
+    gain[padding] = np.nan
+    loss[padding] = np.nan
+    avg_gain = _rolling(gain, window, np.mean)
+    avg_loss = _rolling(loss, window, np.mean)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        rs = avg_gain / avg_loss
+    if zero_loss_rs is not None:
+        rs = np.where(avg_loss == 0, zero_loss_rs, rs)
+    return 100 - (100 / (1 + rs))
+
+
+def wr_2d(close, high, low, window=6):
+    """Vectorized Williams %R"""
+    highest_high = _rolling(high, window, np.max)
+    lowest_low = _rolling(low, window, np.min)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        return (highest_high - close) / (highest_high - lowest_low) * 100
+
+
+def kdj_2d(close, high, low, period=9):
+    """Vectorized KDJ: returns (k, d, j)"""
+    low_min = _rolling(low, period, np.min, min_periods=1)
+    high_max = _rolling(high, period, np.max, min_periods=1)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        k = 100 * ((close - low_min) / (high_max - low_min))
+    d = _rolling(k, 3, np.mean, min_periods=1)
+    j = 3 * k - 2 * d
+    return k, d, j
+
+
+def compute_indicators(close, high, low):
+    """
+    Every indicator the screeners and charts use, for all symbols at once.
+
+    Parameters:
+    close, high, low: (symbols, time) arrays, e.g. pack_right'ed PriceCube fields
+
+    Returns:
+    dict of (symbols, time) arrays; 'ema' is (len(EMA_RIBBON_SPANS), symbols, time)
+    """
+    emas = ema_many(close, EMA_RIBBON_SPANS + [12, 26])
+    macd_line = emas[-2] - emas[-1]
+    signal_line = ema_2d(macd_line, 9)
+    k, d, j = kdj_2d(close, high, low)
+    return {
+        'ema': emas[:-2],
+        'macd': macd_line,
+        'macd_signal': signal_line,
+        'macd_hist': 2 * (macd_line - signal_line),
+        'rsi_6': rsi_2d(close, 6),
+        'rsi_12': rsi_2d(close, 12),
+        'rsi_24': rsi_2d(close, 24),
+        'wr_6': wr_2d(close, high, low, 6),
+        'wr_10': wr_2d(close, high, low, 10),
+        'kdj_k': k,
+        'kdj_d': d,
+        'kdj_j': j,
+    }
+
+
+if __name__ == "__main__":
+    import time
+    close = 50 + np.cumsum(np.random.default_rng(1).normal(0, 1, (3600, 130)), axis=1)
+    start = time.perf_counter()
+    compute_indicators(close, close + 1, close - 1)
+    print(f"All indicators for 3600 x 130 bars: {time.perf_counter() - start:.3f}s")
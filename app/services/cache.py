@@ -1,14 +1,306 @@
+import os
+import pickle
+import sqlite3
+import threading
+import time
 from datetime import datetime
-from functools import lru_cache
-from ..config import CACHE_DURATION
-
-# Cache and utility functions
-def get_cache_timestamp():
-    """Return a timestamp rounded to 5-minute intervals for cache key"""
-    now = datetime.now()
-    return now.replace(second=0, microsecond=0).timestamp() // CACHE_DURATION * CACHE_DURATION
-
-# Define cache decorators
-top_gainers_cache = lru_cache(maxsize=100)
-stock_data_cache = lru_cache(maxsize=100)
-database_stats_cache = lru_cache(maxsize=100)
\ No newline at end of file
+from collections import OrderedDict
+from functools import wraps
+try:
+    from ..config import CACHE_DURATION, CACHE_BACKEND, CACHE_DB_PATH, DATA_VERSION_PATH, DATA_CACHE_DURATION
+except ImportError:
+    # Imported as top-level `services` package by the scheduled job scripts
+    from config import CACHE_DURATION, CACHE_BACKEND, CACHE_DB_PATH, DATA_VERSION_PATH, DATA_CACHE_DURATION
+
+
+_version = (None, None)  # (marker mtime, version) last read by this process
+
+
+def data_version():
+    """
+    Version of the stock data, as last published by publish_data_version().
+
+    One stat() per call; the marker file is only re-read when it changed.
+    Returns '0' before anything has been published.
+    """
+    global _version
+    try:
+        mtime = os.stat(DATA_VERSION_PATH).st_mtime_ns
+    except FileNotFoundError:
+        return '0'
+    if _version[0] != mtime:
+        with open(DATA_VERSION_PATH) as f:
+            _version = (mtime, f.read().strip() or str(mtime))
+    return _version[1]
+
+
+class SQLiteCacheBackend:
+    """
+    Cache entries shared by all processes (e.g. the uvicorn workers) through
+    one SQLite file. Values are pickled; expired rows are dropped as new
+    ones are written.
+    """
+
+    def __init__(self, path=CACHE_DB_PATH):
+        self.path = path
+        self.lock = threading.Lock()
+        self.conn = None
+        self.pid = None
+
+    def _connection(self):
+        # One connection per process; never reuse the parent's after a fork
+        if self.conn is None or self.pid != os.getpid():
+            os.makedirs(os.path.dirname(self.path) or '.', exist_ok=True)
+            self.conn = sqlite3.connect(self.path, timeout=5, check_same_thread=False)
+            self.conn.execute('PRAGMA journal_mode=WAL')
+            self.conn.execute('PRAGMA synchronous=NORMAL')
+            self.conn.execute('''
+            CREATE TABLE IF NOT EXISTS cache_entries (
+                namespace TEXT NOT NULL,
+                key TEXT NOT NULL,
+                value BLOB NOT NULL,
+                expires_at REAL NOT NULL,
+                PRIMARY KEY (namespace, key)
+            )
+            ''')
+            self.conn.execute('''
+            CREATE INDEX IF NOT EXISTS idx_cache_entries_expiry
+            ON cache_entries(namespace, expires_at)
+            ''')
+            self.conn.commit()
+            self.pid = os.getpid()
+        return self.conn
+
+    def get(self, namespace, key, now):
+        """(found, value, expires_at) of a live entry"""
+        with self.lock:
+            row = self._connection().execute(
+                "SELECT value, expires_at FROM cache_entries WHERE namespace = ? AND key = ? AND expires_at > ?",
+                (namespace, key, now)
+            ).fetchone()
+        if row is None:
+            return False, None, None
+        return True, pickle.loads(row[0]), row[1]
+
+    def set(self, namespace, key, value, expires_at, maxsize, now):
+        """Store an entry, then trim the namespace to its maxsize (soonest expiry first)"""
+        blob = pickle.dumps(value, protocol=pickle.HIGHEST_PROTOCOL)
+        with self.lock:
+            conn = self._connection()
+            with conn:
+                conn.execute("INSERT OR REPLACE INTO cache_entries VALUES (?, ?, ?, ?)",
+                             (namespace, key, blob, expires_at))
+                conn.execute("DELETE FROM cache_entries WHERE namespace = ? AND expires_at <= ?", (namespace, now))
+                conn.execute("""
+                    DELETE FROM cache_entries
+                    WHERE namespace = ? AND key IN (
+                        SELECT key FROM cache_entries
+                        WHERE namespace = ?
+                        ORDER BY expires_at DESC
+                        LIMIT -1 OFFSET ?
+                    )
+                """, (namespace, namespace, maxsize))
+
+    def clear(self, namespace=None):
+        with self.lock:
+            conn = self._connection()
+            with conn:
+                if namespace is None:
+                    conn.execute("DELETE FROM cache_entries")
+                else:
+                    conn.execute("DELETE FROM cache_entries WHERE namespace = ?", (namespace,))
+
+
+class TTLCache:
+    """
+    Size-bounded LRU cache whose entries expire after `ttl` seconds.
+
+    Entries live in this process's memory; with a shared backend they are
+    also written there, so a miss here can still be a hit another worker
+    already paid for. Entries belong to one data version: all of them are
+    dropped once a new version is published (see publish_data_version).
+    """
+
+    def __init__(self, name, maxsize=100, ttl=CACHE_DURATION, backend=None):
+        self.name = name
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.backend = backend
+        self.entries = OrderedDict()  # key -> (expires_at, value)
+        self.lock = threading.Lock()
+        self.version = data_version()
+        self.hits = 0
+        self.shared_hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+
+    def _check_version(self):
+        version = data_version()
+        if version != self.version:
+            with self.lock:
+                self.entries.clear()
+                self.version = version
+
+    def _shared_key(self, key, version):
+        # Entries written under an older data version are never read again
+        return f"{version}:{key}"
+
+    def get(self, key):
+        """(found, value)"""
+        self._check_version()
+        now = time.time()
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is not None:
+                if entry[0] > now:
+                    self.entries.move_to_end(key)
+                    self.hits += 1
+                    return True, entry[1]
+                del self.entries[key]
+                self.expirations += 1
+
+        if self.backend is not None:
+            try:
+                found, value, expires_at = self.backend.get(self.name, self._shared_key(key, self.version), now)
+            except sqlite3.Error as e:
+                print(f"Error reading shared cache {self.name}: {str(e)}")
+                found = False
+            if found:
+                self._store(key, value, expires_at)
+                with self.lock:
+                    self.shared_hits += 1
+                return True, value
+
+        with self.lock:
+            self.misses += 1
+        return False, None
+
+    def set(self, key, value, version=None):
+        """
+        Store a value. Pass the data version seen before computing it: if a
+        new one was published meanwhile the (possibly stale) value is dropped.
+        """
+        if version is None:
+            version = self.version
+        if version != data_version():
+            return
+        now = time.time()
+        expires_at = now + self.ttl
+        self._store(key, value, expires_at)
+        if self.backend is not None:
+            try:
+                self.backend.set(self.name, self._shared_key(key, version), value, expires_at, self.maxsize, now)
+            except (sqlite3.Error, pickle.PicklingError) as e:
+                print(f"Error writing shared cache {self.name}: {str(e)}")
+
+    def _store(self, key, value, expires_at):
+        with self.lock:
+            self.entries[key] = (expires_at, value)
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.maxsize:
+                self.entries.popitem(last=False)
+                self.evictions += 1
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+        if self.backend is not None:
+            self.backend.clear(self.name)
+
+    def info(self):
+        """Hit/miss counters and current size"""
+        with self.lock:
+            lookups = self.hits + self.shared_hits + self.misses
+            return {
+                'name': self.name,
+                'hits': self.hits,
+                'shared_hits': self.shared_hits,
+                'misses': self.misses,
+                'hit_rate': round((self.hits + self.shared_hits) / lookups, 4) if lookups else None,
+                'evictions': self.evictions,
+                'expirations': self.expirations,
+                'size': len(self.entries),
+                'maxsize': self.maxsize,
+                'ttl': self.ttl,
+                'backend': 'sqlite' if self.backend is not None else 'memory',
+            }
+
+
+_backend = None
+_caches = {}
+
+
+def get_backend():
+    """The shared backend selected by CACHE_BACKEND ('memory' means none)"""
+    global _backend
+    if CACHE_BACKEND == 'sqlite' and _backend is None:
+        _backend = SQLiteCacheBackend(CACHE_DB_PATH)
+    return _backend
+
+
+def ttl_cache(maxsize=100, ttl=CACHE_DURATION):
+    """
+    Decorator caching a function's results in a TTLCache named after it
+    (module.qualname, which is also its namespace in the shared backend).
+
+    Arguments must have a stable repr (they form the key). The wrapper
+    keeps the lru_cache helpers: cache_clear() and cache_info().
+    """
+    def decorator(func):
+        cache = TTLCache(f"{func.__module__}.{func.__qualname__}", maxsize=maxsize, ttl=ttl, backend=get_backend())
+        _caches[cache.name] = cache
+
+        @wraps(func)
+        def wrapper(*args, **kwargs):
+            key = repr((args, sorted(kwargs.items())))
+            found, value = cache.get(key)
+            if found:
+                return value
+            version = cache.version
+            value = func(*args, **kwargs)
+            cache.set(key, value, version)
+            return value
+
+        wrapper.cache = cache
+        wrapper.cache_clear = cache.clear
+        wrapper.cache_info = cache.info
+        return wrapper
+    return decorator
+
+
+def cache_stats():
+    """info() of every cache registered in this process"""
+    return [cache.info() for cache in _caches.values()]
+
+
+def publish_data_version(version=None):
+    """
+    Publish a new data version (call after the database has been updated).
+
+    Every process's cached entries belong to the previous version and are
+    dropped on their next lookup; the shared backend is emptied as well.
+
+    Returns:
+    str: the published version (default: the current time, to the microsecond)
+    """
+    version = version or datetime.now().strftime('%Y%m%d%H%M%S%f')
+    os.makedirs(os.path.dirname(DATA_VERSION_PATH) or '.', exist_ok=True)
+    tmp_path = f"{DATA_VERSION_PATH}.{os.getpid()}.tmp"
+    with open(tmp_path, 'w') as f:
+        f.write(version)
+    os.replace(tmp_path, DATA_VERSION_PATH)
+
+    if os.path.exists(CACHE_DB_PATH):
+        SQLiteCacheBackend(CACHE_DB_PATH).clear()
+    return version
+
+
+# Define cache decorators; everything below is derived from stock_prices, so
+# it stays valid until update_database publishes a new data version
+top_gainers_cache = ttl_cache(maxsize=100, ttl=DATA_CACHE_DURATION)
+volume_gainers_cache = ttl_cache(maxsize=10, ttl=DATA_CACHE_DURATION)
+stock_data_cache = ttl_cache(maxsize=500, ttl=DATA_CACHE_DURATION)
+series_cache = ttl_cache(maxsize=500, ttl=DATA_CACHE_DURATION)
+database_stats_cache = ttl_cache(maxsize=10, ttl=DATA_CACHE_DURATION)
+trading_dates_cache = ttl_cache(maxsize=10, ttl=DATA_CACHE_DURATION)
@@ -1,4 +1,10 @@
+import pandas as pd
 import yfinance as yf_cloud
+try:
+    from .fundamentals import load_fundamentals, share_counts
+except ImportError:
+    # Imported as top-level `services` package by the scheduled job scripts
+    from services.fundamentals import load_fundamentals, share_counts
 
 # Example usage
 def get_latest_turnover_rate(ticker_symbol):
@@ -51,6 +57,28 @@ def get_latest_turnover_rate(ticker_symbol):
         print(f"Error getting latest turnover rate: {str(e)}")
         return None
 
+def get_turnover_rates(cube, symbols=None):
+    """
+    Latest turnover rate for many stocks at once, without network calls.
+
+    Uses each symbol's latest daily volume from the PriceCube and the share
+    count from the local fundamentals table (float shares, falling back to
+    shares outstanding), i.e. what get_latest_turnover_rate computes.
+
+    Parameters:
+    cube (PriceCube): daily prices
+    symbols (list): symbols to report (default: every symbol in the cube)
+
+    Returns:
+    pd.Series: turnover rate in percent, rounded to 2 decimals, indexed by
+    symbol; NaN where the volume or share count is unknown
+    """
+    symbols = list(cube.symbols if symbols is None else symbols)
+    volume = pd.Series(cube.packed('volume')[:, -1], index=cube.symbols).reindex(symbols)
+    shares = share_counts(load_fundamentals(symbols)).reindex(symbols)
+    shares = shares.where(shares > 0)
+    return (volume / shares * 100).round(2)
+
 if __name__ == "__main__":
     # Calculate daily turnover rates for Apple stock
     ticker = "GTI"
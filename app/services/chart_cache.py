@@ -0,0 +1,229 @@
+import hashlib
+import json
+import multiprocessing
+import os
+import re
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from datetime import datetime, timedelta
+from ..config import CHART_CACHE_DIR, CHART_CACHE_MAX_BYTES
+from ..database import EPOCH_DATE, TIMEFRAME_IDS, get_read_connection
+
+try:
+    import fcntl
+except ImportError:  # Windows: concurrent misses are then only merged within one worker
+    fcntl = None
+
+CHART_FORMATS = {
+    'png': 'image/png',
+    'webp': 'image/webp',
+}
+# Bump when the chart drawing changes, so old images are not served again
+CHART_STYLE = 1
+# Rendering processes per web worker
+CHART_RENDER_WORKERS = 1
+# Lock stripes: misses of the same key always share one
+LOCK_STRIPES = 64
+# Eviction deletes down to this share of the cap, so it does not run again
+# after every single render
+EVICT_TO = 0.9
+# Hits only move an image up the LRU order (its mtime) once per this many seconds
+TOUCH_INTERVAL = 60
+
+
+def last_bar_date(symbol):
+    """Latest daily or weekly bar date ('YYYY-MM-DD') stored for a symbol, or None"""
+    conn = get_read_connection()
+    try:
+        days = [conn.execute("""
+            SELECT MAX(day) FROM stock_bars
+            WHERE symbol_id = (SELECT id FROM symbols WHERE symbol = ?)
+            AND timeframe = ?
+        """, (symbol, timeframe_id)).fetchone()[0] for timeframe_id in TIMEFRAME_IDS.values()]
+    finally:
+        conn.close()
+    days = [day for day in days if day is not None]
+    if not days:
+        return None
+    return (EPOCH_DATE + timedelta(days=max(days))).isoformat()
+
+
+def chart_key(symbol, last_date, params):
+    """
+    File name of a chart: the symbol, its last bar date and a hash of the
+    render parameters (which must include 'format'). A new bar or other
+    parameters give a new name; an existing file never needs refreshing.
+    """
+    digest = hashlib.sha256(json.dumps([symbol, params], sort_keys=True).encode()).hexdigest()[:16]
+    # The hash covers the real symbol; this part only keeps names readable and safe
+    name = re.sub(r'[^A-Za-z0-9.-]', '_', symbol)
+    return f"{name}_{last_date}_{digest}.{params['format']}"
+
+
+class ChartCache:
+    """
+    Rendered chart images on disk, shared by all web workers.
+
+    Files are named by chart_key() and written once (through a temp file
+    and rename). Concurrent misses of one key, in any worker, wait on the
+    same lock and only the first renders. Once the directory holds more
+    than max_bytes the least recently used images (oldest mtime; hits
+    refresh it) are deleted.
+    """
+
+    def __init__(self, directory=CHART_CACHE_DIR, max_bytes=CHART_CACHE_MAX_BYTES):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.stripes = [threading.Lock() for _ in range(LOCK_STRIPES)]
+        self.stats_lock = threading.Lock()
+        self.hits = 0
+        self.waited_hits = 0  # misses another request rendered while this one waited
+        self.renders = 0
+        self.evictions = 0
+        self.size = None  # bytes on disk after the last eviction pass
+
+    def path(self, key):
+        return os.path.join(self.directory, key)
+
+    def _count(self, counter, n=1):
+        with self.stats_lock:
+            setattr(self, counter, getattr(self, counter) + n)
+
+    def _touch(self, path):
+        """Mark a cached image as used; False if it does not exist"""
+        try:
+            mtime = os.stat(path).st_mtime
+        except FileNotFoundError:
+            return False
+        if time.time() - mtime > TOUCH_INTERVAL:
+            try:
+                os.utime(path)
+            except FileNotFoundError:  # evicted meanwhile
+                return False
+        return True
+
+    def _stripe(self, key):
+        # Not hash(): that is salted per process, and the lock files are shared
+        return int(hashlib.sha256(key.encode()).hexdigest()[:8], 16) % LOCK_STRIPES
+
+    def get_or_render(self, key, render):
+        """
+        Path of the cached image for key, calling render(path) first on a
+        miss. render must write the file at path atomically.
+        """
+        path = self.path(key)
+        if self._touch(path):
+            self._count('hits')
+            return path
+
+        stripe = self._stripe(key)
+        os.makedirs(os.path.join(self.directory, '.locks'), exist_ok=True)
+        with self.stripes[stripe], open(os.path.join(self.directory, '.locks', f'{stripe}.lock'), 'w') as lock_file:
+            if fcntl is not None:
+                # Other web workers; the threading lock covers this one
+                fcntl.flock(lock_file, fcntl.LOCK_EX)
+            if self._touch(path):
+                self._count('waited_hits')
+                return path
+            render(path)
+            self._count('renders')
+        self.evict(keep=path)
+        return path
+
+    def evict(self, keep=None):
+        """
+        Delete least recently used images until the directory is back
+        under EVICT_TO of max_bytes (only once it exceeds max_bytes). The
+        image at keep (just rendered, about to be served) is never deleted.
+
+        Returns:
+        int: number of images deleted
+        """
+        entries = []
+        with os.scandir(self.directory) as it:
+            for entry in it:
+                if entry.is_file() and entry.name.rsplit('.', 1)[-1] in CHART_FORMATS:
+                    try:
+                        stat = entry.stat()
+                    except FileNotFoundError:
+                        continue
+                    entries.append((stat.st_mtime, stat.st_size, entry.path))
+        size = sum(entry[1] for entry in entries)
+        deleted = 0
+        if size > self.max_bytes:
+            for _, file_size, path in sorted(entries):
+                if size <= self.max_bytes * EVICT_TO:
+                    break
+                if path == keep:
+                    continue
+                try:
+                    os.remove(path)
+                    deleted += 1
+                except FileNotFoundError:  # another worker got there first
+                    pass
+                size -= file_size
+        self.size = size
+        self._count('evictions', deleted)
+        return deleted
+
+    def info(self):
+        """Hit/render counters and the size found by the last eviction pass"""
+        with self.stats_lock:
+            return {
+                'directory': self.directory,
+                'hits': self.hits,
+                'waited_hits': self.waited_hits,
+                'renders': self.renders,
+                'evictions': self.evictions,
+                'size': self.size,
+                'max_bytes': self.max_bytes,
+            }
+
+
+chart_cache = ChartCache()
+
+_pool = None  # ProcessPoolExecutor rendering this worker's charts
+_pool_lock = threading.Lock()
+
+
+def _render_pool():
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            # Spawned, not forked: the web worker runs threads (database pool,
+            # schedulers) whose locks a forked child could inherit held
+            _pool = ProcessPoolExecutor(max_workers=CHART_RENDER_WORKERS,
+                                        mp_context=multiprocessing.get_context('spawn'))
+        return _pool
+
+
+def _render_stock_chart(symbol, path):
+    # Runs in the render process; matplotlib and scipy only get loaded there
+    from gen_png import update_png
+    update_png(datetime.now().strftime('%Y%m%d'), f"000_{symbol}.png", 1, path)
+
+
+def render_stock_chart(symbol, path):
+    """Render a stock's chart (gen_png's five-panel view) to path in a render process"""
+    global _pool
+    try:
+        _render_pool().submit(_render_stock_chart, symbol, path).result()
+    except BrokenProcessPool:
+        # A render process died (e.g. out of memory): start a new pool next time
+        _pool = None
+        raise
+
+
+def stock_chart_key(symbol, fmt='png'):
+    """Cache key of a stock's chart, or None if there is no data for the symbol"""
+    last_date = last_bar_date(symbol)
+    if last_date is None:
+        return None
+    return chart_key(symbol, last_date, {'chart': 'gen_png.update_png', 'style': CHART_STYLE, 'format': fmt})
+
+
+def stock_chart(symbol, key):
+    """Path of a stock's chart for a key from stock_chart_key(), rendering it on a miss"""
+    return chart_cache.get_or_render(key, lambda path: render_stock_chart(symbol, path))
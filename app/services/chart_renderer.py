@@ -0,0 +1,182 @@
+import os
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+import matplotlib
+matplotlib.use('Agg')  # Set the backend to non-interactive 'Agg'
+import matplotlib.pyplot as plt
+from matplotlib.collections import LineCollection, PolyCollection
+from matplotlib.transforms import Bbox
+
+FIGSIZE = (19, 10)
+
+_chart = None  # ChartAxes of this process, see chart_axes()
+
+
+class ChartAxes:
+    """
+    The five-panel daily/weekly chart: ax1 daily candles, ax2 daily MACD,
+    ax3 trend, ax4 weekly candles and ax5 weekly MACD. ax1-ax3 and ax4-ax5
+    share their x axis.
+    """
+
+    def __init__(self, fig):
+        self.fig = fig
+        # Top group with shared x-axis (ax1, ax2, ax3)
+        gs_top = fig.add_gridspec(3, 1, height_ratios=[2, 0.5, 0.5], hspace=0.00,
+                                  bottom=0.45, top=0.95, left=0.05, right=0.95)
+        self.ax1 = fig.add_subplot(gs_top[0])
+        self.ax2 = fig.add_subplot(gs_top[1], sharex=self.ax1)
+        self.ax3 = fig.add_subplot(gs_top[2], sharex=self.ax1)
+        # Bottom group with separate shared x-axis (ax4, ax5)
+        gs_bottom = fig.add_gridspec(2, 1, height_ratios=[2, 1], hspace=0.00,
+                                     bottom=0.05, top=0.42, left=0.05, right=0.95)
+        self.ax4 = fig.add_subplot(gs_bottom[0])
+        self.ax5 = fig.add_subplot(gs_bottom[1], sharex=self.ax4)
+        self.axes = (self.ax1, self.ax2, self.ax3, self.ax4, self.ax5)
+        self.reset()
+
+    def reset(self):
+        """Clear every panel for the next ticker, keeping the figure and layout"""
+        for ax in self.fig.axes:
+            if ax in self.axes:
+                ax.clear()
+                # clear() keeps the old data limits; an x-only artist drawn
+                # first (axvline) would union the last ticker's y range in
+                ax.dataLim.set(Bbox.null())
+            else:
+                # Twins (ax3.twinx() for the volume) are added per chart
+                ax.remove()
+        # Hide x-axis labels for upper plots in each group
+        for ax in (self.ax1, self.ax2, self.ax4):
+            ax.tick_params(labelbottom=False)
+        # Keep pyplot-style calls (plt.gca(), plt.savefig()) on this figure
+        plt.figure(self.fig.number)
+
+
+def chart_axes():
+    """
+    This process's chart figure, cleared and ready to draw on.
+
+    The figure is built once per process and reused for every ticker, so a
+    batch pays for the figure and axes setup only once per worker.
+    """
+    global _chart
+    if _chart is None or not plt.fignum_exists(_chart.fig.number):
+        _chart = ChartAxes(plt.figure(figsize=FIGSIZE))
+    else:
+        _chart.reset()
+    return _chart
+
+
+def _boxes(x, bottom, top, width):
+    """(n, 4, 2) rectangle vertices centred on x, for a PolyCollection"""
+    left, right = x - width / 2, x + width / 2
+    return np.stack([np.column_stack(corner) for corner in
+                     ((left, bottom), (right, bottom), (right, top), (left, top))], axis=1)
+
+
+def draw_candlesticks(ax, data, up_color='green', down_color='red', up_face=None,
+                      up_edge_width=1.0, down_edge_width=1.0):
+    """
+    Candlesticks for the Open/High/Low/Close columns of data at x = 0..n-1,
+    as one LineCollection of wicks and one PolyCollection of bodies (two
+    artists per chart instead of two per bar).
+
+    Bars with close >= open use up_color (bodies filled with up_face, by
+    default the same colour); the others down_color. Bars with a missing
+    price are skipped.
+    """
+    o, h, l, c = (data[column].to_numpy(dtype=float) for column in ('Open', 'High', 'Low', 'Close'))
+    x = np.arange(len(data), dtype=float)
+    keep = np.isfinite(o) & np.isfinite(h) & np.isfinite(l) & np.isfinite(c)
+    x, o, h, l, c = x[keep], o[keep], h[keep], l[keep], c[keep]
+    up = c >= o
+    colors = np.where(up, up_color, down_color)
+
+    wicks = np.stack([np.column_stack((x, l)), np.column_stack((x, h))], axis=1)
+    ax.add_collection(LineCollection(wicks, colors=colors, linewidths=2, zorder=1))
+    bodies = _boxes(x, np.minimum(o, c), np.maximum(o, c), 0.6)
+    ax.add_collection(PolyCollection(
+        bodies,
+        facecolors=np.where(up, up_face or up_color, down_color),
+        edgecolors=colors,
+        linewidths=np.where(up, up_edge_width, down_edge_width),
+        zorder=2))
+
+
+def draw_bars(ax, x, heights, colors, width=0.8, alpha=None):
+    """
+    ax.bar(x, heights, color=colors, width=width, alpha=alpha) as a single
+    PolyCollection, including bar()'s sticky y=0 baseline.
+    """
+    x = np.asarray(x, dtype=float)
+    heights = np.asarray(heights, dtype=float)
+    keep = np.isfinite(heights)
+    bars = PolyCollection(_boxes(x[keep], np.zeros(keep.sum()), heights[keep], width),
+                          facecolors=np.asarray(colors)[keep], edgecolors='none', alpha=alpha)
+    bars.sticky_edges.y.append(0)
+    ax.add_collection(bars)
+
+
+def draw_markers(axes, xs, color, linestyle='-'):
+    """
+    Full-height vertical lines at xs (like ax.axvline at each x) on every
+    axes in axes, drawn as one LineCollection per axes.
+    """
+    if len(xs) == 0:
+        return
+    segments = [[(x, 0), (x, 1)] for x in xs]
+    for ax in axes:
+        # x in data, y in axes coordinates; autolim off so y limits stay put
+        ax.add_collection(LineCollection(segments, colors=color, linestyles=linestyle,
+                                         linewidths=plt.rcParams['lines.linewidth'],
+                                         transform=ax.get_xaxis_transform()),
+                          autolim=False)
+
+
+def save_chart(fig, path):
+    """
+    Save through a temp file and rename, so the web app never serves a
+    half-written image. The format follows the extension (.png, .webp).
+    """
+    os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+    # tight_layout() leaves a placeholder layout engine behind, which makes
+    # savefig draw the whole figure an extra time just to lay it out again
+    fig.set_layout_engine('none')
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    try:
+        fig.savefig(tmp_path, format=os.path.splitext(path)[1][1:] or 'png')
+        os.replace(tmp_path, path)
+    finally:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+
+
+def _render_one(render, args):
+    try:
+        render(*args)
+        return None
+    except Exception as e:
+        return f"{type(e).__name__}: {e}"
+
+
+def render_charts(render, jobs, workers=None):
+    """
+    Run render(*args) for every args tuple in jobs on a pool of worker
+    processes (os.cpu_count() by default; 1 renders in this process).
+
+    render must be a module-level function, as ProcessPoolExecutor pickles
+    it by name. A failed chart does not stop the batch.
+
+    Returns:
+    list: None for each rendered chart, or the error message, in job order
+    """
+    jobs = list(jobs)
+    workers = workers or os.cpu_count() or 1
+    if workers == 1 or len(jobs) < 2:
+        return [_render_one(render, args) for args in jobs]
+
+    with ProcessPoolExecutor(max_workers=min(workers, len(jobs))) as executor:
+        # One chart per task: render times vary a lot more than the
+        # scheduling overhead
+        return list(executor.map(_render_one, [render] * len(jobs), jobs))
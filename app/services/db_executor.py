@@ -0,0 +1,62 @@
+import asyncio
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+
+from ..database import POOL_SIZE
+
+DB_THREADS = POOL_SIZE      # one thread per pooled read connection
+DB_MAX_PENDING = 32         # queries admitted per worker (running + queued)
+DB_TIMEOUT = 15             # seconds a request waits for its query
+
+_executor = ThreadPoolExecutor(max_workers=DB_THREADS, thread_name_prefix='db')
+_slots = threading.local()  # the admission semaphore of this thread's running loop
+
+
+def _loop_slots(loop):
+    """
+    The admission semaphore of the running loop, created on its first
+    call. Before Python 3.10 a Semaphore binds to the loop current when
+    it is created, so one made at import time fails under another loop.
+    """
+    if getattr(_slots, 'loop', None) is not loop:
+        _slots.loop, _slots.semaphore = loop, asyncio.Semaphore(DB_MAX_PENDING)
+    return _slots.semaphore
+
+
+def _release(loop, slots):
+    try:
+        loop.call_soon_threadsafe(slots.release)
+    except RuntimeError:  # the loop was closed while the call ran
+        pass
+
+
+class QueryTimeout(TimeoutError):
+    """A data-access call did not finish (or start) within its timeout"""
+
+
+async def run_db(func, *args, timeout=DB_TIMEOUT, **kwargs):
+    """
+    Run a blocking data-access call (SQLite, pandas) on the bounded thread
+    pool, so the event loop keeps serving other requests meanwhile.
+
+    At most DB_MAX_PENDING calls are admitted at once; beyond that callers
+    wait for a slot. A slot is only freed once its call has finished (or
+    was dropped before starting), so timed-out queries still count against
+    the limit while they run. Both the wait and the call count against
+    `timeout`, after which QueryTimeout is raised.
+    """
+    loop = asyncio.get_running_loop()
+    deadline = loop.time() + timeout
+    slots = _loop_slots(loop)
+    try:
+        await asyncio.wait_for(slots.acquire(), timeout)
+    except asyncio.TimeoutError:
+        raise QueryTimeout(f"{func.__name__} waited more than {timeout}s for a free slot")
+
+    future = _executor.submit(partial(func, *args, **kwargs))
+    future.add_done_callback(lambda _: _release(loop, slots))
+    try:
+        return await asyncio.wait_for(asyncio.wrap_future(future), max(deadline - loop.time(), 0))
+    except asyncio.TimeoutError:
+        raise QueryTimeout(f"{func.__name__} took more than {timeout}s")
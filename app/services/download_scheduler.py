@@ -0,0 +1,220 @@
+import json
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from datetime import datetime
+
+
+class RateLimitError(Exception):
+    """Raised by a downloader when the data provider answers with a 429"""
+
+
+class TokenBucket:
+    """
+    Thread-safe token bucket limiting how often downloads may start.
+
+    Parameters:
+    rate (float): tokens added per second
+    capacity (int): maximum burst size
+    clock, sleep: injectable for tests against a fake downloader
+    """
+
+    def __init__(self, rate, capacity, clock=time.monotonic, sleep=time.sleep):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.clock = clock
+        self.sleep = sleep
+        self.updated = clock()
+        self.lock = threading.Lock()
+
+    def _refill(self):
+        now = self.clock()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def acquire(self):
+        """Block until a token is available, then take it"""
+        while True:
+            with self.lock:
+                self._refill()
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                wait = (1 - self.tokens) / self.rate
+            self.sleep(wait)
+
+    def set_rate(self, rate):
+        with self.lock:
+            self._refill()
+            self.rate = rate
+
+
+class RetryQueue:
+    """
+    Symbols whose download failed, persisted as JSON so the next run
+    only retries them instead of re-scanning the whole universe.
+    """
+
+    def __init__(self, path="static/logs/download_retry_queue.json"):
+        self.path = path
+        self.entries = {}
+        self.lock = threading.Lock()
+        self.load()
+
+    def load(self):
+        try:
+            if os.path.exists(self.path):
+                with open(self.path, 'r') as f:
+                    self.entries = json.load(f)
+        except Exception as e:
+            print(f"Error loading retry queue: {str(e)}")
+            self.entries = {}
+
+    def save(self):
+        try:
+            os.makedirs(os.path.dirname(self.path), exist_ok=True)
+            tmp_path = f"{self.path}.tmp"
+            with open(tmp_path, 'w') as f:
+                json.dump(self.entries, f, indent=2)
+            os.replace(tmp_path, self.path)
+        except Exception as e:
+            print(f"Error saving retry queue: {str(e)}")
+
+    def add(self, symbols, error):
+        with self.lock:
+            for symbol in symbols:
+                entry = self.entries.get(symbol, {'attempts': 0})
+                entry['attempts'] += 1
+                entry['last_error'] = error
+                entry['last_attempt'] = datetime.now().isoformat()
+                self.entries[symbol] = entry
+
+    def remove(self, symbols):
+        with self.lock:
+            for symbol in symbols:
+                self.entries.pop(symbol, None)
+
+    def pending(self):
+        return sorted(self.entries)
+
+    def __len__(self):
+        return len(self.entries)
+
+
+class DownloadScheduler:
+    """
+    Download symbols in batches on a bounded worker pool.
+
+    fetch(batch) runs on the workers and returns the downloaded data (or
+    None when there is nothing to store); process(batch, data) runs on the
+    calling thread, so a single SQLite connection can do all the writing.
+
+    Every download takes a token from the bucket first. A RateLimitError
+    halves the request rate, pauses all workers for an exponentially
+    growing backoff and requeues the batch; successful downloads let the
+    rate creep back up to its configured value. Batches that keep failing
+    end up in the persistent retry queue.
+    """
+
+    def __init__(self, fetch, process, batch_size=5, max_workers=4, rate=2.0, burst=4,
+                 max_attempts=5, backoff=5.0, max_backoff=300.0, retry_queue=None,
+                 log=print, clock=time.monotonic, sleep=time.sleep):
+        self.fetch = fetch
+        self.process = process
+        self.batch_size = batch_size
+        self.max_workers = max_workers
+        self.base_rate = rate
+        self.min_rate = rate / 16
+        self.max_attempts = max_attempts
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.retry_queue = retry_queue if retry_queue is not None else RetryQueue()
+        self.log = log
+        self.sleep = sleep
+        self.clock = clock
+        self.bucket = TokenBucket(rate, burst, clock=clock, sleep=sleep)
+        self.lock = threading.Lock()
+        self.paused_until = 0.0
+        self.consecutive_429 = 0
+
+    def _wait_if_paused(self):
+        while True:
+            with self.lock:
+                wait = self.paused_until - self.clock()
+            if wait <= 0:
+                return
+            self.sleep(wait)
+
+    def _on_rate_limited(self):
+        with self.lock:
+            self.consecutive_429 += 1
+            delay = min(self.max_backoff, self.backoff * 2 ** (self.consecutive_429 - 1))
+            self.paused_until = max(self.paused_until, self.clock() + delay)
+            rate = max(self.min_rate, self.bucket.rate / 2)
+        self.bucket.set_rate(rate)
+        self.log(f"Rate limited; backing off {delay:.0f}s, rate now {rate:.2f}/s")
+
+    def _on_success(self):
+        with self.lock:
+            self.consecutive_429 = 0
+            rate = min(self.base_rate, self.bucket.rate * 1.25)
+        self.bucket.set_rate(rate)
+
+    def _download(self, batch):
+        self._wait_if_paused()
+        self.bucket.acquire()
+        return self.fetch(batch)
+
+    def run(self, symbols):
+        """
+        Download and process all symbols.
+
+        Returns:
+        dict: batches, downloaded, rate_limited, failed (symbols) and added
+        (sum of what process returned)
+        """
+        batches = [list(symbols[i:i + self.batch_size])
+                   for i in range(0, len(symbols), self.batch_size)]
+        summary = {'batches': len(batches), 'downloaded': 0, 'rate_limited': 0,
+                   'failed': [], 'added': 0}
+        if not batches:
+            return summary
+
+        attempts = {}
+        with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+            pending = {executor.submit(self._download, batch): tuple(batch) for batch in batches}
+            while pending:
+                for future in as_completed(list(pending)):
+                    batch = pending.pop(future)
+                    try:
+                        data = future.result()
+                    except RateLimitError as e:
+                        summary['rate_limited'] += 1
+                        attempts[batch] = attempts.get(batch, 0) + 1
+                        self._on_rate_limited()
+                        if attempts[batch] < self.max_attempts:
+                            pending[executor.submit(self._download, list(batch))] = batch
+                        else:
+                            self.retry_queue.add(batch, f"rate limited: {str(e)}")
+                            summary['failed'].extend(batch)
+                        continue
+                    except Exception as e:
+                        self.log(f"Error downloading {', '.join(batch)}: {str(e)}")
+                        self.retry_queue.add(batch, str(e))
+                        summary['failed'].extend(batch)
+                        continue
+
+                    self._on_success()
+                    summary['downloaded'] += 1
+                    try:
+                        summary['added'] += self.process(list(batch), data) or 0
+                        self.retry_queue.remove(batch)
+                    except Exception as e:
+                        self.log(f"Error processing {', '.join(batch)}: {str(e)}")
+                        self.retry_queue.add(batch, str(e))
+                        summary['failed'].extend(batch)
+
+        self.retry_queue.save()
+        return summary
@@ -0,0 +1,79 @@
+import pandas as pd
+try:
+    from ..database import get_read_connection, DB_PATH
+except ImportError:
+    # Imported as top-level `services` package by the scheduled job scripts
+    from database import get_read_connection, DB_PATH
+
+# yfinance info key -> fundamentals column
+INFO_FIELDS = {
+    'floatShares': 'float_shares',
+    'sharesOutstanding': 'shares_outstanding',
+    'marketCap': 'market_cap',
+    'country': 'country',
+}
+FUNDAMENTAL_COLUMNS = ['symbol'] + list(INFO_FIELDS.values()) + ['updated_at']
+
+
+def create_fundamentals_table(conn):
+    """Create the fundamentals table (refreshed by applications/update_fundamentals.py)"""
+    conn.execute('''
+    CREATE TABLE IF NOT EXISTS fundamentals (
+        symbol TEXT PRIMARY KEY,
+        float_shares REAL,
+        shares_outstanding REAL,
+        market_cap REAL,
+        country TEXT,
+        updated_at TEXT
+    )
+    ''')
+    conn.commit()
+
+
+def upsert_fundamentals(conn, records):
+    """
+    Insert or update fundamentals rows.
+
+    Parameters:
+    records (list): dicts with a 'symbol' key and any of the fundamentals
+    columns; missing or None values keep what is already stored
+    """
+    conn.executemany('''
+        INSERT INTO fundamentals (symbol, float_shares, shares_outstanding, market_cap, country, updated_at)
+        VALUES (:symbol, :float_shares, :shares_outstanding, :market_cap, :country, :updated_at)
+        ON CONFLICT(symbol) DO UPDATE SET
+            float_shares = COALESCE(excluded.float_shares, fundamentals.float_shares),
+            shares_outstanding = COALESCE(excluded.shares_outstanding, fundamentals.shares_outstanding),
+            market_cap = COALESCE(excluded.market_cap, fundamentals.market_cap),
+            country = COALESCE(excluded.country, fundamentals.country),
+            updated_at = COALESCE(excluded.updated_at, fundamentals.updated_at)
+    ''', [{column: record.get(column) for column in FUNDAMENTAL_COLUMNS} for record in records])
+
+
+def load_fundamentals(symbols=None, db_path=DB_PATH):
+    """
+    Stored fundamentals as a DataFrame indexed by symbol.
+
+    Returns an empty frame if the table has not been created yet.
+    """
+    conn = get_read_connection(db_path)
+    try:
+        query = "SELECT * FROM fundamentals"
+        params = []
+        if symbols is not None:
+            symbols = list(symbols)
+            query += f" WHERE symbol IN ({','.join('?' * len(symbols))})"
+            params = symbols
+        df = pd.read_sql_query(query, conn, params=params)
+    except Exception:
+        df = pd.DataFrame(columns=FUNDAMENTAL_COLUMNS)
+    finally:
+        conn.close()
+    return df.set_index('symbol')
+
+
+def share_counts(fundamentals):
+    """Float shares where known, shares outstanding otherwise (as get_latest_turnover_rate did)"""
+    float_shares = fundamentals['float_shares'].astype(float)
+    shares_outstanding = fundamentals['shares_outstanding'].astype(float)
+    return float_shares.where(float_shares > 0, shares_outstanding)
@@ -0,0 +1,297 @@
+import argparse
+import json
+import os
+from datetime import date, timedelta
+import pandas as pd
+try:
+    from ..config import ARCHIVE_DIR
+    from ..database import connect, DB_PATH, EPOCH_DATE, TIMEFRAME_IDS, day_sql, to_day
+except ImportError:
+    # Imported as top-level `services` package by the scheduled job scripts
+    from config import ARCHIVE_DIR
+    from database import connect, DB_PATH, EPOCH_DATE, TIMEFRAME_IDS, day_sql, to_day
+
+try:
+    import pyarrow as pa
+    import pyarrow.compute as pc
+except ImportError:  # optional: without it every read stays on SQLite
+    pa = pc = None
+
+# Reads of at least this many symbols (or of every symbol) go to the archive
+# for the part of the range it covers. Year files hold the whole universe,
+# so reading one for a few symbols costs more than their SQLite key ranges,
+# however long the range.
+WHOLE_UNIVERSE_SYMBOLS = 200
+# Rows per record batch in the year files
+BATCH_ROWS = 65536
+
+MANIFEST = 'manifest.json'
+# What read_sql_query(parse_dates=...) gives for ISO dates in this pandas
+# version, so archive frames concatenate cleanly with SQLite ones
+DATE_DTYPE = pd.to_datetime(pd.Series(['1970-01-01'])).dtype
+BAR_FIELDS = ['open', 'high', 'low', 'close', 'volume', 'dividends', 'stock_splits']
+
+_manifest = (None, None)  # ((path, mtime), parsed manifest) last read by this process
+
+
+def _schema():
+    return pa.schema([
+        ('symbol', pa.dictionary(pa.int32(), pa.string())),
+        ('date', pa.date32()),
+        ('open', pa.float64()),
+        ('high', pa.float64()),
+        ('low', pa.float64()),
+        ('close', pa.float64()),
+        ('volume', pa.int64()),
+        ('dividends', pa.float64()),
+        ('stock_splits', pa.float64()),
+    ])
+
+
+def _year_path(timeframe, year, archive_dir=ARCHIVE_DIR):
+    return os.path.join(archive_dir, timeframe, f'{year}.arrow')
+
+
+def _write_atomic(path, write):
+    """Write through a temp file and rename, so readers never see a partial file"""
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    try:
+        write(tmp_path)
+        os.replace(tmp_path, path)
+    finally:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+
+
+def load_manifest(archive_dir=ARCHIVE_DIR):
+    """
+    The archive manifest: per timeframe, the last archived date and a
+    signature of every archived year. Re-read only when the file changed;
+    {} if there is no archive yet.
+    """
+    global _manifest
+    path = os.path.join(archive_dir, MANIFEST)
+    try:
+        mtime = os.stat(path).st_mtime_ns
+    except FileNotFoundError:
+        return {}
+    if _manifest[0] != (path, mtime):
+        with open(path) as f:
+            _manifest = ((path, mtime), json.load(f))
+    return _manifest[1]
+
+
+def _write_manifest(manifest, archive_dir):
+    def write(tmp_path):
+        with open(tmp_path, 'w') as f:
+            json.dump(manifest, f, indent=1, sort_keys=True)
+    _write_atomic(os.path.join(archive_dir, MANIFEST), write)
+
+
+def _year_signatures(conn, timeframe):
+    """
+    {year: [rows, total volume, rounded close sum]} of the stored bars,
+    used to spot the closed years whose data changed since they were
+    archived (back-fills, split adjustments).
+    """
+    rows = conn.execute(f"""
+        SELECT CAST(strftime('%Y', {day_sql()}) AS INTEGER) AS year,
+               COUNT(*), TOTAL(volume), ROUND(TOTAL(close), 4)
+        FROM stock_bars
+        WHERE timeframe = ?
+        GROUP BY year
+    """, (TIMEFRAME_IDS[timeframe],))
+    return {str(year): [count, volume, close] for year, count, volume, close in rows}
+
+
+def _year_signature(conn, timeframe, year):
+    """_year_signatures for one year, through the (timeframe, day) index; None if it has no bars"""
+    count, volume, close = conn.execute("""
+        SELECT COUNT(*), TOTAL(volume), ROUND(TOTAL(close), 4)
+        FROM stock_bars
+        WHERE timeframe = ? AND day BETWEEN ? AND ?
+    """, (TIMEFRAME_IDS[timeframe], to_day(f'{year}-01-01'), to_day(f'{year}-12-31'))).fetchone()
+    return [count, volume, close] if count else None
+
+
+def _day_year(day):
+    return (EPOCH_DATE + timedelta(days=day)).year
+
+
+def _read_year(conn, timeframe, year):
+    """One year of bars from SQLite as an Arrow table, ordered by symbol, date"""
+    df = pd.read_sql_query(f"""
+        SELECT s.symbol, b.day AS date, {', '.join('b.' + field for field in BAR_FIELDS)}
+        FROM stock_bars b
+        JOIN symbols s ON s.id = b.symbol_id
+        WHERE b.timeframe = ?
+        AND b.day BETWEEN ? AND ?
+        ORDER BY s.symbol, b.day
+    """, conn, params=(TIMEFRAME_IDS[timeframe], to_day(f'{year}-01-01'), to_day(f'{year}-12-31')))
+    schema = _schema()
+    columns = {
+        # day numbers count from 1970-01-01, exactly like date32
+        'symbol': pa.array(df['symbol'], type=pa.string()).dictionary_encode(),
+        'date': pa.array(df['date'], type=pa.int32()).cast(pa.date32()),
+    }
+    for field in BAR_FIELDS:
+        columns[field] = pa.array(df[field], type=schema.field(field).type, from_pandas=True)
+    return pa.table(columns, schema=schema)
+
+
+def update_archive(conn, timeframes=('daily', 'weekly'), archive_dir=ARCHIVE_DIR, changed=None):
+    """
+    Bring the archive in line with stock_bars.
+
+    Every closed year (before the year of the latest stored bar) is kept as
+    one Arrow IPC file per timeframe; the current year only lives in
+    SQLite. Only years that are new or whose signature changed are
+    rewritten. Files and the manifest are swapped in atomically.
+
+    changed=(first_day, last_day) says the bars written since the last
+    update all fall in that day range: then only the closed years it
+    overlaps, and closed years not archived yet, are signed again (one
+    indexed range each). changed=None signs every year with a full scan,
+    for writes that could be anywhere (e.g. the weekend purge).
+
+    Returns:
+    dict: timeframe -> list of years written (None if pyarrow is missing)
+    """
+    if pa is None:
+        return None
+    manifest = dict(load_manifest(archive_dir))
+    written = {}
+    for timeframe in timeframes:
+        last_day = conn.execute("SELECT MAX(day) FROM stock_bars WHERE timeframe = ?",
+                                (TIMEFRAME_IDS[timeframe],)).fetchone()[0]
+        if last_day is None:
+            continue
+        current_year = _day_year(last_day)
+        archived = manifest.get(timeframe, {}).get('years', {})
+        if changed is None:
+            signatures = {year: signature for year, signature in _year_signatures(conn, timeframe).items()
+                          if int(year) < current_year}
+        else:
+            first_year = _day_year(conn.execute("SELECT MIN(day) FROM stock_bars WHERE timeframe = ?",
+                                                (TIMEFRAME_IDS[timeframe],)).fetchone()[0])
+            changed_years = range(_day_year(changed[0]), _day_year(changed[1]) + 1)
+            signatures = {}
+            for year in map(str, range(first_year, current_year)):
+                if year in archived and int(year) not in changed_years:
+                    signatures[year] = archived[year]
+                    continue
+                signature = _year_signature(conn, timeframe, year)
+                if signature is not None:
+                    signatures[year] = signature
+
+        written[timeframe] = []
+        for year, signature in sorted(signatures.items()):
+            path = _year_path(timeframe, year, archive_dir)
+            if archived.get(year) == signature and os.path.exists(path):
+                continue
+            table = _read_year(conn, timeframe, year)
+
+            def write(tmp_path, table=table):
+                with pa.OSFile(tmp_path, 'wb') as sink:
+                    with pa.ipc.new_file(sink, table.schema) as writer:
+                        writer.write_table(table, max_chunksize=BATCH_ROWS)
+            _write_atomic(path, write)
+            written[timeframe].append(int(year))
+
+        # Years that no longer hold any bars
+        for year in set(archived) - set(signatures):
+            path = _year_path(timeframe, year, archive_dir)
+            if os.path.exists(path):
+                os.remove(path)
+
+        manifest[timeframe] = {
+            'through': f'{current_year - 1}-12-31' if signatures else None,
+            'years': signatures,
+        }
+
+    _write_manifest(manifest, archive_dir)
+    return written
+
+
+def invalidate_archive(timeframe, first_day, last_day, archive_dir=ARCHIVE_DIR):
+    """
+    Take the years between two day numbers out of the archive after their
+    bars were changed outside an ingest (e.g. a deleted symbol). Reads of
+    those years fall back to SQLite until the next update_archive rewrites
+    them.
+    """
+    manifest = dict(load_manifest(archive_dir))
+    entry = manifest.get(timeframe)
+    if not entry or entry.get('through') is None:
+        return
+    first_year, last_year = _day_year(first_day), _day_year(last_day)
+    years = {year: signature for year, signature in entry['years'].items()
+             if not first_year <= int(year) <= last_year}
+    # Archived reads must not skip a year: stop before the first one taken out
+    through = min(entry['through'], f'{first_year - 1}-12-31')
+    manifest[timeframe] = {'through': through if years else None, 'years': years}
+    _write_manifest(manifest, archive_dir)
+
+
+def archived_through(start_date, end_date, timeframe, n_symbols=None, archive_dir=ARCHIVE_DIR):
+    """
+    Whether a read should use the archive: returns the last archived date
+    ('YYYY-MM-DD') if the range starts inside the archive and the read is
+    whole-universe (n_symbols None means every symbol, otherwise at least
+    WHOLE_UNIVERSE_SYMBOLS); otherwise None and the read stays on SQLite.
+    The range length does not matter: end_date is only taken for symmetry
+    with the readers.
+    """
+    if pa is None:
+        return None
+    if n_symbols is not None and n_symbols < WHOLE_UNIVERSE_SYMBOLS:
+        return None
+    through = load_manifest(archive_dir).get(timeframe, {}).get('through')
+    if through is None or str(start_date)[:10] > through:
+        return None
+    return through
+
+
+def read_archive(symbols, start_date, end_date, timeframe, archive_dir=ARCHIVE_DIR):
+    """
+    Archived bars between two dates (inclusive) as a long frame with the
+    columns of the SQLite reads: symbol, date, open, ..., stock_splits,
+    ordered by symbol, date. symbols=None reads every symbol.
+
+    Year files are memory-mapped, so the filters and the conversion work on
+    the mapped pages directly.
+    """
+    start, end = date.fromisoformat(str(start_date)[:10]), date.fromisoformat(str(end_date)[:10])
+    years = load_manifest(archive_dir).get(timeframe, {}).get('years', {})
+    tables = []
+    for year in range(start.year, end.year + 1):
+        if str(year) not in years:
+            continue
+        with pa.memory_map(_year_path(timeframe, year, archive_dir)) as source:
+            table = pa.ipc.open_file(source).read_all()
+        mask = pc.and_(pc.greater_equal(table['date'], pa.scalar(start, pa.date32())),
+                       pc.less_equal(table['date'], pa.scalar(end, pa.date32())))
+        if symbols is not None:
+            mask = pc.and_(mask, pc.is_in(table['symbol'], value_set=pa.array(symbols, type=pa.string())))
+        tables.append(table.filter(mask))
+
+    if not tables:
+        table = _schema().empty_table()
+    else:
+        # Year files have their own dictionaries; unify before concatenating
+        table = pa.concat_tables(tables).unify_dictionaries()
+    table = table.set_column(0, 'symbol', table['symbol'].cast(pa.string()))
+    df = table.to_pandas(date_as_object=False)
+    df['date'] = df['date'].astype(DATE_DTYPE)
+    return df.sort_values(['symbol', 'date'], kind='stable', ignore_index=True)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Write closed years of stock_bars to the Arrow archive")
+    parser.add_argument('--db', default=DB_PATH)
+    args = parser.parse_args()
+
+    conn = connect(args.db)
+    print(update_archive(conn))
+    conn.close()
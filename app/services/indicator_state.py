@@ -0,0 +1,323 @@
+import argparse
+import json
+import numpy as np
+import pandas as pd
+try:
+    from ..database import connect, get_read_connection, DB_PATH, TIMEFRAME_IDS, day_sql, day_from_sql
+    from .analysis import EMA_RIBBON_SPANS, pack_right, rsi_2d
+except ImportError:
+    # Imported as top-level `services` package by the scheduled job scripts
+    from database import connect, get_read_connection, DB_PATH, TIMEFRAME_IDS, day_sql, day_from_sql
+    from services.analysis import EMA_RIBBON_SPANS, pack_right, rsi_2d
+
+# Everything the screeners need carried forward from one bar to the next:
+# the EMA ribbon plus the MACD spans, the MACD signal line, and the last
+# close-to-close changes for the (simple rolling mean) RSI windows.
+STATE_EMA_SPANS = sorted(set(EMA_RIBBON_SPANS) | {12, 26})
+MACD_SIGNAL_SPAN = 9
+RSI_WINDOWS = (6, 12, 24)
+DELTA_WINDOW = max(RSI_WINDOWS)
+# Symbols per history read when rebuilding
+REBUILD_CHUNK = 500
+
+EMA_COLUMNS = [f'ema_{span}' for span in STATE_EMA_SPANS]
+RSI_COLUMNS = [f'avg_{kind}_{window}' for window in RSI_WINDOWS for kind in ('gain', 'loss')]
+STATE_COLUMNS = (['symbol', 'timeframe', 'date', 'bars', 'close'] + EMA_COLUMNS +
+                 ['macd', 'macd_signal', 'macd_hist'] + RSI_COLUMNS + ['deltas'])
+
+
+def create_indicator_state_table(conn):
+    """Create the indicator_state table (one row per symbol and timeframe)"""
+    columns = ',\n        '.join(f'{name} REAL' for name in EMA_COLUMNS + ['macd', 'macd_signal', 'macd_hist'] + RSI_COLUMNS)
+    conn.execute(f'''
+    CREATE TABLE IF NOT EXISTS indicator_state (
+        symbol TEXT NOT NULL,
+        timeframe TEXT NOT NULL,
+        date TEXT NOT NULL,
+        bars INTEGER NOT NULL,
+        close REAL,
+        {columns},
+        deltas TEXT,
+        PRIMARY KEY (symbol, timeframe)
+    )
+    ''')
+    conn.commit()
+
+
+class IndicatorState:
+    """
+    Indicator state for a set of symbols as arrays, advanced one bar at a
+    time for all symbols at once.
+
+    Attributes:
+    symbols (list): symbol per row
+    dates (np.ndarray): date of the last bar folded in (object, None if none)
+    bars (np.ndarray): number of bars folded in
+    close (np.ndarray): last close
+    ema (np.ndarray): (len(STATE_EMA_SPANS), symbols) last EMA values
+    signal (np.ndarray): last MACD signal value
+    deltas (np.ndarray): (symbols, DELTA_WINDOW) last close changes, NaN-padded on the left
+    """
+
+    alphas = 2.0 / (np.array(STATE_EMA_SPANS, dtype=float)[:, None] + 1.0)
+    signal_alpha = 2.0 / (MACD_SIGNAL_SPAN + 1.0)
+    fast = STATE_EMA_SPANS.index(12)
+    slow = STATE_EMA_SPANS.index(26)
+
+    def __init__(self, symbols):
+        n = len(symbols)
+        self.symbols = list(symbols)
+        self.dates = np.full(n, None, dtype=object)
+        self.bars = np.zeros(n, dtype=int)
+        self.close = np.full(n, np.nan)
+        self.ema = np.full((len(STATE_EMA_SPANS), n), np.nan)
+        self.signal = np.full(n, np.nan)
+        self.deltas = np.full((n, DELTA_WINDOW), np.nan)
+
+    @classmethod
+    def from_frame(cls, df):
+        """Rebuild the arrays from indicator_state rows"""
+        state = cls(df['symbol'])
+        state.dates = df['date'].to_numpy(dtype=object)
+        state.bars = df['bars'].to_numpy(dtype=int)
+        state.close = df['close'].to_numpy(dtype=float)
+        state.ema = df[EMA_COLUMNS].to_numpy(dtype=float).T.copy()
+        state.signal = df['macd_signal'].to_numpy(dtype=float)
+        state.deltas = np.array([json.loads(d) for d in df['deltas']], dtype=float).reshape(len(df), DELTA_WINDOW)
+        return state
+
+    def fold(self, closes, dates):
+        """
+        Advance the state over new bars.
+
+        Parameters:
+        closes: (symbols, n) new closes per symbol, oldest first, NaN-padded on the right
+        dates: (symbols, n) matching date strings
+        """
+        for k in range(closes.shape[1]):
+            x = closes[:, k]
+            has_bar = ~np.isnan(x)
+            started = self.bars > 0
+            # pandas turns the first (NaN) close change into a 0 gain / 0 loss
+            delta = np.where(started, x - self.close, 0.0)
+            ema = np.where(started, self.alphas * x + (1 - self.alphas) * self.ema, x)
+            self.ema = np.where(has_bar, ema, self.ema)
+            macd = self.ema[self.fast] - self.ema[self.slow]
+            signal = np.where(started, self.signal_alpha * macd + (1 - self.signal_alpha) * self.signal, macd)
+            self.signal = np.where(has_bar, signal, self.signal)
+            shifted = np.concatenate([self.deltas[:, 1:], delta[:, None]], axis=1)
+            self.deltas = np.where(has_bar[:, None], shifted, self.deltas)
+            self.close = np.where(has_bar, x, self.close)
+            self.dates = np.where(has_bar, dates[:, k], self.dates)
+            self.bars = self.bars + has_bar
+
+    def averages(self, window):
+        """Rolling mean gain and loss over the last `window` changes (NaN until there are enough bars)"""
+        recent = self.deltas[:, -window:]
+        enough = self.bars >= window
+        gain = np.where(enough, np.where(recent > 0, recent, 0.0).mean(axis=1), np.nan)
+        loss = np.where(enough, np.where(recent < 0, -recent, 0.0).mean(axis=1), np.nan)
+        return gain, loss
+
+    def rows(self, timeframe):
+        """indicator_state rows for the symbols that have at least one bar"""
+        macd = self.ema[self.fast] - self.ema[self.slow]
+        columns = [self.bars, self.close, *self.ema, macd, self.signal, 2 * (macd - self.signal)]
+        for window in RSI_WINDOWS:
+            columns.extend(self.averages(window))
+        values = np.column_stack(columns).astype(object)
+        values[pd.isna(values)] = None
+        deltas = [json.dumps([None if np.isnan(d) else float(d) for d in row]) for row in self.deltas]
+        return [(symbol, timeframe, date, int(row[0]), *row[1:], delta)
+                for symbol, date, row, delta in zip(self.symbols, self.dates, values, deltas)
+                if date is not None]
+
+
+def _to_matrix(df, symbols):
+    """Long (symbol, date, close) frame -> (symbols, n) closes and dates, oldest first, NaN-padded on the right"""
+    row = pd.Index(symbols).get_indexer(df['symbol'])
+    col = df.groupby('symbol', sort=False).cumcount().to_numpy()
+    width = int(col.max()) + 1 if len(df) else 0
+    closes = np.full((len(symbols), width), np.nan)
+    dates = np.full((len(symbols), width), None, dtype=object)
+    closes[row, col] = df['close'].to_numpy(dtype=float)
+    dates[row, col] = df['date'].to_numpy(dtype=object)
+    return closes, dates
+
+
+def _save(conn, state, timeframe):
+    placeholders = ','.join('?' * len(STATE_COLUMNS))
+    conn.executemany(
+        f"INSERT OR REPLACE INTO indicator_state ({','.join(STATE_COLUMNS)}) VALUES ({placeholders})",
+        state.rows(timeframe)
+    )
+
+
+def rebuild_indicator_state(conn, timeframe='daily', symbols=None):
+    """
+    Recompute the state from each symbol's full stored history, e.g. after
+    a split or dividend adjusted past prices. symbols=None rebuilds every
+    symbol in stock_bars. Returns the number of symbols rebuilt.
+    """
+    create_indicator_state_table(conn)
+    if symbols is None:
+        symbols = [row[0] for row in conn.execute(
+            "SELECT symbol FROM symbols s WHERE EXISTS "
+            "(SELECT 1 FROM stock_bars WHERE symbol_id = s.id AND timeframe = ?)",
+            (TIMEFRAME_IDS[timeframe],))]
+    symbols = sorted(symbols)
+
+    for i in range(0, len(symbols), REBUILD_CHUNK):
+        chunk = symbols[i:i + REBUILD_CHUNK]
+        df = pd.read_sql_query(f"""
+            SELECT s.symbol, {day_sql('b.day')} AS date, b.close
+            FROM symbols s
+            JOIN stock_bars b ON b.symbol_id = s.id
+            WHERE b.timeframe = ?
+            AND s.symbol IN ({','.join('?' * len(chunk))})
+            AND b.close IS NOT NULL
+            ORDER BY s.symbol, b.day
+        """, conn, params=[TIMEFRAME_IDS[timeframe], *chunk])
+        conn.execute(f"DELETE FROM indicator_state WHERE timeframe = ? AND symbol IN ({','.join('?' * len(chunk))})",
+                     [timeframe, *chunk])
+        state = IndicatorState(chunk)
+        state.fold(*_to_matrix(df, chunk))
+        _save(conn, state, timeframe)
+        conn.commit()
+    return len(symbols)
+
+
+def update_indicator_state(conn, timeframe='daily', rebuild=False):
+    """
+    Fold the bars stored since the last run into indicator_state.
+
+    Each symbol only advances over its new bars (O(1) work per bar). Symbols
+    without state, whose stored close at the state date no longer matches
+    (prices were re-adjusted or deleted), or that got a split or dividend in
+    the new bars are rebuilt from their full history instead. rebuild=True
+    rebuilds everything.
+
+    Returns:
+    dict: symbols advanced, bars folded in, symbols rebuilt
+    """
+    create_indicator_state_table(conn)
+    summary = {'updated': 0, 'bars': 0, 'rebuilt': 0}
+    since = conn.execute("SELECT MIN(date) FROM indicator_state WHERE timeframe = ?", (timeframe,)).fetchone()[0]
+    if rebuild or since is None:
+        summary['rebuilt'] = rebuild_indicator_state(conn, timeframe)
+        return summary
+
+    stale = {row[0] for row in conn.execute(f"""
+        SELECT s.symbol FROM indicator_state s
+        LEFT JOIN symbols sy ON sy.symbol = s.symbol
+        LEFT JOIN stock_bars p
+            ON p.symbol_id = sy.id AND p.timeframe = ? AND p.day = {day_from_sql('s.date')}
+        WHERE s.timeframe = ?
+        AND p.close IS NOT s.close
+    """, (TIMEFRAME_IDS[timeframe], timeframe))}
+
+    new_bars = pd.read_sql_query(f"""
+        SELECT sy.symbol, {day_sql('p.day')} AS date, p.close, p.dividends, p.stock_splits,
+               s.date AS state_date
+        FROM stock_bars p
+        JOIN symbols sy ON sy.id = p.symbol_id
+        LEFT JOIN indicator_state s ON s.symbol = sy.symbol AND s.timeframe = ?
+        WHERE p.timeframe = ?
+        AND p.day > {day_from_sql('?')}
+        AND (s.date IS NULL OR p.day > {day_from_sql('s.date')})
+        AND p.close IS NOT NULL
+        ORDER BY sy.symbol, p.day
+    """, conn, params=(timeframe, TIMEFRAME_IDS[timeframe], since))
+    adjusted = (new_bars['dividends'].fillna(0) != 0) | (new_bars['stock_splits'].fillna(0) != 0)
+    stale |= set(new_bars.loc[adjusted | new_bars['state_date'].isna(), 'symbol'])
+
+    if stale:
+        summary['rebuilt'] = rebuild_indicator_state(conn, timeframe, stale)
+    new_bars = new_bars[~new_bars['symbol'].isin(stale)]
+    if new_bars.empty:
+        return summary
+
+    symbols = list(new_bars['symbol'].unique())
+    current = pd.read_sql_query("SELECT * FROM indicator_state WHERE timeframe = ?", conn, params=(timeframe,))
+    current = current.set_index('symbol').loc[symbols].reset_index()
+
+    state = IndicatorState.from_frame(current)
+    state.fold(*_to_matrix(new_bars, symbols))
+    _save(conn, state, timeframe)
+    conn.commit()
+    summary['updated'] = len(symbols)
+    summary['bars'] = len(new_bars)
+    return summary
+
+
+def load_indicator_state(timeframe='daily', symbols=None, db_path=DB_PATH):
+    """Latest indicator values as a DataFrame indexed by symbol"""
+    conn = get_read_connection(db_path)
+    try:
+        query = "SELECT * FROM indicator_state WHERE timeframe = ?"
+        params = [timeframe]
+        if symbols is not None:
+            query += f" AND symbol IN ({','.join('?' * len(symbols))})"
+            params.extend(symbols)
+        df = pd.read_sql_query(query, conn, params=params)
+    except Exception:
+        # No state yet (update_database has not run since the table was added)
+        df = pd.DataFrame(columns=STATE_COLUMNS)
+    finally:
+        conn.close()
+    return df.set_index('symbol')
+
+
+def state_rsi(state, window, zero_loss_rs=None):
+    """RSI(window) from stored gain/loss averages; zero_loss_rs as in analysis.rsi_2d"""
+    gain = state[f'avg_gain_{window}'].astype(float)
+    loss = state[f'avg_loss_{window}'].astype(float)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        rs = gain / loss
+    if zero_loss_rs is not None:
+        rs = rs.where(loss != 0, zero_loss_rs)
+    return 100 - (100 / (1 + rs))
+
+
+def get_latest_rsi(cube, window=6, period="3mo", zero_loss_rs=None):
+    """
+    RSI(window) on every cube symbol's latest bar, as the screeners'
+    per-ticker calculate_rsi over `period` would give it.
+
+    Read from indicator_state where the state is at the symbol's latest
+    bar; computed with the vectorized engine for the rest.
+    """
+    valid = cube.valid()
+    start = cube.since(period)
+    last = valid.shape[1] - 1 - np.argmax(valid[:, ::-1], axis=1)
+    last_dates = np.asarray(cube.dates[last].strftime('%Y-%m-%d'), dtype=object)
+    # Fewer bars than that and the period's first close change shows in the result
+    enough = valid[:, start:].sum(axis=1) > window
+
+    state = load_indicator_state(cube.timeframe)
+    rsi = state_rsi(state, window, zero_loss_rs) if window in RSI_WINDOWS else pd.Series(dtype=float)
+    state_dates = state['date'].reindex(cube.symbols).to_numpy(dtype=object)
+    from_state = enough & (state_dates == last_dates)
+
+    latest = dict(zip(np.array(cube.symbols, dtype=object)[from_state], rsi.reindex(cube.symbols).to_numpy()[from_state]))
+    rest = np.flatnonzero(~from_state)
+    if len(rest):
+        close = pack_right(cube.field('close')[rest, start:], valid[rest, start:])
+        values = rsi_2d(close, window, zero_loss_rs=zero_loss_rs)[:, -1]
+        latest.update(zip((cube.symbols[i] for i in rest), values))
+    return latest
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Update or rebuild the indicator_state table")
+    parser.add_argument('--timeframe', choices=['daily', 'weekly'], default='daily')
+    parser.add_argument('--rebuild', action='store_true', help="recompute from full history")
+    parser.add_argument('symbols', nargs='*', help="rebuild only these symbols")
+    args = parser.parse_args()
+
+    conn = connect(DB_PATH)
+    if args.symbols:
+        print(f"Rebuilt {rebuild_indicator_state(conn, args.timeframe, args.symbols)} symbols")
+    else:
+        print(update_indicator_state(conn, args.timeframe, rebuild=args.rebuild))
+    conn.close()
@@ -0,0 +1,105 @@
+try:
+    from ..database import TIMEFRAME_IDS, day_sql, symbol_ids
+except ImportError:
+    # Imported as top-level `services` package by the scheduled job scripts
+    from database import TIMEFRAME_IDS, day_sql, symbol_ids
+
+# Trailing volumes kept per (symbol, timeframe); vol_1 is the latest bar's
+TRAILING_VOLUMES = 5
+VOLUME_COLUMNS = [f'vol_{i}' for i in range(1, TRAILING_VOLUMES + 1)]
+LATEST_BAR_COLUMNS = (['symbol', 'timeframe', 'date', 'open', 'high', 'low', 'close', 'volume',
+                       'percentage_change'] + VOLUME_COLUMNS)
+
+
+def create_latest_bars_table(conn):
+    """
+    Create the latest_bars table: each (symbol, timeframe)'s most recent
+    bar plus its trailing volumes, so "latest bar" reads never have to
+    window over the whole history.
+    """
+    conn.execute(f'''
+    CREATE TABLE IF NOT EXISTS latest_bars (
+        symbol TEXT NOT NULL,
+        timeframe TEXT NOT NULL,
+        date TEXT NOT NULL,
+        open REAL,
+        high REAL,
+        low REAL,
+        close REAL,
+        volume INTEGER,
+        percentage_change REAL,
+        {', '.join(f'{column} INTEGER' for column in VOLUME_COLUMNS)},
+        PRIMARY KEY (symbol, timeframe)
+    )
+    ''')
+    conn.execute('''
+    CREATE INDEX IF NOT EXISTS idx_latest_bars_change
+    ON latest_bars(timeframe, percentage_change DESC)
+    ''')
+    conn.commit()
+
+
+def refresh_latest_bars(conn, timeframe, symbols=None):
+    """
+    Rewrite the latest_bars rows of the given symbols.
+
+    Each symbol costs one primary-key range read of its last
+    TRAILING_VOLUMES bars, however long its history is. symbols=None refreshes every symbol
+    (first build); after an ingest pass only the symbols that were updated.
+    Symbols without bars in this timeframe lose their row (on a full
+    refresh, so does every row whose symbol is gone).
+
+    Returns:
+    int: number of rows written
+    """
+    create_latest_bars_table(conn)
+    if symbols is None:
+        ids = dict(conn.execute("SELECT symbol, id FROM symbols"))
+    else:
+        ids = symbol_ids(conn, symbols)
+
+    rows = []
+    removed = []
+    for symbol, symbol_id in ids.items():
+        bars = conn.execute(f"""
+            SELECT {day_sql()}, open, high, low, close, volume
+            FROM stock_bars
+            WHERE symbol_id = ? AND timeframe = ?
+            ORDER BY day DESC
+            LIMIT {TRAILING_VOLUMES}
+        """, (symbol_id, TIMEFRAME_IDS[timeframe])).fetchall()
+        if not bars:
+            removed.append(symbol)
+            continue
+        date, open_, high, low, close, volume = bars[0]
+        # Same NULL-on-zero semantics as computing it in SQL
+        percentage_change = ((close - open_) / open_ * 100) if open_ and close is not None else None
+        volumes = [bar[5] for bar in bars] + [None] * (TRAILING_VOLUMES - len(bars))
+        rows.append((symbol, timeframe, date, open_, high, low, close, volume, percentage_change, *volumes))
+
+    if symbols is None:
+        conn.execute("""
+            DELETE FROM latest_bars
+            WHERE timeframe = ? AND symbol NOT IN (SELECT symbol FROM symbols)
+        """, (timeframe,))
+    else:
+        # Symbols not in the dictionary at all have no bars either
+        removed += [symbol for symbol in dict.fromkeys(symbols) if symbol not in ids]
+    conn.executemany("DELETE FROM latest_bars WHERE symbol = ? AND timeframe = ?",
+                     [(symbol, timeframe) for symbol in removed])
+    conn.executemany(f"""
+        INSERT OR REPLACE INTO latest_bars ({', '.join(LATEST_BAR_COLUMNS)})
+        VALUES ({', '.join('?' * len(LATEST_BAR_COLUMNS))})
+    """, rows)
+    conn.commit()
+    return len(rows)
+
+
+def update_latest_bars(conn, timeframe, symbols):
+    """
+    Refresh after an ingest pass: just `symbols`, or everything if the
+    table has no rows for this timeframe yet.
+    """
+    create_latest_bars_table(conn)
+    built = conn.execute("SELECT EXISTS (SELECT 1 FROM latest_bars WHERE timeframe = ?)", (timeframe,)).fetchone()[0]
+    return refresh_latest_bars(conn, timeframe, symbols if built else None)
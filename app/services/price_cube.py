@@ -0,0 +1,165 @@
+import numpy as np
+import pandas as pd
+try:
+    from ..database import get_read_connection, DB_PATH, TIMEFRAME_IDS, day_sql, to_day
+    from .yfiance_local import Ticker
+    from .history_archive import archived_through, read_archive
+    from .analysis import pack_right
+except ImportError:
+    # Imported as top-level `services` package by the scheduled job scripts
+    from database import get_read_connection, DB_PATH, TIMEFRAME_IDS, day_sql, to_day
+    from services.yfiance_local import Ticker
+    from services.history_archive import archived_through, read_archive
+    from services.analysis import pack_right
+
+FIELDS = ('open', 'high', 'low', 'close', 'volume')
+COLUMNS = ['Open', 'High', 'Low', 'Close', 'Volume']
+
+
+class PriceCube:
+    """
+    Dense in-memory OHLCV history for the whole universe.
+
+    values has shape (symbols, dates, fields) with NaN where a symbol has
+    no bar on a date, so screeners can work on whole arrays instead of
+    running one query and building one DataFrame per ticker.
+
+    Attributes:
+    symbols (list): symbol per row
+    dates (pd.DatetimeIndex): trading dates, ascending
+    values (np.ndarray): float64 array of shape (len(symbols), len(dates), 5)
+    timeframe (str): 'daily' or 'weekly'
+    """
+
+    def __init__(self, symbols, dates, values, timeframe='daily'):
+        self.symbols = list(symbols)
+        self.dates = pd.DatetimeIndex(dates, name='date')
+        self.values = values
+        self.timeframe = timeframe
+        self.index = {symbol: i for i, symbol in enumerate(self.symbols)}
+
+    @classmethod
+    def load(cls, timeframe='daily', period='6mo', bars=None, symbols=None, db_path=DB_PATH):
+        """
+        Load the cube with one scan of stock_bars (plus the Arrow archive
+        for archived years, when the range reaches back into it).
+
+        Parameters:
+        timeframe (str): 'daily' or 'weekly'
+        period (str): yfinance-style period (see Ticker._get_date_range)
+        bars (int): if given, keep only the last `bars` trading dates instead
+        symbols (list): restrict to these symbols (default: everything stored)
+        """
+        conn = get_read_connection(db_path)
+        try:
+            if bars is not None:
+                cursor = conn.execute(f"""
+                    SELECT {day_sql('MIN(day)')} FROM (
+                        SELECT DISTINCT day FROM stock_bars
+                        WHERE timeframe = ?
+                        ORDER BY day DESC
+                        LIMIT ?
+                    )
+                """, (TIMEFRAME_IDS[timeframe], bars))
+                start_date = cursor.fetchone()[0] or '9999-12-31'
+            else:
+                start_date, _ = Ticker._get_date_range(period)
+
+            frames = []
+            _, today = Ticker._get_date_range('1d')
+            through = archived_through(start_date, today, timeframe, None if symbols is None else len(symbols))
+            if through is not None:
+                frames.append(read_archive(symbols, start_date, through, timeframe))
+                start_date = (pd.Timestamp(through) + pd.Timedelta(days=1)).strftime('%Y-%m-%d')
+
+            # Uses idx_stock_bars_day; dates are rendered back to ISO text
+            query = f"""
+                SELECT s.symbol, {day_sql('b.day')} AS date, b.open, b.high, b.low, b.close, b.volume
+                FROM stock_bars b
+                JOIN symbols s ON s.id = b.symbol_id
+                WHERE b.timeframe = ?
+                AND b.day >= ?
+            """
+            params = [TIMEFRAME_IDS[timeframe], to_day(start_date)]
+            if symbols is not None:
+                query += f" AND s.symbol IN ({','.join('?' * len(symbols))})"
+                params.extend(symbols)
+            frames.append(pd.read_sql_query(query, conn, params=params))
+            df = pd.concat(frames, ignore_index=True) if len(frames) > 1 else frames[0]
+        finally:
+            conn.close()
+
+        return cls.from_frame(df, timeframe)
+
+    @classmethod
+    def from_frame(cls, df, timeframe='daily'):
+        """Build a cube from a long frame with symbol, date and OHLCV columns"""
+        symbol_codes, symbols = pd.factorize(df['symbol'], sort=True)
+        date_codes, dates = pd.factorize(pd.to_datetime(df['date']), sort=True)
+
+        values = np.full((len(symbols), len(dates), len(FIELDS)), np.nan)
+        values[symbol_codes, date_codes] = df[list(FIELDS)].to_numpy(dtype=float)
+        return cls(symbols, dates, values, timeframe)
+
+    def __contains__(self, symbol):
+        return symbol in self.index
+
+    def __len__(self):
+        return len(self.symbols)
+
+    def field(self, name):
+        """(symbols, dates) view of one field; no copy"""
+        return self.values[:, :, FIELDS.index(name)]
+
+    def view(self, symbol):
+        """(dates, fields) view of one symbol's rows; no copy"""
+        return self.values[self.index[symbol]]
+
+    def valid(self):
+        """(symbols, dates) mask of the bars that exist"""
+        return ~np.isnan(self.field('close'))
+
+    def packed(self, name, start=0, stop=None):
+        """
+        One field over dates[start:stop] with each symbol's bars shifted to
+        the right edge (NaN-padded on the left), so column -1 is every
+        symbol's latest bar; the input layout of the indicator engine.
+        """
+        return pack_right(self.field(name)[:, start:stop], self.valid()[:, start:stop])
+
+    def since(self, period):
+        """Index of the first date inside a yfinance-style period"""
+        start_date, _ = Ticker._get_date_range(period)
+        return int(self.dates.searchsorted(pd.Timestamp(start_date)))
+
+    def history(self, symbol, period=None):
+        """
+        One symbol as a Ticker.history-style DataFrame (missing bars dropped).
+
+        Returns an empty DataFrame for symbols not in the cube.
+        """
+        if symbol not in self.index:
+            return pd.DataFrame(columns=COLUMNS, index=pd.DatetimeIndex([], name='date'))
+        start = self.since(period) if period else 0
+        rows = self.view(symbol)[start:]
+        mask = ~np.isnan(rows[:, FIELDS.index('close')])
+        return pd.DataFrame(rows[mask], index=self.dates[start:][mask], columns=COLUMNS)
+
+
+_cubes = {}
+
+
+def get_price_cube(timeframe='daily', period='6mo', bars=None):
+    """
+    Load a cube once per process and hand the same object to every caller,
+    so all screeners in a nightly run share a single scan.
+    """
+    key = (timeframe, period, bars)
+    if key not in _cubes:
+        _cubes[key] = PriceCube.load(timeframe=timeframe, period=period, bars=bars)
+    return _cubes[key]
+
+
+def clear_price_cubes():
+    """Drop loaded cubes (call after the database has been updated)"""
+    _cubes.clear()
@@ -0,0 +1,90 @@
+import json
+import math
+
+from .cache import series_cache
+from .stock import get_stock_data
+
+try:
+    import orjson
+except ImportError:  # optional: faster encoding, same output
+    orjson = None
+
+try:
+    import pyarrow as pa
+except ImportError:  # optional: only needed for format=arrow
+    pa = None
+
+TIMEFRAMES = ('daily', 'weekly')
+SERIES_FORMATS = {
+    'json': 'application/json',
+    'arrow': 'application/vnd.apache.arrow.stream',
+}
+PRICE_COLUMNS = ['open', 'high', 'low', 'close']
+INDICATOR_COLUMNS = {
+    'wr': ('indicators', 'wr'),
+    'macd_dif': ('macd', 'dif'),
+    'macd_dea': ('macd', 'dea'),
+    'macd': ('macd', 'macd'),
+}
+
+
+class FormatUnavailable(RuntimeError):
+    """The requested encoding needs an optional package that is not installed"""
+
+
+def _nan_to_none(values):
+    return [None if value is None or (isinstance(value, float) and math.isnan(value)) else value
+            for value in values]
+
+
+def build_series(symbol, timeframe):
+    """
+    One timeframe of the /stockdetail payload as flat columns of equal
+    length: date, OHLCV, wr, macd_dif, macd_dea and macd (NaN -> None).
+    """
+    data = get_stock_data(symbol)[timeframe]
+    columns = {'date': list(data['dates'])}
+    for column in PRICE_COLUMNS + ['volume']:
+        columns[column] = _nan_to_none(data[column])
+    for column, (group, key) in INDICATOR_COLUMNS.items():
+        columns[column] = _nan_to_none(data[group][key])
+    return columns
+
+
+def _to_json(payload):
+    if orjson is not None:
+        return orjson.dumps(payload)
+    return json.dumps(payload, separators=(',', ':'), allow_nan=False).encode()
+
+
+def _to_arrow(columns):
+    if pa is None:
+        raise FormatUnavailable("format=arrow needs pyarrow, which is not installed")
+    fields = {'date': pa.array(columns['date'], type=pa.string()),
+              'volume': pa.array(columns['volume'], type=pa.int64())}
+    for column in PRICE_COLUMNS + list(INDICATOR_COLUMNS):
+        # float32 halves the payload; plenty for charting
+        fields[column] = pa.array(columns[column], type=pa.float32())
+    table = pa.table({name: fields[name] for name in columns})
+    sink = pa.BufferOutputStream()
+    with pa.ipc.new_stream(sink, table.schema) as writer:
+        writer.write_table(table)
+    return sink.getvalue().to_pybytes()
+
+
+@series_cache
+def encode_series(symbol, timeframes, fmt='json'):
+    """
+    Encoded body of /api/stock/{symbol}/series; cached per data version.
+
+    json is {"symbol": ..., "<timeframe>": {column: [...]}} for each
+    requested timeframe; arrow is one IPC stream and takes exactly one
+    timeframe. Returns None if the symbol has no bars at all.
+    """
+    series = {timeframe: build_series(symbol, timeframe) for timeframe in timeframes}
+    if not any(columns['date'] for columns in series.values()):
+        return None
+    if fmt == 'arrow':
+        (columns,) = series.values()
+        return _to_arrow(columns)
+    return _to_json({'symbol': symbol, **series})
@@ -1,55 +1,41 @@
 from typing import List, Dict, Optional
 import pandas as pd
 
-from ..database import get_db_connection, get_database_size
+from ..database import (get_db_connection, get_read_connection, get_database_size, create_compact_schema,
+                        day_sql, to_day, TIMEFRAME_IDS)
 from .analysis import calculate_macd, calculate_wr
+from .latest_bars import VOLUME_COLUMNS
+from .trading_dates import latest_trading_dates
+from .weekly_snapshot import SORT_COLUMNS
 
-from .cache import database_stats_cache, stock_data_cache, top_gainers_cache
+from .cache import database_stats_cache, stock_data_cache, top_gainers_cache, trading_dates_cache, volume_gainers_cache
 
 
 def create_indexes():
-    """Create necessary database indexes"""
-    conn = get_db_connection()
-    with conn:
-        conn.execute("""
-        CREATE INDEX IF NOT EXISTS idx_symbol_timeframe 
-        ON stock_prices(symbol, timeframe, date DESC)
-        """)
-        conn.execute("""
-        CREATE INDEX IF NOT EXISTS idx_weekly_date 
-        ON stock_prices(timeframe, date, symbol)
-        WHERE timeframe = 'weekly'
-        """)
-    conn.close()
-
-
-def create_top_gainers_indexes():
-    """Create indexes for top gainers queries"""
+    """Create necessary database tables and indexes"""
     conn = get_db_connection()
     try:
-        with conn:
-            conn.execute("""
-            CREATE INDEX IF NOT EXISTS idx_weekly_date 
-            ON stock_prices(timeframe, date, symbol)
-            WHERE timeframe = 'weekly'
-            """)
+        # stock_bars is clustered on (symbol_id, timeframe, day); its only
+        # secondary index serves the per-date cross-sections
+        create_compact_schema(conn)
     finally:
         conn.close()
 
 @database_stats_cache
-def get_database_stats(timestamp):
+def get_database_stats():
     """Get cached database statistics"""
-    conn = get_db_connection()
+    conn = get_read_connection()
     try:
-        # For SQLite, using COUNT(*) on rowid is faster than COUNT(*)
+        # stock_bars has no rowid; COUNT(*) walks its smallest index (the
+        # result is cached until the next ingest anyway)
         stats_query = """
         SELECT
-            (SELECT MAX(_ROWID_) FROM stock_prices) as total_records,
-            (SELECT COUNT(DISTINCT symbol)
-             FROM stock_prices
-             WHERE timeframe = 'weekly') as total_stocks
+            (SELECT COUNT(*) FROM stock_bars) as total_records,
+            (SELECT COUNT(*) FROM symbols s
+             WHERE EXISTS (SELECT 1 FROM stock_bars b
+                           WHERE b.symbol_id = s.id AND b.timeframe = ?)) as total_stocks
         """
-        cursor = conn.execute(stats_query)
+        cursor = conn.execute(stats_query, (TIMEFRAME_IDS['weekly'],))
         stats = cursor.fetchone()
         return {
             'total_records': stats[0],
@@ -60,29 +46,21 @@ def get_database_stats(timestamp):
         conn.close()
 
 @top_gainers_cache
-def get_top_gainers_data(timestamp):
+def get_top_gainers_data():
     """Cache top gainers data with optimized queries"""
-    conn = get_db_connection()
+    conn = get_read_connection()
     try:
-        top_stocks_query = """
-        WITH LastWeekData AS (
-            SELECT
-                symbol,
-                open,
-                close,
-                ((close - open) / open * 100) as percentage_change,
-                date,
-                ROW_NUMBER() OVER (PARTITION BY symbol ORDER BY date DESC) as rn
-            FROM stock_prices
-            WHERE timeframe = 'weekly'
-        )
+        # One indexed top-k read of the latest_bars materialization (kept
+        # current by update_database), instead of windowing every weekly row
+        top_stocks_query = f"""
         SELECT
             symbol,
             open,
             close,
-            percentage_change
-        FROM LastWeekData
-        WHERE rn = 1
+            percentage_change,
+            {', '.join(VOLUME_COLUMNS)}
+        FROM latest_bars
+        WHERE timeframe = 'weekly'
         ORDER BY percentage_change DESC
         LIMIT 20
         """
@@ -92,39 +70,16 @@ def get_top_gainers_data(timestamp):
         if current_week_data.empty:
             return []
             
-        symbols_list = "', '".join(current_week_data['symbol'].tolist())
-        volume_query = f"""
-        WITH RankedData AS (
-            SELECT
-                symbol,
-                volume,
-                date,
-                ROW_NUMBER() OVER (PARTITION BY symbol ORDER BY date DESC) as week_num
-            FROM stock_prices
-            WHERE timeframe = 'weekly'
-            AND symbol IN ('{symbols_list}')
-        )
-        SELECT
-            symbol,
-            volume,
-            week_num
-        FROM RankedData
-        WHERE week_num <= 5
-        ORDER BY symbol, week_num
-        """
-        
-        volume_data = pd.read_sql_query(volume_query, conn)
-        volume_pivot = volume_data.pivot(index='symbol', columns='week_num', values='volume')
-        final_data = current_week_data.copy()
+        final_data = current_week_data.drop(columns=VOLUME_COLUMNS)
         
         for i in range(1, 5):
-            if i+1 in volume_pivot.columns:
-                week_current = volume_pivot[i]
-                week_prev = volume_pivot[i+1]
+            week_current = current_week_data[f'vol_{i}']
+            week_prev = current_week_data[f'vol_{i+1}']
+            if week_prev.notnull().any():
                 mask = (week_prev != 0) & week_prev.notnull() & week_current.notnull()
                 pct_change = pd.Series(index=week_current.index, data=0.0)
                 pct_change[mask] = ((week_current[mask] - week_prev[mask]) / week_prev[mask] * 100).round(2)
-                final_data[f'vol_change_week{i}'] = final_data['symbol'].map(pct_change)
+                final_data[f'vol_change_week{i}'] = pct_change
         
         final_data['percentage_change'] = pd.to_numeric(final_data['percentage_change'], errors='coerce')
         final_data = final_data.sort_values('percentage_change', ascending=False)
@@ -137,27 +92,80 @@ def get_top_gainers_data(timestamp):
         conn.close()
 
 
-# @stock_data_cache
-def get_stock_data(symbol: str, timestamp: int):
-    """Cache stock data with LRU cache decorator"""
-    conn = get_db_connection()
+@volume_gainers_cache
+def get_volume_gainers_data():
+    """Top 20 stocks by volume increase over the previous week"""
+    # Latest and previous weekly bar dates from the trading_dates registry
+    latest_date, prev_date = get_trading_date_anchors('weekly')
+    if latest_date is None or prev_date is None:
+        return []
+
+    conn = get_read_connection()
+    try:
+        volume_query = """
+        WITH CurrentWeek AS (
+            SELECT symbol_id, volume, open, close
+            FROM stock_bars
+            WHERE timeframe = ? 
+            AND day = ?
+        ),
+        PrevWeek AS (
+            SELECT symbol_id, volume as prev_volume
+            FROM stock_bars
+            WHERE timeframe = ? 
+            AND day = ?
+        )
+        SELECT 
+            s.symbol,
+            c.open as current_open,
+            c.close as current_close,
+            c.volume as current_volume,
+            p.prev_volume,
+            ROUND(((c.volume - p.prev_volume) * 100.0 / p.prev_volume), 2) as volume_change
+        FROM CurrentWeek c
+        JOIN PrevWeek p ON c.symbol_id = p.symbol_id
+        JOIN symbols s ON s.id = c.symbol_id
+        WHERE p.prev_volume > 0
+        ORDER BY volume_change DESC
+        LIMIT 20
+        """
+        
+        df = pd.read_sql_query(
+            volume_query,
+            conn,
+            params=(TIMEFRAME_IDS['weekly'], to_day(latest_date), TIMEFRAME_IDS['weekly'], to_day(prev_date)),
+            coerce_float=True
+        )
+        
+        df['current_volume'] = df['current_volume'].astype(int)
+        df['prev_volume'] = df['prev_volume'].astype(int)
+        return df.to_dict('records')
+    finally:
+        conn.close()
+
+
+@stock_data_cache
+def get_stock_data(symbol: str):
+    """Cache stock data with TTL cache decorator"""
+    conn = get_read_connection()
     try:
         plot_data = {'daily': {}, 'weekly': {}}
         
         for timeframe in ['daily', 'weekly']:
-            # Modified query to include volume
-            query = """
-                SELECT date, open, high, low, close, volume
-                FROM stock_prices
-                WHERE symbol = ?
+            # Weekend bars are dropped at ingest, so this is a plain
+            # backwards range scan of the stock_bars key that stops after
+            # LIMIT rows
+            query = f"""
+                SELECT {day_sql()}, open, high, low, close, volume
+                FROM stock_bars
+                WHERE symbol_id = (SELECT id FROM symbols WHERE symbol = ?)
                 AND timeframe = ?
-                AND strftime('%w', date) NOT IN ('0', '6')
-                ORDER BY date DESC
+                ORDER BY day DESC
                 LIMIT ?
             """
             
             limit = 120 if timeframe == 'daily' else 104
-            cursor = conn.execute(query, (symbol, timeframe, limit))
+            cursor = conn.execute(query, (symbol, TIMEFRAME_IDS[timeframe], limit))
             rows = cursor.fetchall()
             
             if rows:
@@ -265,20 +273,36 @@ def get_stock_data(symbol: str, timestamp: int):
 
 def get_data_summary():
     """Get summary of data in database"""
-    conn = get_db_connection()
-    counts = pd.read_sql_query('''
+    conn = get_read_connection()
+    # Grouped on the stock_bars key, names joined per group afterwards
+    counts = pd.read_sql_query(f'''
         SELECT 
-            symbol,
-            timeframe,
-            COUNT(*) as count,
-            MIN(date) as start_date,
-            MAX(date) as end_date
-        FROM stock_prices 
-        GROUP BY symbol, timeframe
+            s.symbol,
+            t.name as timeframe,
+            g.count,
+            {day_sql('g.first_day')} as start_date,
+            {day_sql('g.last_day')} as end_date
+        FROM (
+            SELECT symbol_id, timeframe, COUNT(*) as count, MIN(day) as first_day, MAX(day) as last_day
+            FROM stock_bars
+            GROUP BY symbol_id, timeframe
+        ) g
+        JOIN symbols s ON s.id = g.symbol_id
+        JOIN timeframes t ON t.id = g.timeframe
+        ORDER BY s.symbol, t.name
     ''', conn)
     conn.close()
     return counts.to_dict('records')
 
+@trading_dates_cache
+def get_trading_date_anchors(timeframe, count=2):
+    """Latest `count` trading dates of a timeframe, newest first, cached for the cache TTL"""
+    conn = get_read_connection()
+    try:
+        return latest_trading_dates(conn, timeframe, count)
+    finally:
+        conn.close()
+
 def get_filtered_stocks(
     limit: int,
     min_price: float,
@@ -288,94 +312,31 @@ def get_filtered_stocks(
     sort_order: str
 ) -> List[Dict]:
     """Get filtered stocks based on criteria"""
-    conn = get_db_connection()
+    conn = get_read_connection()
     try:
-        date_range_query = """
-        SELECT 
-            MAX(date) as last_week_end,
-            MIN(date) as last_week_start,
-            (SELECT date FROM stock_prices 
-             WHERE symbol = 'AAPL' 
-             AND timeframe = 'weekly'
-             ORDER BY date DESC
-             LIMIT 1 OFFSET 1) as prev_week
-        FROM stock_prices
-        WHERE symbol = 'AAPL'
-        AND timeframe = 'weekly'
-        ORDER BY date DESC
-        LIMIT 1
-        """
-        
-        cursor = conn.cursor()
-        cursor.execute(date_range_query)
-        last_week_end, last_week_start, prev_week = cursor.fetchone()
-        
-        query = """
-        WITH LastWeekData AS (
-            SELECT 
-                symbol,
-                open as week_open,
-                close as week_close,
-                volume as week_volume
-            FROM stock_prices
-            WHERE date = ?
-            AND timeframe = 'weekly'
-        ),
-        PrevWeekData AS (
-            SELECT 
-                symbol,
-                volume as prev_week_volume
-            FROM stock_prices
-            WHERE date = ?
-            AND timeframe = 'weekly'
-        ),
-        CombinedData AS (
-            SELECT 
-                lw.symbol,
-                lw.week_open,
-                lw.week_close,
-                lw.week_volume,
-                CASE 
-                    WHEN pw.prev_week_volume > 0 
-                    THEN ROUND(((lw.week_volume - pw.prev_week_volume) * 100.0 / NULLIF(pw.prev_week_volume, 0)), 2)
-                    ELSE 0 
-                END as volume_change_pct,
-                CASE 
-                    WHEN lw.week_open > 0 
-                    THEN ROUND(((lw.week_close - lw.week_open) * 100.0 / NULLIF(lw.week_open, 0)), 2)
-                    ELSE 0 
-                END as price_change_pct
-            FROM LastWeekData lw
-            JOIN PrevWeekData pw ON lw.symbol = pw.symbol
-            WHERE lw.week_close >= ?
-            AND lw.week_volume >= ?
-        )
+        # weekly_snapshot is rebuilt after each ingest; ordering by a plain
+        # indexed column lets SQLite walk that index instead of sorting
+        sort_column = SORT_COLUMNS[sort_by]
+        query = f"""
         SELECT 
             symbol,
             ROUND(week_open, 2) as week_open,
             ROUND(week_close, 2) as week_close,
             week_volume,
-            COALESCE(volume_change_pct, 0) as volume_change_pct,
-            COALESCE(price_change_pct, 0) as price_change_pct
-        FROM CombinedData
-        WHERE price_change_pct >= ?
-        ORDER BY 
-            CASE ? 
-                WHEN 'volume' THEN week_volume
-                WHEN 'price' THEN week_close
-                WHEN 'volume_change' THEN volume_change_pct
-                WHEN 'price_change' THEN price_change_pct
-            END
-        """ + f" {sort_order} " + """
+            volume_change_pct,
+            price_change_pct
+        FROM weekly_snapshot
+        WHERE week_close >= ?
+        AND week_volume >= ?
+        AND price_change_pct >= ?
+        ORDER BY {sort_column} {sort_order}
         LIMIT ?
         """
+        cursor = conn.cursor()
         cursor.execute(query, (
-            last_week_end,
-            prev_week,
             min_price,
             min_volume,
             min_price_change,
-            sort_by,
             limit
         ))
         
@@ -384,4 +345,3 @@ def get_filtered_stocks(
         
     finally:
         conn.close()
-
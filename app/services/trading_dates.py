@@ -0,0 +1,98 @@
+import sqlite3
+try:
+    from ..database import TIMEFRAME_IDS, day_sql, to_day
+except ImportError:
+    # Imported as top-level `services` package by the scheduled job scripts
+    from database import TIMEFRAME_IDS, day_sql, to_day
+
+TIMEFRAMES = ('daily', 'weekly')
+
+
+def create_trading_dates_table(conn):
+    """
+    Create the trading_dates table: the distinct bar dates stored per
+    timeframe, so "latest week" style anchors are a primary key lookup
+    instead of a probe on one symbol's history.
+
+    Timeframes with no rows yet are backfilled from stock_bars (one index
+    scan, first run only).
+    """
+    conn.execute('''
+    CREATE TABLE IF NOT EXISTS trading_dates (
+        timeframe TEXT NOT NULL,
+        date TEXT NOT NULL,
+        PRIMARY KEY (timeframe, date)
+    ) WITHOUT ROWID
+    ''')
+    for timeframe in TIMEFRAMES:
+        cursor = conn.execute("SELECT EXISTS (SELECT 1 FROM trading_dates WHERE timeframe = ?)", (timeframe,))
+        if not cursor.fetchone()[0]:
+            conn.execute(f"""
+                INSERT OR IGNORE INTO trading_dates (timeframe, date)
+                SELECT DISTINCT ?, {day_sql()} FROM stock_bars WHERE timeframe = ?
+            """, (timeframe, TIMEFRAME_IDS[timeframe]))
+    conn.commit()
+
+
+def record_trading_dates(conn, timeframe, dates):
+    """Register the dates of freshly written bars (no-op for known dates)"""
+    conn.executemany(
+        "INSERT OR IGNORE INTO trading_dates (timeframe, date) VALUES (?, ?)",
+        [(timeframe, date) for date in set(dates)]
+    )
+
+
+def remove_weekend_bars(conn):
+    """
+    Delete the bars dated on a Saturday or Sunday.
+
+    Ingest no longer writes them, so readers need no weekday filter. The
+    weekend dates are found in trading_dates (a few thousand rows), so
+    once the old rows are gone this costs one small scan per run.
+
+    Returns:
+    int: number of bars deleted
+    """
+    weekend = conn.execute("""
+        SELECT timeframe, date FROM trading_dates
+        WHERE strftime('%w', date) IN ('0', '6')
+    """).fetchall()
+    if not weekend:
+        return 0
+    deleted = 0
+    with conn:
+        for timeframe, date in weekend:
+            cursor = conn.execute("DELETE FROM stock_bars WHERE timeframe = ? AND day = ?",
+                                  (TIMEFRAME_IDS[timeframe], to_day(date)))
+            deleted += cursor.rowcount
+            conn.execute("DELETE FROM trading_dates WHERE timeframe = ? AND date = ?", (timeframe, date))
+    return deleted
+
+
+def latest_trading_dates(conn, timeframe='weekly', count=2):
+    """
+    The `count` most recent trading dates of a timeframe, newest first,
+    padded with None when fewer are stored.
+
+    Falls back to the stock_bars day index if update_database has not
+    created the table yet.
+    """
+    try:
+        cursor = conn.execute("""
+            SELECT date FROM trading_dates
+            WHERE timeframe = ?
+            ORDER BY date DESC
+            LIMIT ?
+        """, (timeframe, count))
+    except sqlite3.OperationalError:
+        cursor = conn.execute(f"""
+            SELECT {day_sql()} FROM (
+                SELECT DISTINCT day FROM stock_bars
+                WHERE timeframe = ?
+                ORDER BY day DESC
+                LIMIT ?
+            )
+            ORDER BY 1 DESC
+        """, (TIMEFRAME_IDS[timeframe], count))
+    dates = [row[0] for row in cursor.fetchall()]
+    return tuple(dates + [None] * (count - len(dates)))
@@ -0,0 +1,75 @@
+import asyncio
+import threading
+from collections import Counter
+
+from .cache import data_version
+from .stock import (
+    get_database_stats,
+    get_stock_data,
+    get_top_gainers_data,
+    get_volume_gainers_data
+)
+
+WARMUP_POLL_SECONDS = 30   # how often a worker checks for a new data version
+WARMUP_DETAIL_SYMBOLS = 20  # most-viewed /stockdetail payloads to precompute
+
+# /stockdetail views served by this worker
+_views = Counter()
+_views_lock = threading.Lock()
+
+
+def record_view(symbol):
+    """Count a /stockdetail view (picks the payloads warm_caches precomputes)"""
+    with _views_lock:
+        _views[symbol] += 1
+
+
+def most_viewed(n=WARMUP_DETAIL_SYMBOLS):
+    with _views_lock:
+        return [symbol for symbol, _ in _views.most_common(n)]
+
+
+def warm_caches(detail_symbols=WARMUP_DETAIL_SYMBOLS):
+    """
+    Precompute the cached payloads behind `/`, `/top-gainers`,
+    `/volume-gainers` and the most-viewed `/stockdetail` pages, so the
+    first visitor after an ingest does not pay the cold queries.
+
+    The detail pages warmed are this worker's most viewed symbols, topped
+    up with the current top gainers.
+
+    Returns:
+    int: number of payloads computed
+    """
+    get_database_stats()
+    top_gainers = get_top_gainers_data()
+    get_volume_gainers_data()
+
+    symbols = most_viewed(detail_symbols)
+    for row in top_gainers:
+        if len(symbols) >= detail_symbols:
+            break
+        if row['symbol'] not in symbols:
+            symbols.append(row['symbol'])
+    for symbol in symbols:
+        get_stock_data(symbol)
+    return 3 + len(symbols)
+
+
+async def keep_caches_warm(poll_seconds=WARMUP_POLL_SECONDS):
+    """
+    Background task for each web worker: warm the caches at startup and
+    again whenever update_database publishes a new data version.
+    """
+    warmed_version = None
+    while True:
+        version = data_version()
+        if version != warmed_version:
+            try:
+                count = await asyncio.to_thread(warm_caches)
+                print(f"Warmed {count} cached payloads for data version {version}")
+            except Exception as e:
+                print(f"Error warming caches: {str(e)}")
+            # Not retried on error: requests will fill the caches instead
+            warmed_version = version
+        await asyncio.sleep(poll_seconds)
@@ -0,0 +1,90 @@
+try:
+    from ..database import TIMEFRAME_IDS, day_sql, to_day
+    from .trading_dates import latest_trading_dates
+except ImportError:
+    # Imported as top-level `services` package by the scheduled job scripts
+    from database import TIMEFRAME_IDS, day_sql, to_day
+    from services.trading_dates import latest_trading_dates
+
+# sort_by value of /api/filtered_stocks -> indexed weekly_snapshot column
+SORT_COLUMNS = {
+    'volume': 'week_volume',
+    'price': 'week_close',
+    'volume_change': 'volume_change_pct',
+    'price_change': 'price_change_pct',
+}
+
+
+def create_weekly_snapshot_table(conn):
+    """
+    Create the weekly_snapshot table: the latest week's open, close, volume
+    and week-over-week changes per symbol, with an index on every column
+    the stock filter sorts by.
+    """
+    conn.execute('''
+    CREATE TABLE IF NOT EXISTS weekly_snapshot (
+        symbol TEXT PRIMARY KEY,
+        date TEXT NOT NULL,
+        week_open REAL,
+        week_close REAL,
+        week_volume INTEGER,
+        prev_week_volume INTEGER,
+        volume_change_pct REAL,
+        price_change_pct REAL
+    )
+    ''')
+    for column in SORT_COLUMNS.values():
+        conn.execute(f'''
+        CREATE INDEX IF NOT EXISTS idx_weekly_snapshot_{column}
+        ON weekly_snapshot({column})
+        ''')
+    conn.commit()
+
+
+def refresh_weekly_snapshot(conn):
+    """
+    Rebuild weekly_snapshot from the last two weekly trading dates.
+
+    Symbols need a bar in both weeks. The changes are computed as the old
+    per-request query did: rounded to 2 places, 0 when the previous volume
+    or the open is not positive. The table is swapped in one transaction,
+    so readers see either the old or the new snapshot.
+
+    Returns:
+    int: number of symbols in the snapshot
+    """
+    create_weekly_snapshot_table(conn)
+    last_week, prev_week = latest_trading_dates(conn, 'weekly', 2)
+    if last_week is None or prev_week is None:
+        return 0
+
+    with conn:
+        conn.execute("DELETE FROM weekly_snapshot")
+        cursor = conn.execute(f"""
+            INSERT INTO weekly_snapshot
+                (symbol, date, week_open, week_close, week_volume, prev_week_volume,
+                 volume_change_pct, price_change_pct)
+            SELECT
+                s.symbol,
+                {day_sql('lw.day')},
+                lw.open,
+                lw.close,
+                lw.volume,
+                pw.volume,
+                CASE
+                    WHEN pw.volume > 0
+                    THEN COALESCE(ROUND(((lw.volume - pw.volume) * 100.0 / NULLIF(pw.volume, 0)), 2), 0)
+                    ELSE 0
+                END,
+                CASE
+                    WHEN lw.open > 0
+                    THEN COALESCE(ROUND(((lw.close - lw.open) * 100.0 / NULLIF(lw.open, 0)), 2), 0)
+                    ELSE 0
+                END
+            FROM stock_bars lw
+            JOIN stock_bars pw
+              ON pw.symbol_id = lw.symbol_id AND pw.timeframe = lw.timeframe AND pw.day = ?
+            JOIN symbols s ON s.id = lw.symbol_id
+            WHERE lw.timeframe = ? AND lw.day = ?
+        """, (to_day(prev_week), TIMEFRAME_IDS['weekly'], to_day(last_week)))
+    return cursor.rowcount
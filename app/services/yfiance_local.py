@@ -1,30 +1,39 @@
-import sqlite3
 from datetime import datetime, timedelta
 import pandas as pd
+try:
+    from ..database import get_read_connection, TIMEFRAME_IDS, day_sql, to_day
+    from .history_archive import archived_through, read_archive
+except ImportError:
+    # Imported as top-level `services` package by the scheduled job scripts
+    from database import get_read_connection, TIMEFRAME_IDS, day_sql, to_day
+    from services.history_archive import archived_through, read_archive
+
+DB_PATH = 'static/stock_data.db'
+PRICE_COLUMNS = ['Open', 'High', 'Low', 'Close', 'Volume', 'Dividends', 'Stock Splits']
+# Stay under SQLite's bound-parameter limit on older builds (999)
+MAX_SYMBOLS_PER_QUERY = 900
 
 class Ticker:
     def __init__(self, symbol):
         self.symbol = symbol.upper()
-        self.db_path = 'static/stock_data.db'
-        
-        # Verify that the symbol exists in the database
-        if not self._symbol_exists():
-            return None
-            #raise ValueError(f"Symbol {self.symbol} not found in local database")
+        self.db_path = DB_PATH
+        # No existence probe here: history() returns [] for unknown symbols,
+        # so checking up front only cost an extra query per ticker.
     
     def _symbol_exists(self):
-        """Check if the symbol exists in the database"""
-        conn = sqlite3.connect(self.db_path)
+        """Check if the symbol exists in the database (stops at the first index hit)"""
+        conn = get_read_connection(self.db_path)
         cursor = conn.cursor()
         cursor.execute(
-            "SELECT COUNT(*) FROM stock_prices WHERE symbol = ?", 
+            "SELECT EXISTS (SELECT 1 FROM symbols WHERE symbol = ?)", 
             (self.symbol,)
         )
-        count = cursor.fetchone()[0]
+        exists = cursor.fetchone()[0]
         conn.close()
-        return count > 0
+        return bool(exists)
     
-    def _get_date_range(self, period):
+    @staticmethod
+    def _get_date_range(period):
         """Convert period string to start and end dates"""
         end_date = datetime.now()
         
@@ -60,49 +69,85 @@ class Ticker:
         Returns:
         - pandas DataFrame with historical data
         """
-        if interval not in ["1d", "1wk"]:
-            raise ValueError("Only daily interval ('1d') is supported in this version")
+        start_date, end_date, timeframe = _resolve_query(period, interval, start, end)
             
-        conn = sqlite3.connect(self.db_path)
-        
-        # Use provided dates or calculate from period
-        if start is None or end is None:
-            start_date, end_date = self._get_date_range(period)
-        else:
-            start_date, end_date = start, end
-
-        # Map interval to timeframe
-        timeframe = 'daily' if interval == '1d' else 'weekly'
-            
-        query = """
-        SELECT date, open, high, low, close, volume, dividends, stock_splits
-        FROM stock_prices
-        WHERE symbol = ?
-        AND date BETWEEN ? AND ?
-        AND timeframe = ?
-        ORDER BY date ASC
-        """
-        
-        df = pd.read_sql_query(
-            query, 
-            conn, 
-            params=(self.symbol, start_date, end_date, timeframe),
-            parse_dates=['date']
-        )
-        conn.close()
+        conn = get_read_connection(self.db_path)
+        try:
+            df = _read_prices(conn, [self.symbol], start_date, end_date, timeframe)
+        finally:
+            conn.close()
         
         if df.empty:
             return []
             #raise ValueError(f"No data found for {self.symbol} in specified date range")
             
         # Set date as index to match yfinance format
-        df.set_index('date', inplace=True)
+        df = df.drop(columns='symbol').set_index('date')
         
         # Ensure column names match yfinance format
-        df.columns = ['Open', 'High', 'Low', 'Close', 'Volume', 'Dividends', 'Stock Splits']
+        df.columns = PRICE_COLUMNS
         
         return df
 
+def _resolve_query(period, interval, start, end):
+    """Turn yfinance-style arguments into (start_date, end_date, timeframe)"""
+    if interval not in ["1d", "1wk"]:
+        raise ValueError("Only daily interval ('1d') is supported in this version")
+
+    # Use provided dates or calculate from period
+    if start is None or end is None:
+        start_date, end_date = Ticker._get_date_range(period)
+    else:
+        start_date, end_date = start, end
+
+    # Map interval to timeframe
+    timeframe = 'daily' if interval == '1d' else 'weekly'
+    return start_date, end_date, timeframe
+
+def _read_prices(conn, symbols, start_date, end_date, timeframe):
+    """
+    Read bars for several symbols on one connection.
+
+    Returns a long frame (symbol, date, open, ..., stock_splits) ordered by
+    symbol, date. Whole-universe reads take the archived
+    years from the Arrow archive (services/history_archive.py) and only
+    the rest from SQLite.
+    """
+    through = archived_through(start_date, end_date, timeframe, len(symbols))
+    if through is None:
+        return _read_sqlite(conn, symbols, start_date, end_date, timeframe)
+
+    frames = [read_archive(symbols, start_date, min(str(end_date)[:10], through), timeframe)]
+    if str(end_date)[:10] > through:
+        after = (pd.Timestamp(through) + pd.Timedelta(days=1)).strftime('%Y-%m-%d')
+        frames.append(_read_sqlite(conn, symbols, after, end_date, timeframe))
+    df = pd.concat(frames, ignore_index=True)
+    return df.sort_values(['symbol', 'date'], kind='stable', ignore_index=True)
+
+def _read_sqlite(conn, symbols, start_date, end_date, timeframe):
+    """_read_prices from stock_bars: one `symbol IN (...)` query per MAX_SYMBOLS_PER_QUERY symbols"""
+    frames = []
+    for i in range(0, len(symbols), MAX_SYMBOLS_PER_QUERY):
+        chunk = symbols[i:i + MAX_SYMBOLS_PER_QUERY]
+        placeholders = ','.join('?' * len(chunk))
+        query = f"""
+        SELECT s.symbol, {day_sql('b.day')} AS date, b.open, b.high, b.low, b.close,
+               b.volume, b.dividends, b.stock_splits
+        FROM symbols s
+        JOIN stock_bars b ON b.symbol_id = s.id
+        WHERE s.symbol IN ({placeholders})
+        AND b.timeframe = ?
+        AND b.day BETWEEN ? AND ?
+        ORDER BY s.symbol, b.day ASC
+        """
+        frames.append(pd.read_sql_query(
+            query,
+            conn,
+            params=(*chunk, TIMEFRAME_IDS[timeframe], to_day(start_date), to_day(end_date)),
+            parse_dates=['date']
+        ))
+    return pd.concat(frames, ignore_index=True) if len(frames) > 1 else frames[0]
+
 # Function to mimic yfinance's download functionality
 def download(tickers, period="1mo", interval="1d", start=None, end=None):
     """
@@ -117,26 +162,33 @@ def download(tickers, period="1mo", interval="1d", start=None, end=None):
     
     Returns:
     - pandas DataFrame with MultiIndex (ticker, field)
+
+    All tickers are read with one query on a single connection.
     """
     if isinstance(tickers, str):
         tickers = tickers.split()
-        
-    all_data = {}
-    for ticker in tickers:
-        try:
-            stock = Ticker(ticker)
-            all_data[ticker] = stock.history(period=period, interval=interval, 
-                                          start=start, end=end)
-        except ValueError as e:
-            print(f"Error fetching {ticker}: {str(e)}")
-            continue
-    
-    if not all_data:
+    tickers = list(dict.fromkeys(ticker.upper() for ticker in tickers))
+
+    start_date, end_date, timeframe = _resolve_query(period, interval, start, end)
+    conn = get_read_connection(DB_PATH)
+    try:
+        df = _read_prices(conn, tickers, start_date, end_date, timeframe)
+    finally:
+        conn.close()
+
+    if df.empty:
         raise ValueError("No data fetched for any tickers")
-        
+
+    df.columns = ['symbol', 'date'] + PRICE_COLUMNS
+
     if len(tickers) == 1:
-        return list(all_data.values())[0]
-        
-    # Combine all DataFrames into a single DataFrame with MultiIndex
-    combined_data = pd.concat(all_data, axis=1, keys=all_data.keys())
-    return combined_data
\ No newline at end of file
+        return df.drop(columns='symbol').set_index('date')
+
+    # Pivot into a DataFrame with MultiIndex (ticker, field), in request order
+    present = set(df['symbol'])
+    fetched = [ticker for ticker in tickers if ticker in present]
+    combined_data = df.pivot(index='date', columns='symbol', values=PRICE_COLUMNS)
+    combined_data = combined_data.swaplevel(axis=1).reindex(
+        columns=pd.MultiIndex.from_product([fetched, PRICE_COLUMNS])
+    )
+    return combined_data
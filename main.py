@@ -13,9 +13,11 @@ from fastapi.staticfiles import StaticFiles
 from starlette.middleware.sessions import SessionMiddleware  # Changed import
 from app.api.endpoints import scheduler
 from app.api.endpoints import db_scheduler
+from app.services.warmup import keep_caches_warm
 
 from typing import Optional
 from contextlib import asynccontextmanager
+import asyncio
 
 
 @asynccontextmanager
@@ -25,7 +27,10 @@ async def lifespan(app: FastAPI):
     db_scheduler.schedule_task()
 
     print('Starting scheduled jobs')
+    # Re-warm the page caches whenever an ingest publishes a new data version
+    warmer = asyncio.create_task(keep_caches_warm())
     yield
+    warmer.cancel()
     # Shutdown: Cleanup both schedulers
     if scheduler.scheduler.running:
         scheduler.scheduler.shutdown()
@@ -0,0 +1,96 @@
+"""
+Parity of the vectorized indicator engine (app/services/analysis.py) with
+the per-series pandas formulas the screening and chart scripts used
+before they moved onto it.
+"""
+import numpy as np
+import pandas as pd
+import pytest
+
+from app.services.analysis import (EMA_RIBBON_SPANS, add_indicators, calculate_macd, calculate_wr,
+                                   compute_indicators, ema)
+
+N_SYMBOLS = 50
+N_BARS = 130
+
+
+def reference_indicators(data):
+    """The scripts' original pandas helpers, column for column"""
+    close, high, low = data['Close'], data['High'], data['Low']
+    columns = {f'EMA_{span}': close.ewm(span=span, adjust=False).mean() for span in EMA_RIBBON_SPANS}
+    macd = close.ewm(span=12, adjust=False).mean() - close.ewm(span=26, adjust=False).mean()
+    signal = macd.ewm(span=9, adjust=False).mean()
+    columns.update(MACD=macd, MACD_signal=signal, MACD_hist=2 * (macd - signal))
+    delta = close.diff()
+    for window in (6, 12, 24):
+        gain = (delta.where(delta > 0, 0)).rolling(window=window).mean()
+        loss = (-delta.where(delta < 0, 0)).rolling(window=window).mean()
+        columns[f'RSI_{window}'] = 100 - (100 / (1 + gain / loss))
+    for window in (6, 10):
+        highest_high = high.rolling(window=window).max()
+        lowest_low = low.rolling(window=window).min()
+        columns[f'WR_{window}'] = (highest_high - close) / (highest_high - lowest_low) * 100
+    low_min = low.rolling(window=9, min_periods=1).min()
+    high_max = high.rolling(window=9, min_periods=1).max()
+    kdj_k = 100 * ((close - low_min) / (high_max - low_min))
+    kdj_d = kdj_k.rolling(window=3, min_periods=1).mean()
+    columns.update(kdj_k=kdj_k, kdj_d=kdj_d, kdj_j=3 * kdj_k - 2 * kdj_d)
+    return columns
+
+
+@pytest.fixture(scope='module')
+def bars():
+    """Random walks with ragged NaN padding on the left, as pack_right gives them"""
+    rng = np.random.default_rng(0)
+    close = 50 + np.cumsum(rng.normal(0, 1, (N_SYMBOLS, N_BARS)), axis=1)
+    high = close + rng.uniform(0, 2, close.shape)
+    low = close - rng.uniform(0, 2, close.shape)
+    starts = rng.integers(0, N_BARS // 2, N_SYMBOLS)
+    for i, start in enumerate(starts):
+        close[i, :start] = high[i, :start] = low[i, :start] = np.nan
+    return close, high, low, starts
+
+
+def assert_matches(name, actual, expected):
+    actual = np.asarray(actual, dtype=float)
+    expected = np.asarray(expected, dtype=float)
+    assert np.array_equal(np.isnan(actual), np.isnan(expected)), name
+    if len(expected):
+        assert np.nanmax(np.abs(actual - expected)) < 1e-8, name
+
+
+def test_compute_indicators_matches_pandas(bars):
+    close, high, low, starts = bars
+    result = compute_indicators(close, high, low)
+    for i, start in enumerate(starts):
+        data = pd.DataFrame({'Close': close[i, start:], 'High': high[i, start:], 'Low': low[i, start:]})
+        expected = reference_indicators(data)
+        for k, span in enumerate(EMA_RIBBON_SPANS):
+            assert_matches(f'EMA_{span}', result['ema'][k, i, start:], expected[f'EMA_{span}'])
+        for key, column in [('macd', 'MACD'), ('macd_signal', 'MACD_signal'), ('macd_hist', 'MACD_hist'),
+                            ('rsi_6', 'RSI_6'), ('rsi_12', 'RSI_12'), ('rsi_24', 'RSI_24'),
+                            ('wr_6', 'WR_6'), ('wr_10', 'WR_10'),
+                            ('kdj_k', 'kdj_k'), ('kdj_d', 'kdj_d'), ('kdj_j', 'kdj_j')]:
+            assert_matches(key, result[key][i, start:], expected[column])
+            # The padding stays NaN
+            assert np.isnan(result[key][i, :start]).all(), key
+
+
+def test_series_helpers_match_pandas(bars):
+    close, high, low, starts = bars
+    for i, start in enumerate(starts[:10]):
+        index = pd.date_range('2024-01-01', periods=N_BARS - start, freq='B')
+        data = pd.DataFrame({'Close': close[i, start:], 'High': high[i, start:], 'Low': low[i, start:],
+                             'Volume': 1.0}, index=index)
+        expected = reference_indicators(data)
+
+        add_indicators(data)
+        for column, values in expected.items():
+            assert_matches(column, data[column], values)
+
+        assert ema(data['Close'], 5).index.equals(index)
+        assert_matches('ema', ema(data['Close'], 5), expected['EMA_5'])
+        for name, series in zip(('MACD', 'MACD_signal', 'MACD_hist'), calculate_macd(data['Close'])):
+            assert series.index.equals(index)
+            assert_matches(name, series, expected[name])
+        assert_matches('WR_10', calculate_wr(data['Close'], data['High'], data['Low'], 10), expected['WR_10'])